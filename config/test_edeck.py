@@ -4,7 +4,7 @@ name = 'edeck缓存测试'
 describe = '当前策略用于edeck测试'
 
 modules = {
-    'io/hw_edeck': {'bus_num': 0, 'bus_speed': 500},
+    'io/hw_edeck': {'bus_num': 0, 'bus_speed': 500, 'trace': True},     # 输出逐帧的读写信息
     'tools/analyze': {}
 }
 
@@ -8,7 +8,7 @@ modules = {
     'tools/analyze~2': {},
     'tools/sniffer~1': {'bus': 'sniffer1'},
     'tools/sniffer~2': {'bus': 'sniffer2'},
-    'tools/filter': {},
+    'tools/filter': {'trace': True},        # 输出每一个被拦截的数据帧
 }
 
 actions = [
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import threading
+
+from frame.kernel.clock import get_clock
+from frame.kernel.engine import L6Engine
+from frame.kernel.module import CANModule
+from frame.kernel.stats import EngineStats
+from frame.message.can import CANSploitMessage
+
+
+class AsyncWaker:
+
+    """
+    异步引擎使用的唤醒器，接口与`waker.EventWaker`的`notify`一致，模块可以在任意线程中调用`notify`。
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        self._event = asyncio.Event()
+
+    def notify(self):
+        """唤醒正在`wait`中的主循环，可以在任意线程中调用。"""
+        if threading.get_ident() == self._thread_id:
+            self._event.set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                pass        # 事件循环已经关闭
+
+    async def wait(self, timeout=None):
+        """等待事件的发生。
+
+        :param float timeout: 最长等待的秒数，None表示一直等待。
+
+        :return: 被事件唤醒返回True，超时返回False。
+        :rtype: bool
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+
+class AsyncL6Engine(L6Engine):
+
+    """
+    基于`asyncio`的引擎。所有动作在一个事件循环中依次执行，模块可以通过重写`do_effect_async`,
+    `do_start_async`,`do_stop_async`等异步回调在等待IO时让出事件循环，从而在一个线程中同时驱动多个总线与
+    TCP连接。没有重写异步回调的模块依然按照同步的方式执行。
+
+    模块通过`get_fileno`返回的文件描述符由事件循环监听，可读时唤醒主循环。异步引擎只支持'loop'执行模式，
+    默认的调度模式为'event'，调度模式为'poll'时每一轮之间只让出一次事件循环。
+    """
+
+    def __init__(self, params={}):
+        self._loop = None
+        self._async_modules = set()
+        self._started = threading.Event()
+        self._start_error = None
+        params = dict(params)
+        params.setdefault('schedule', 'event')
+        super().__init__(params)
+
+    def _load_engine_params(self, params):
+        super()._load_engine_params(params)
+        if self._mode != 'loop':
+            raise ValueError("异步引擎不支持执行模式 '{}'.".format(self._mode))
+
+    def _load_module(self, module, init_params, strategy):
+        # 通过初始化参数告知模块运行在异步引擎中，模块可以据此推迟创建线程等资源
+        init_params = dict(init_params)
+        init_params['async_engine'] = True
+        super()._load_module(module, init_params, strategy)
+
+    def reload_config(self, fullpath=None, modules=()):
+        if not self._stop.is_set():
+            raise ValueError("异步引擎运行时不支持热加载，请先停止引擎.")
+        return super().reload_config(fullpath, modules)
+
+    @staticmethod
+    def _overrides(module, method):
+        """模块是否重写了`CANModule`中的异步回调。"""
+        return getattr(type(module), method, None) is not getattr(CANModule, method)
+
+    def start_loop(self):
+        """启动事件循环线程，并在事件循环中执行各个模块的启动回调。
+
+        :return: 引擎的状态。
+        :rtype: bool
+        """
+        self.info("准备启动主处理线程")
+        with self._lifecycle:
+            if not self._stop.is_set():
+                return True
+            if self._stats_enabled and self._stats is None:
+                self._stats = EngineStats(self._actions)
+            self._schedules = {}
+            self._started.clear()
+            self._start_error = None
+            self._thread = threading.Thread(target=self.main_loop, name='engine')
+            self._thread.daemon = True
+
+            self._stop.clear()
+            self.do_stop_e.clear()
+            self.info("启动主线程")
+            self._thread.start()
+            self._started.wait()
+            if self._start_error is not None:
+                self._thread.join()
+                self._thread = None
+                self._stop.set()
+                raise self._start_error
+            self.info("主线程启动完毕")
+        return not self._stop.is_set()
+
+    def main_loop(self):
+        """事件循环线程的入口。"""
+        asyncio.run(self._main_loop_async())
+
+    async def _main_loop_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._waker = AsyncWaker(self._loop)
+        filenos = []
+        try:
+            for name, module, params in self._actions:
+                self.info("启动模块: " + name)
+                module.bind_waker(self._waker)
+                module._batch_size = self._batch
+                await module.start_async(params)
+            # 事件循环监听模块的文件描述符
+            for name, module, params in self._actions:
+                fileno = module.get_fileno(params) if module.is_active else None
+                if fileno is not None and fileno not in filenos:
+                    self._loop.add_reader(fileno, self._waker.notify)
+                    filenos.append(fileno)
+        except Exception as e:
+            self._start_error = e
+            await self._stop_modules_async(filenos)
+            self._started.set()
+            return
+
+        self._async_modules = set()
+        for name, module, params in self._actions:
+            method = 'do_effect_batch_async' if self._batch > 0 else 'do_effect_async'
+            if self._overrides(module, method):
+                self._async_modules.add(id(module))
+        self._started.set()
+
+        virtual = get_clock().virtual
+        while not self.do_stop_e.is_set():
+            pipes = {}
+            await self._run_pass_async(self._actions, pipes)
+
+            if self._schedule == 'event':
+                timeout = self._idle_wait_time(pipes, self._actions)
+                if timeout is not None:
+                    await self._waker.wait(timeout)
+                    continue
+            elif virtual:
+                self._advance_virtual(pipes, self._actions)
+            await asyncio.sleep(0)
+
+        self.info("主循环停止")
+        await self._stop_modules_async(filenos)
+        self.info("停止完成")
+
+    async def _stop_modules_async(self, filenos):
+        for fileno in filenos:
+            self._loop.remove_reader(fileno)
+        for name, module, params in self._actions:
+            self.info("停止模块: " + name)
+            await module.stop_async(params)
+            module.bind_waker(None)
+        self._waker = None
+        self._loop = None
+
+    async def _run_pass_async(self, actions, pipes):
+        """依次执行一轮动作，重写了异步回调的模块在事件循环中等待执行结果。
+
+        :param list actions: 要执行的动作列表。
+        :param dict pipes: 本轮循环的管道变量，执行后保存了各个管道的结果。
+        """
+        batch = self._batch > 0
+        stats = self._stats
+        for action in actions:
+            name, module, params = action
+            if not module.is_active:
+                continue
+            if 'schedule' in params and not self._action_schedule(params).ready(pipes.get(params['pipe'])):
+                continue
+            pipe_name = params['pipe']
+            if pipe_name not in pipes:
+                pipes[pipe_name] = [] if batch else CANSploitMessage()
+            if stats is not None:
+                frames_in = self._count_frames(pipes[pipe_name])
+                t0 = time.perf_counter_ns()
+
+            with module._thr_block:
+                if stats is not None:
+                    t1 = time.perf_counter_ns()
+                if id(module) in self._async_modules:
+                    if batch:
+                        pipes[pipe_name] = await module.do_batch_async(pipes[pipe_name], params)
+                    else:
+                        pipes[pipe_name] = await module.do_async(pipes[pipe_name], params)
+                elif batch:
+                    pipes[pipe_name] = module.do_batch(pipes[pipe_name], params)
+                else:
+                    pipes[pipe_name] = module.do(pipes[pipe_name], params)
+
+            if stats is not None:
+                action_stats = stats.get(action)
+                if action_stats is not None:
+                    action_stats.calls += 1
+                    action_stats.frames_in += frames_in
+                    action_stats.frames_out += self._count_frames(pipes[pipe_name])
+                    action_stats.block_wait += t1 - t0
+                    action_stats.latency.record(time.perf_counter_ns() - t1)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from frame.kernel.clock import get_clock
+from frame.message.can import CANSploitMessage
+from frame.utils.replay import iter_dump
+
+
+class BatchRunner:
+
+    """
+    无界面的批处理模式。在调用线程中按照动作列表逐轮执行，每一轮开始时从转储文件中读取数据帧放入输入管道，
+    不按照文件中的时间戳等待，以最快的速度处理整个文件，读取到文件末尾后停止。
+
+    * 输入管道默认为第一个动作的管道，批量管道模式下每轮最多放入`batch`个数据帧。
+    * 每一轮结束时携带数据的管道变量写入输出目录中的`pipe_<管道名称>.dump`，格式与`Replay.save_dump`相同，
+      时间戳为本轮输入数据帧的时间戳。
+    * 运行期间开启动作统计，结束后统计信息保存到输出目录中的`stats.json`。
+    * 使用虚拟时钟(引擎参数`clock`为'virtual')时，每一轮开始前按照输入数据帧的时间戳推进时钟，模块看到的时间与
+      抓包时一致，结果是确定的。时间戳变小(文件中的多段抓包)时从当前时间继续推进。
+    """
+
+    def __init__(self, engine, input_path, output_dir=None, pipe=None, bus='dump', drain=1000):
+        """
+        :param L6Engine engine: 已经加载了策略的引擎。
+        :param str input_path: 转储文件的路径。
+        :param str output_dir: 输出目录，None表示不输出。
+        :param pipe: 输入管道的名称，None表示第一个动作的管道。
+        :param str bus: 输入数据帧的总线名称。
+        :param int drain: 文件读取完毕后，管道中依然有数据时最多继续执行的轮数。
+
+        :raises ValueError: 策略中没有动作、输入管道不存在或者执行模式不支持。
+        """
+        if not engine.actions:
+            raise ValueError("策略中没有任何动作.")
+        if engine._mode == 'multiprocess':
+            raise ValueError("批处理模式不支持执行模式 'multiprocess'.")
+        self._engine = engine
+        self._input_path = input_path
+        self._output_dir = output_dir
+        self._bus = bus
+        self._drain = max(0, int(drain))
+        self._files = {}
+        self.pipe = self._find_pipe(pipe)
+        self.frames = 0
+        self.elapsed = 0.0
+        self._last_stamp = None
+
+    def _find_pipe(self, pipe):
+        actions = self._engine.actions
+        if pipe is None:
+            return actions[0][2]['pipe']
+        for name, module, params in actions:
+            if str(params['pipe']) == str(pipe):
+                return params['pipe']
+        raise ValueError("管道 '{}' 不存在.".format(pipe))
+
+    def _read_pass(self, frames):
+        """读取一轮的输入。
+
+        :return: (时间戳, 管道变量)，文件结束时返回None。
+        :rtype: tuple
+        """
+        engine = self._engine
+        if engine._batch > 0:
+            batch = []
+            time_stamp = -1.0
+            for time_stamp, can_msg in frames:
+                batch.append(can_msg)
+                if len(batch) >= engine._batch:
+                    break
+            if not batch:
+                return None
+            self.frames += len(batch)
+            return time_stamp, batch
+        for time_stamp, can_msg in frames:
+            self.frames += 1
+            return time_stamp, can_msg
+        return None
+
+    def _advance_clock(self, time_stamp):
+        """虚拟时钟下按照数据帧的时间戳推进时钟。"""
+        clock = get_clock()
+        if not clock.virtual or time_stamp < 0:
+            return
+        if self._last_stamp is not None and time_stamp > self._last_stamp:
+            clock.advance(time_stamp - self._last_stamp)
+        self._last_stamp = time_stamp
+
+    def _write_pipes(self, time_stamp, pipes):
+        """将携带数据的管道变量写入输出目录。"""
+        prefix = ("[" + str(time_stamp) + "]") if time_stamp >= 0.0 else ""
+        for pipe_name, item in pipes.items():
+            for can_msg in (item if isinstance(item, list) else (item,)):
+                if not can_msg.CANData:
+                    continue
+                f = self._files.get(pipe_name)
+                if f is None:
+                    path = os.path.join(self._output_dir, 'pipe_{}.dump'.format(pipe_name))
+                    f = self._files[pipe_name] = open(path, 'w')
+                f.write(prefix + can_msg.CANFrame.get_text() + "\n")
+
+    def run(self):
+        """处理整个转储文件。
+
+        :return: 统计信息，格式与`L6Engine.get_stats`相同，并增加了'frames'(输入的数据帧数量)与'elapsed'(秒)。
+        :rtype: dict
+        """
+        engine = self._engine
+        actions = engine.actions
+        if self._output_dir:
+            os.makedirs(self._output_dir, exist_ok=True)
+        engine.enable_stats(True)
+        engine._schedules = {}
+        for name, module, params in actions:
+            engine.info("启动模块: " + name)
+            module._batch_size = engine._batch
+            module.start(params)
+
+        frames = iter_dump(self._input_path, self._bus)
+        started = time.perf_counter()
+        try:
+            while True:
+                item = self._read_pass(frames)
+                if item is None:
+                    break
+                time_stamp, pipes = item[0], {self.pipe: item[1]}
+                self._advance_clock(time_stamp)
+                engine._run_pass(actions, pipes)
+                if self._output_dir:
+                    self._write_pipes(time_stamp, pipes)
+
+            # 文件读取完毕，继续执行直到管道中没有数据，例如模块中缓存的数据帧
+            for _ in range(self._drain):
+                pipes = {self.pipe: [] if engine._batch > 0 else CANSploitMessage()}
+                engine._run_pass(actions, pipes)
+                if not engine._pipes_have_data(pipes):
+                    break
+                if self._output_dir:
+                    self._write_pipes(-1.0, pipes)
+        finally:
+            self.elapsed = time.perf_counter() - started
+            for name, module, params in actions:
+                engine.info("停止模块: " + name)
+                module.stop(params)
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+        if self._output_dir:
+            engine.dump_stats(os.path.join(self._output_dir, 'stats.json'))
+        stats = engine.get_stats()
+        stats['frames'] = self.frames
+        stats['elapsed'] = self.elapsed
+        return stats
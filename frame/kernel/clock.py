@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+
+class RealClock:
+
+    """
+    实时时钟，`now`为`time.perf_counter()`，`wall`为`time.time()`。
+    """
+
+    virtual = False
+
+    def now(self):
+        """单调时间点(秒)，用于计算间隔与定时。
+
+        :rtype: float
+        """
+        return time.perf_counter()
+
+    def wall(self):
+        """当前的日历时间(秒)，用于记录时间戳。
+
+        :rtype: float
+        """
+        return time.time()
+
+    def sleep(self, seconds):
+        """休眠指定的秒数。"""
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event, timeout):
+        """等待事件，超时返回False。
+
+        :param threading.Event event: 等待的事件。
+        :param float timeout: 超时的秒数。
+
+        :rtype: bool
+        """
+        return event.wait(max(0.0, timeout))
+
+
+class VirtualClock(RealClock):
+
+    """
+    虚拟时钟。时间不随真实时间流逝，只由`advance`/`advance_to`推进(例如批处理模式下按照转储文件中的时间戳推进，
+    事件驱动模式下空闲时直接跳到下一个到期的时间点)，`sleep`直接推进时间而不等待，因此回放测试的结果是确定的，
+    并且以CPU允许的最快速度运行。
+    """
+
+    virtual = True
+
+    def __init__(self, start=0.0, epoch=0.0):
+        """
+        :param float start: 初始的时间点。
+        :param float epoch: `now`为0时对应的日历时间，用于`wall`。
+        """
+        self._now = float(start)
+        self._epoch = float(epoch)
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self._now
+
+    def wall(self):
+        return self._epoch + self._now
+
+    def advance(self, seconds):
+        """将时间向前推进指定的秒数。"""
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+    def advance_to(self, when):
+        """将时间推进到指定的时间点，时间不会倒退。"""
+        with self._lock:
+            if when > self._now:
+                self._now = float(when)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        self.advance(timeout)
+        return event.is_set()
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    """获取当前的时钟。
+
+    :rtype: RealClock
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """切换当前进程使用的时钟。
+
+    :param clock: `'real'`,`'virtual'`或者时钟对象。
+
+    :raises ValueError: 不支持的时钟。
+
+    :return: 切换后的时钟。
+    :rtype: RealClock
+    """
+    global _clock
+    if clock == 'real':
+        clock = RealClock()
+    elif clock == 'virtual':
+        clock = VirtualClock()
+    elif not isinstance(clock, RealClock):
+        raise ValueError("不支持的时钟 '{}'.".format(clock))
+    _clock = clock
+    return clock
+
+
+def now():
+    """当前时钟的单调时间点，参见`RealClock.now`。"""
+    return _clock.now()
+
+
+def wall():
+    """当前时钟的日历时间，参见`RealClock.wall`。"""
+    return _clock.wall()
+
+
+def sleep(seconds):
+    """按照当前时钟休眠，虚拟时钟下只推进时间。"""
+    _clock.sleep(seconds)
+
+
+def wait(event, timeout):
+    """按照当前时钟等待事件，参见`RealClock.wait`。"""
+    return _clock.wait(event, timeout)
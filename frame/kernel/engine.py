@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import glob
+import copy
 import time
 import threading
-import collections
 
 from importlib.machinery import SourceFileLoader
+from frame.kernel.waker import EventWaker
+from frame.kernel.pipeline import Pipeline
+from frame.kernel.stats import EngineStats
+from frame.kernel.plan import ActionPlan, ActionSchedule
+from frame.kernel.pacer import TxPacer
+from frame.kernel.manifest import ModuleManifest
+from frame.kernel.clock import get_clock, set_clock
 from frame.message.can import CANSploitMessage
 from frame.stream.iostream import IOStream
 from frame.stream.cmdres import CmdResult, CMDRES_ERROR, CMDRES_NULL, CMDRES_INT, CMDRES_STR, CMDRES_TAB, CMDRES_OBJ
@@ -25,6 +31,9 @@ class L6Engine:
         #
         self._modules = {}
         self._actions = []
+        self._config_path = None
+        self._module_params = {}    # 模块名称 -> 策略文件中的初始化参数
+        self._module_sources = {}   # 模块名称 -> (模块文件, 修改时间)
 
         #
         # 线程相关变量
@@ -34,6 +43,7 @@ class L6Engine:
         self._stop.set()
         self.do_stop_e = threading.Event()
         self.do_stop_e.clear()
+        self._lifecycle = threading.Lock()      # 启动与停止互斥，不能并发执行
 
         #
         # 输出IO
@@ -47,11 +57,87 @@ class L6Engine:
         self._timeout = int(params.get('timeout', 3))
         self._DEBUG = int(params.get('debug', 3))
         self._path_modules = str(params.get('path_modules', None))
+        self._manifest_path = params.get('manifest', os.path.join(
+            os.path.expanduser('~'), '.canfuzz', 'manifest.json'))
         self._output_screen = True if params.get('output_screen') in [
             "True", "true", "1"] else False
 
+        #
+        # 调度相关变量
+        #
+        self._waker = None
+        self._pipeline = None
+        self._procs = None
+        self._plan = None
+        self._schedules = {}        # id(动作参数) -> (动作参数, 调度策略)
+        self._pending_reload = None  # 等待主循环切换的(动作列表, 新增的动作, 移除的动作)
+        self._reloaded = threading.Event()
+        self._mode = 'loop'
+        self._schedule = 'poll'
+        self._idle_timeout = 0.5
+        self._batch = 0
+        self._queue_depth = 1024
+        self._queue_policy = 'block'
+        self._pipe_params = {}
+        self._pacer = TxPacer()
+        self._rpc = None
+        self._profiler = None
+
+        #
+        # 统计相关变量，关闭时为None
+        #
+        self._stats_enabled = False
+        self._stats = None
+        self._load_engine_params(params)
+
         sys.dont_write_bytecode = True
 
+    def _load_engine_params(self, params):
+        """读取引擎的调度参数，可以来自构造参数，也可以来自策略文件中的'engine'字段。
+
+        * `schedule`        调度模式，'poll'(默认)轮询执行所有动作，'event'在没有数据时休眠等待事件。
+        * `idle_timeout`    事件驱动模式下，没有任何事件时最长的休眠时间(秒)，默认0.5秒。
+        * `batch`           批量管道模式下每个模块每次最多追加的数据帧数量，0(默认)表示每个管道只携带一个数据帧。
+        * `mode`            执行模式，'loop'(默认)单线程依次执行所有动作，'pipeline'将动作拆分为多个阶段并发执行，
+                            'multiprocess'将动作参数中指定了'process'的动作放到独立的工作进程中执行。
+        * `queue_depth`     流水线模式下阶段之间队列的默认深度，默认1024。
+        * `queue_policy`    流水线模式下队列满时的默认策略，'block'(默认)阻塞上游阶段，'drop'丢弃新的数据。
+        * `pipes`           流水线模式下按管道名称单独指定队列参数，例如 {1: {'depth': 64, 'policy': 'drop'}}。
+        * `stats`           是否统计每个动作的调用次数、数据帧数量与耗时，默认关闭。
+        * `pacer`           按总线名称配置发送令牌桶，例如 {'can0': {'bitrate': 500000, 'load': 30, 'burst': 4}}，
+                            发送数据的动作通过动作参数'pace'使用。
+        * `clock`           时钟，'real'(默认)使用真实时间，'virtual'使用虚拟时钟，参见`clock.VirtualClock`。
+                            时钟在整个进程中共享，只支持执行模式'loop'。轮询与事件驱动模式下，没有数据流动时主循环
+                            将虚拟时钟推进到下一个定时模块到期的时间点。
+
+        :param dict params: 引擎参数。
+        """
+        schedule = str(params.get('schedule', self._schedule)).lower()
+        if schedule not in ['poll', 'event']:
+            raise ValueError("不支持的调度模式 '{}'.".format(schedule))
+        self._schedule = schedule
+        self._idle_timeout = float(
+            params.get('idle_timeout', self._idle_timeout))
+        self._batch = int(params.get('batch', self._batch))
+
+        mode = str(params.get('mode', self._mode)).lower()
+        if mode not in ['loop', 'pipeline', 'multiprocess']:
+            raise ValueError("不支持的执行模式 '{}'.".format(mode))
+        self._mode = mode
+        self._queue_depth = int(params.get('queue_depth', self._queue_depth))
+        self._queue_policy = str(
+            params.get('queue_policy', self._queue_policy)).lower()
+        self._pipe_params.update(params.get('pipes', {}))
+        if 'stats' in params:
+            self._stats_enabled = params['stats'] in [True, 1, "True", "true", "1"]
+        if 'pacer' in params:
+            self._pacer.configure(params['pacer'])
+        if 'clock' in params:
+            set_clock(params['clock'])
+        if get_clock().virtual and self._mode != 'loop':
+            # 流水线的各个阶段与工作进程各自循环，没有统一推进虚拟时钟的地方
+            raise ValueError("虚拟时钟只支持执行模式 'loop'，当前为 '{}'.".format(self._mode))
+
     def dprint(self, level, msg):
         """打印调试信息。"""
         if level <= self._DEBUG:
@@ -99,39 +185,353 @@ class L6Engine:
         这里是引擎启动后主要执行模块的主循环。这里负责了加载模块，验证模块是否激活以及执行当前方面中
         指定的动作。
         """
-        while not self.do_stop_e.is_set():
-            #
-            # 保存了当前方案中所需的所有管道变量
-            # 这里的 pipes = {} 清空操作很重要，每次循环都要清空，防止走入死循环
-            #
-            pipes = {}
-
-            # 以下的循环遍历当前方案所有要执行的动作，并依次执行
-            for name, module, params in self._actions:
-                if not module.is_active:
-                    continue  # 如果当前模块没有被激活，则执行跳过此模块
-                module._thr_block.wait(3)
-                module._thr_block.clear()
-
-                pipe_name = params['pipe']
-                # 如果发现管道变量是新创建的，则初始一个空的CAN消息结构，并保存在pipes字典中
-                if pipe_name not in pipes:
-                    pipes[pipe_name] = CANSploitMessage()
-
-                # self.dprint(1, "执行 " + name)
+        if self._pipeline is not None:
+            # 流水线模式下各个阶段在自己的线程中运行，这里只等待停止信号
+            self._pipeline.start()
+            self.do_stop_e.wait()
+            self._pipeline.stop()
+        else:
+            # 轮询模式下虚拟时钟只能由主循环推进，见`_advance_virtual`
+            virtual = get_clock().virtual
+            while not self.do_stop_e.is_set():
+                # 热加载的动作列表在两轮之间切换
+                if self._pending_reload is not None:
+                    self._apply_reload()
+
+                if self._stats is not None:
+                    #
+                    # 保存了当前方案中所需的所有管道变量
+                    # 这里的 pipes = {} 清空操作很重要，每次循环都要清空，防止走入死循环
+                    #
+                    pipes = {}
+                    self._run_pass(self._actions, pipes)
+
+                    # 事件驱动模式下，如果没有任何数据在管道中则休眠等待
+                    if self._waker is not None:
+                        self._wait_event(pipes, self._actions, self._waker)
+                    elif virtual:
+                        self._advance_virtual(pipes, self._actions)
+                    continue
 
-                # 运行当前动作中指定的模块以及相关的动作，并将结果保存在指定的管道变量中
-                pipes[pipe_name] = module.do(pipes[pipe_name], params)
-                module._thr_block.set()
+                # 执行预先编译的动作计划，动作参数被修改后重新编译
+                plan = self._plan
+                if plan is None:
+                    plan = self._plan = self._compile_plan()
+                plan.run()
+                if self._waker is not None:
+                    self._wait_event(plan.pipes(), self._actions, self._waker)
+                elif virtual:
+                    self._advance_virtual(plan.pipes(), self._actions)
+                plan.recycle()
 
         self.info("主循环停止")
         # 停止所有已经加载的模块
         for name, module, params in self._actions:
             self.info("停止模块: " + name)
             module.stop(params)
-        self.do_stop_e.clear()
+        self._unbind_waker()
         self.info("停止完成")
 
+    def _compile_plan(self):
+        """将动作列表编译为动作计划。
+
+        :rtype: plan.ActionPlan
+        """
+        return ActionPlan(self._actions, self._batch > 0, self._action_schedule)
+
+    def _action_schedule(self, params):
+        """获取动作的调度策略，同一个动作参数只解析一次，调度的状态(计数、下一次运行的时间)也保存在其中。
+
+        :param dict params: 动作参数。
+
+        :return: 调度策略，没有指定时返回None。
+        :rtype: plan.ActionSchedule
+        """
+        entry = self._schedules.get(id(params))
+        if entry is None or entry[0] is not params:
+            # 同时保存动作参数的引用，保证其id在缓存的生命周期中不会被复用
+            entry = (params, ActionSchedule.parse(params.get('schedule')))
+            self._schedules[id(params)] = entry
+        return entry[1]
+
+    def _run_pass(self, actions, pipes):
+        """依次执行一轮动作。
+
+        :param list actions: 要执行的动作列表。
+        :param dict pipes: 本轮循环的管道变量，执行后保存了各个管道的结果。
+        """
+        if self._stats is not None:
+            self._run_stats_actions(actions, pipes)
+            return
+        if self._batch > 0:
+            self._run_batch_actions(actions, pipes)
+            return
+
+        # 以下的循环遍历当前方案所有要执行的动作，并依次执行
+        for name, module, params in actions:
+            if not module.is_active:
+                continue  # 如果当前模块没有被激活，则执行跳过此模块
+            if 'schedule' in params and not self._action_schedule(params).ready(pipes.get(params['pipe'])):
+                continue  # 按照动作的调度策略本轮不需要执行
+            pipe_name = params['pipe']
+            # 如果发现管道变量是新创建的，则初始一个空的CAN消息结构，并保存在pipes字典中
+            if pipe_name not in pipes:
+                pipes[pipe_name] = CANSploitMessage()
+
+            # self.dprint(1, "执行 " + name)
+
+            # 运行当前动作中指定的模块以及相关的动作，并将结果保存在指定的管道变量中
+            with module._thr_block:
+                pipes[pipe_name] = module.do(pipes[pipe_name], params)
+
+    def _run_batch_actions(self, actions, pipes):
+        """批量管道模式下执行一轮动作，每个管道变量是一个CAN消息结构的列表。
+
+        :param list actions: 要执行的动作列表。
+        :param dict pipes: 本轮循环的管道变量。
+        """
+        for name, module, params in actions:
+            if not module.is_active:
+                continue
+            if 'schedule' in params and not self._action_schedule(params).ready(pipes.get(params['pipe'])):
+                continue
+            pipe_name = params['pipe']
+            if pipe_name not in pipes:
+                pipes[pipe_name] = []
+
+            with module._thr_block:
+                pipes[pipe_name] = module.do_batch(pipes[pipe_name], params)
+
+    def _run_stats_actions(self, actions, pipes):
+        """开启统计时执行一轮动作，记录每个动作的调用次数、输入输出的数据帧数量、执行耗时以及等待模块锁的时间。
+        关闭统计时不会进入此函数，因此不会带来额外的开销。
+
+        :param list actions: 要执行的动作列表。
+        :param dict pipes: 本轮循环的管道变量。
+        """
+        stats = self._stats
+        batch = self._batch > 0
+        clock = time.perf_counter_ns
+        for action in actions:
+            name, module, params = action
+            if not module.is_active:
+                continue
+            if 'schedule' in params and not self._action_schedule(params).ready(pipes.get(params['pipe'])):
+                continue
+            pipe_name = params['pipe']
+            if pipe_name not in pipes:
+                pipes[pipe_name] = [] if batch else CANSploitMessage()
+            frames_in = self._count_frames(pipes[pipe_name])
+
+            t0 = clock()
+            with module._thr_block:
+                t1 = clock()
+                if batch:
+                    pipes[pipe_name] = module.do_batch(pipes[pipe_name], params)
+                else:
+                    pipes[pipe_name] = module.do(pipes[pipe_name], params)
+                t2 = clock()
+
+            action_stats = stats.get(action)
+            if action_stats is not None:
+                action_stats.calls += 1
+                action_stats.frames_in += frames_in
+                action_stats.frames_out += self._count_frames(pipes[pipe_name])
+                action_stats.block_wait += t1 - t0
+                action_stats.latency.record(t2 - t1)
+
+    def _count_frames(self, item):
+        """统计一个管道变量中携带CAN数据的帧数。"""
+        if self._batch > 0:
+            return sum(1 for can_msg in item if can_msg.CANData)
+        return 1 if item.CANData else 0
+
+    def enable_stats(self, enable=True):
+        """开启或者关闭统计，开启时清空之前的统计信息。
+
+        :param bool enable: 是否开启。
+        """
+        self._stats_enabled = enable
+        self._stats = EngineStats(self._actions) if enable else None
+
+    def reset_stats(self):
+        """清空统计信息。"""
+        if self._stats is not None:
+            self._stats = EngineStats(self._actions)
+
+    def get_stats(self):
+        """获取统计信息。
+
+        :return: 统计信息，没有开启统计时返回None。
+        :rtype: dict
+        """
+        if self._stats is None:
+            return None
+        return self._stats.to_dict()
+
+    def dump_stats(self, path=None):
+        """以JSON格式导出统计信息。
+
+        :param str path: 保存的文件路径，为None时只返回字符串。
+
+        :return: JSON字符串，没有开启统计时返回None。
+        :rtype: str
+        """
+        if self._stats is None:
+            return None
+        text = self._stats.to_json(indent=2)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
+
+    def start_profiler(self, interval=0.005):
+        """开始采样分析所有线程，引擎不需要停止，参见`profiler.SamplingProfiler`。
+
+        :param float interval: 采样间隔(秒)。
+
+        :raises ValueError: 采样间隔不是正数。
+
+        :return: 新的采样分析器(之前的结果被丢弃)，已经在运行时返回正在运行的分析器。
+        :rtype: SamplingProfiler
+        """
+        if self._profiler is None or not self._profiler.running:
+            # 只在需要时导入
+            from frame.kernel.profiler import SamplingProfiler
+            self._profiler = SamplingProfiler(interval)
+            self._profiler.start()
+        return self._profiler
+
+    def stop_profiler(self):
+        """停止采样分析，结果保留到下一次开始。
+
+        :return: 采样分析器，没有开始过时返回None。
+        :rtype: SamplingProfiler
+        """
+        if self._profiler is not None:
+            self._profiler.stop()
+        return self._profiler
+
+    def get_profiler(self):
+        """获取最近一次的采样分析器，没有开始过时返回None。
+
+        :rtype: SamplingProfiler
+        """
+        return self._profiler
+
+    def _pipe_has_data(self, item):
+        """判断一个管道变量中是否携带CAN数据。"""
+        if self._batch > 0:
+            for can_msg in item:
+                if can_msg.CANData:
+                    return True
+            return False
+        return item.CANData
+
+    def _pipes_have_data(self, pipes):
+        """判断本轮循环结束时是否有管道中携带CAN数据。"""
+        for item in pipes.values():
+            if self._pipe_has_data(item):
+                return True
+        return False
+
+    def _idle_wait_time(self, pipes, actions):
+        """计算事件驱动模式下本轮结束后可以休眠的时间。
+
+        :param dict pipes: 本轮循环结束时的管道变量。
+        :param list actions: 本轮执行的动作列表。
+
+        :return: 可以休眠的秒数，None表示需要立即进行下一轮。
+        :rtype: float
+        """
+        if self._pipes_have_data(pipes):
+            return None     # 本轮有数据流动，数据源可能还有更多的数据，立即进行下一轮
+
+        clock = get_clock()
+        now = clock.now()
+        earliest = None
+        for name, module, params in actions:
+            if not module.is_active:
+                continue
+            due = module.next_due(params)
+            if 'schedule' in params:
+                due = self._action_schedule(params).next_due(due)
+            if due is None:
+                continue
+            if due <= now:
+                return None     # 有模块需要立即运行
+            if earliest is None or due < earliest:
+                earliest = due
+        if earliest is not None and clock.virtual:
+            # 虚拟时钟下不需要真实地等待定时模块，直接推进到下一个到期的时间点，不受空闲超时的限制
+            clock.advance_to(earliest)
+            return None
+        deadline = now + self._idle_timeout
+        if earliest is not None and earliest < deadline:
+            deadline = earliest
+        return deadline - now
+
+    def _advance_virtual(self, pipes, actions):
+        """轮询模式下使用虚拟时钟时，本轮没有数据流动则将时钟推进到下一个到期的时间点。虚拟时钟不会自己前进，
+        否则按照速率发送的模块(`tx_ready`)与按照时间戳回放的模块永远不会到期，主循环一直空转。
+
+        :param dict pipes: 本轮循环结束时的管道变量。
+        :param list actions: 本轮执行的动作列表。
+        """
+        self._idle_wait_time(pipes, actions)
+
+    def _wait_event(self, pipes, actions, waker):
+        """事件驱动模式下，当本轮没有产生数据时，休眠直到有模块可读、被唤醒或者定时模块到期。
+
+        :param dict pipes: 本轮循环结束时的管道变量。
+        :param list actions: 本轮执行的动作列表。
+        :param waker.EventWaker waker: 用于休眠的唤醒器。
+        """
+        timeout = self._idle_wait_time(pipes, actions)
+        if timeout is not None:
+            waker.wait(timeout)
+
+    def _bind_waker(self):
+        """创建唤醒器(流水线模式下创建流水线)并绑定到所有模块，需要在模块启动之前调用。"""
+        if self._mode == 'pipeline':
+            self._pipeline = Pipeline(self, self._actions)
+            return
+        if self._procs is not None:
+            self._pipeline = self._procs.bind()
+            return
+        if self._schedule != 'event':
+            return
+        self._waker = EventWaker()
+        for name, module, params in self._actions:
+            module.bind_waker(self._waker)
+
+    def _register_sources(self):
+        """将已经启动模块的文件描述符注册到唤醒器中。"""
+        if self._pipeline is not None:
+            self._pipeline.register_sources()
+            return
+        if self._waker is None:
+            return
+        for name, module, params in self._actions:
+            if not module.is_active:
+                continue
+            fileno = module.get_fileno(params)
+            if fileno is not None:
+                self._waker.register(fileno, module)
+
+    def _unbind_waker(self):
+        """解除所有模块与唤醒器的绑定并关闭唤醒器。"""
+        if self._pipeline is not None:
+            self._pipeline.close()
+            self._pipeline = None
+            return
+        if self._waker is None:
+            return
+        for name, module, params in self._actions:
+            module.bind_waker(None)
+        self._waker.close()
+        self._waker = None
+
     def call_module(self, index, params):
         """通过模块的index以及指定参数来运行模块。
 
@@ -145,11 +545,40 @@ class L6Engine:
             return CmdResult(cmdline=str(index), describe='模块 {} 未找到'.format(index), last_error=-2)
         return self._actions[index][1].raw_write(params)
 
+    def start_rpc(self, path):
+        """在Unix域套接字上启动JSON-RPC控制接口，参见`rpc.RPCServer`。
+
+        :param str path: 套接字文件的路径。
+
+        :raises ValueError: 当前平台不支持Unix域套接字。
+
+        :return: RPC服务。
+        :rtype: RPCServer
+        """
+        # 只在需要时导入，减少启动时间
+        from frame.kernel.rpc import RPCServer
+        self.stop_rpc()
+        self._rpc = RPCServer(self, path)
+        self._rpc.start()
+        self.info("RPC服务启动: " + path)
+        return self._rpc
+
+    def stop_rpc(self):
+        """停止JSON-RPC控制接口。"""
+        if self._rpc is not None:
+            self._rpc.stop()
+            self._rpc = None
+
     def engine_exit(self):
         """引擎退出时，退出所有加载的模块。"""
+        self.stop_rpc()
+        self.stop_profiler()
         for name, module, params in self._actions:
             self.info("退出模块: " + name)
             module.exit(params)
+        if self._procs is not None:
+            self._procs.shutdown()
+            self._procs = None
         self.ios.clear()
         self.module_ios.clear()
 
@@ -160,14 +589,21 @@ class L6Engine:
         :rtype: bool
         """
         self.info("准备启动主处理线程")
-        if self._stop.is_set() and not self.do_stop_e.is_set():
-            self.do_stop_e.set()
+        with self._lifecycle:
+            if not self._stop.is_set():
+                return True
+            if self._stats_enabled and self._stats is None:
+                self._stats = EngineStats(self._actions)
+            self._plan = None
+            self._schedules = {}
+            self._bind_waker()
             for name, module, params in self._actions:
                 self.info("启动模块: " + name)
+                module._batch_size = self._batch
                 module.start(params)
-                module._thr_block.set()
+            self._register_sources()
 
-            self._thread = threading.Thread(target=self.main_loop)
+            self._thread = threading.Thread(target=self.main_loop, name='engine')
             self._thread.daemon = True
 
             self._stop.clear()
@@ -184,12 +620,17 @@ class L6Engine:
         :rtype: bool
         """
         self.info("准备停止主处理线程")
-        if not self._stop.is_set() and not self.do_stop_e.is_set():
+        with self._lifecycle:
+            if self._stop.is_set():
+                return False
             self.do_stop_e.set()
-            while self.do_stop_e.is_set():
-                time.sleep(0.01)
-
-        self._stop.set()
+            # 主循环在休眠时立即唤醒，本轮结束后退出并停止所有模块
+            if self._waker is not None:
+                self._waker.notify()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+            self._stop.set()
         return not self._stop.is_set()
 
     @property
@@ -242,8 +683,31 @@ class L6Engine:
         if index < 0 or index >= len(self._actions):
             return False
         self._actions[index][2] = self._validate_action_params(params)
+        self._plan = None
+        module = self._actions[index][1]
+        if self._procs is not None:
+            # 只有多进程模式下才会创建进程管理器，此时多进程模块已经导入
+            from frame.kernel.multiproc import RemoteModule
+            if isinstance(module, RemoteModule):
+                self._procs.edit(index, module, self._actions[index][2])
         return True
 
+    def restart_module(self, index, params):
+        """修改动作参数后让index指定的模块使用新的参数：暂时反激活模块，引擎运行时停止并重新启动模块，最后恢复原来的
+        激活状态。命令行的`edit`与RPC的`edit_module`都在`edit_module`之后调用，两者的行为一致。
+
+        :param int index: 模块的索引。
+        :param dict params: 模块执行的新的参数。
+        """
+        module = self._actions[index][1]
+        if self._procs is not None:
+            from frame.kernel.multiproc import RemoteModule
+            if isinstance(module, RemoteModule):
+                # 在模块所在的工作进程中重启，由工作进程持有模块锁
+                self._procs.restart(module, params)
+                return
+        module.restart(params, self.status_loop)
+
     def _get_load_paths(self):
         """获取当前模块加载的路径。
 
@@ -264,31 +728,12 @@ class L6Engine:
         return strats
 
     def list_modules(self):
-        """列出所有的模块。
+        """列出所有的模块。模块文件只做静态解析而不会被导入，解析结果缓存在模块清单中，参见`manifest.ModuleManifest`。
 
         :return: 一个字典结构，保存了所有在搜索目录范围内的所有模块。
         :rtype: collections.OrderedDict
         """
-        modules = collections.OrderedDict()
-        # 便利所有加载模块的路径
-        for search_path in self._get_load_paths()[::-1]:
-            search_path = os.path.join(search_path, '**', '*.py')
-            for fullpath in glob.iglob(search_path):
-                if fullpath.endswith('__init__.py'):
-                    continue        # 跳过包初始化文件
-                path, filename = os.path.split(fullpath)
-                subdir = os.path.split(os.path.dirname(fullpath))[1]
-                filename = os.path.splitext(filename)[0]
-                sys.path.append(path)
-                module = __import__(filename)
-                if subdir != 'modules':
-                    new_module = {os.path.join(subdir, filename): (
-                        getattr(module, filename), path)}
-                else:
-                    new_module = {filename: (
-                        getattr(module, filename).name, path)}
-                modules.update(new_module)
-        return modules
+        return ModuleManifest(self._manifest_path).scan(self._get_load_paths())
 
     def load_config(self, fullpath):
         """加载运行方案。
@@ -317,12 +762,13 @@ class L6Engine:
         ]
         --------------------------------------------------
         """
-        path, filename = os.path.split(fullpath)
-        if not path:
-            path = os.getcwd()
-        sys.path.append(path)
+        filename = os.path.basename(fullpath)
+        config = self._read_config(fullpath)
+        self._config_path = fullpath
 
-        config = __import__(os.path.splitext(filename)[0])
+        # 策略文件中可选的'engine'字段用于指定引擎的调度参数
+        if hasattr(config, 'engine'):
+            self._load_engine_params(config.engine)
 
         # 寻找'modules'字段并进行加载
         if hasattr(config, 'modules'):
@@ -330,31 +776,7 @@ class L6Engine:
         else:
             raise AttributeError("丢失 '模块' 检查你的策略文件 '{}'.".format(filename))
 
-        for module, init_params in modules:
-            # 在所有搜索路径中找寻当前的模块
-            for path in self._get_load_paths():
-                if not os.path.exists(path):
-                    continue
-                try:
-                    self.dprint(1, '搜索模块 {} 从 {}'.format(module, path))
-                    # 对在方案中的模块进行动态加载并初始化
-                    self._init_module(path, module, init_params)
-                    break
-                except ImportError:
-                    self.dprint(1, '模块 {} 未发现在 {}'.format(module, path))
-                    continue
-            else:
-                raise ImportError(
-                    "不能找到模块 '{}'. 检查你的策略文件 '{}' 是否有效.".format(module, filename))
-
-        # 加载方案中的动作
-        for action in config.actions:
-            # 遍历动作中所有的模块以及参数
-            for module, parameters in action.items():
-                # 验证参数是否合规，并将其添加到引擎中的动作列表
-                validated_parameters = self._validate_action_params(parameters)
-                self._actions.append(
-                    [module, self._modules[module], validated_parameters])
+        self._load_strategy(filename, modules, config.actions)
 
     def load_config_by_json(self, config):
         """加载运行方案。
@@ -368,33 +790,249 @@ class L6Engine:
         modules = config.get('modules', {})
         if not config.get('modules', ''):
             raise AttributeError("丢失模块' 检查你的策略文件 '{}'.".format(name))
+        if config.get('engine', None):
+            self._load_engine_params(config['engine'])
 
-        for module, init_params in modules.items():
-            # 在所有搜索路径中找寻当前的模块
-            for path in self._get_load_paths():
-                if not os.path.exists(path):
-                    continue
-                try:
-                    self.dprint(1, '搜索模块 {} 从 {}'.format(module, path))
-                    # 对在方案中的模块进行动态加载并初始化
-                    self._init_module(path, module, init_params)
-                    break
-                except ImportError:
-                    self.dprint(1, '模块 {} 未发现在 {}'.format(module, path))
+        self._load_strategy(name, modules.items(), config.get('actions', []))
+
+    @staticmethod
+    def _read_config(fullpath):
+        """导入策略文件。重复导入同一个策略文件时会重新执行，因此可以读取到修改后的内容。
+
+        :param str fullpath: 方案文件的路径。
+
+        :return: 策略文件对应的python模块。
+        """
+        path, filename = os.path.split(fullpath)
+        if not path:
+            path = os.getcwd()
+        if path not in sys.path:
+            sys.path.append(path)
+        return SourceFileLoader(os.path.splitext(filename)[0], os.path.join(path, filename)).load_module()
+
+    def _module_changed(self, key, init_params):
+        """判断已经加载的模块在重新加载策略时是否需要重新创建：初始化参数或者模块文件发生了变化。"""
+        if self._module_params.get(key) != init_params:
+            return True
+        source = self._module_sources.get(key)
+        if source is None:
+            return True
+        try:
+            return os.path.getmtime(source[0]) != source[1]
+        except OSError:
+            return True
+
+    def reload_config(self, fullpath=None, modules=()):
+        """热加载策略文件，引擎运行时不需要停止。
+
+        * 初始化参数与模块文件都没有变化的模块保留原来的对象，其中的数据与打开的设备不受影响。
+        * 新增的以及发生变化的模块重新创建，引擎运行时在切换之前启动。
+        * 新的动作列表在主循环的两轮之间整体切换，随后停止并退出不再使用的模块。
+
+        :param str fullpath: 方案文件的路径，None表示重新加载当前的方案文件。
+        :param modules: 需要强制重新导入的模块名称，即使文件没有变化。
+
+        :raises ValueError: 没有可以重新加载的方案，执行模式不支持热加载，或者运行时修改了需要重启的引擎参数。
+        :raises AttributeError: 方案中缺少模块。
+
+        :return: (保留的模块, 重新创建的模块, 移除的模块)的名称列表。
+        :rtype: tuple
+        """
+        fullpath = fullpath or self._config_path
+        if not fullpath:
+            raise ValueError("没有可以重新加载的策略文件.")
+        if self._mode != 'loop':
+            raise ValueError("热加载不支持执行模式 '{}'.".format(self._mode))
+        filename = os.path.basename(fullpath)
+        config = self._read_config(fullpath)
+        if not hasattr(config, 'modules'):
+            raise AttributeError("丢失 '模块' 检查你的策略文件 '{}'.".format(filename))
+
+        running = not self._stop.is_set()
+        engine_params = getattr(config, 'engine', None) or {}
+        if running:
+            for key, value in (('mode', self._mode), ('schedule', self._schedule), ('batch', self._batch)):
+                if key in engine_params and str(engine_params[key]).lower() != str(value).lower():
+                    raise ValueError("引擎运行时不能修改参数 '{}'，请先停止引擎.".format(key))
+        if str(engine_params.get('mode', self._mode)).lower() != 'loop':
+            raise ValueError("热加载不支持执行模式 '{}'.".format(engine_params['mode']))
+        self._load_engine_params(engine_params)
+
+        validated_actions = []
+        for action in config.actions:
+            for module, parameters in action.items():
+                validated_actions.append((module, self._validate_action_params(parameters)))
+
+        old_modules = dict(self._modules)
+        old_params = dict(self._module_params)
+        created = {}
+        try:
+            new_modules = {}
+            for module, init_params in config.modules.items():
+                key = module.replace(os.sep, '/').rsplit('/', 1)[-1]
+                if key in old_modules and key not in modules and not self._module_changed(key, init_params):
+                    new_modules[key] = old_modules[key]
                     continue
-            else:
-                raise ImportError(
-                    "不能找到模块 '{}'. 检查你的策略文件 '{}' 是否有效.".format(module, name))
+                self._load_module(module, init_params, filename)
+                self._module_params[key] = copy.deepcopy(init_params)
+                new_modules[key] = created[key] = self._modules[key]
+
+            # 动作参数没有变化的动作保留原来的对象，统计信息也随之保留
+            old_actions = {}
+            for action in self._actions:
+                old_actions.setdefault((action[0], id(action[1])), []).append(action)
+            new_actions = []
+            for module, parameters in validated_actions:
+                if module not in new_modules:
+                    raise AttributeError("丢失模块 '{}' 检查你的策略文件 '{}'.".format(module, filename))
+                candidates = old_actions.get((module, id(new_modules[module])), [])
+                for action in candidates:
+                    if action[2] == parameters:
+                        candidates.remove(action)
+                        break
+                else:
+                    action = [module, new_modules[module], parameters]
+                new_actions.append(action)
+        except Exception:
+            self._modules = old_modules
+            self._module_params = old_params
+            for module in created.values():
+                module.exit({})
+            raise
+
+        created_ids = {id(module) for module in created.values()}
+        kept_ids = {id(module) for module in new_modules.values()}
+        added = [action for action in new_actions if id(action[1]) in created_ids]
+        removed = [action for action in self._actions if id(action[1]) not in kept_ids]
+
+        if running:
+            for name, module, params in added:
+                self.info("启动模块: " + name)
+                module._batch_size = self._batch
+                if self._waker is not None:
+                    module.bind_waker(self._waker)
+                module.start(params)
+            self._swap_actions(new_actions, added, removed)
+        else:
+            self._actions = new_actions
+            self._plan = None
+        self._modules = new_modules
+        self._config_path = fullpath
 
-        # 加载方案中的动作
-        actions = config.get('actions', [])
+        for name, module, params in removed:
+            self.info("停止模块: " + name)
+            if running:
+                module.stop(params)
+                module.bind_waker(None)
+            module.exit(params)
+        for key in list(self._module_params):
+            if key not in new_modules:
+                del self._module_params[key]
+                self._module_sources.pop(key, None)
+
+        return ([key for key in new_modules if key not in created], list(created),
+                [key for key in old_modules if key not in new_modules])
+
+    def _swap_actions(self, actions, added, removed):
+        """请求主循环在两轮之间切换动作列表，并等待切换完成。"""
+        self._reloaded.clear()
+        self._pending_reload = (actions, added, removed)
+        if self._waker is not None:
+            self._waker.notify()
+        while not self._reloaded.wait(0.1):
+            if self._thread is None or not self._thread.is_alive():
+                # 主循环已经退出，直接切换
+                self._apply_reload()
+                break
+
+    def _apply_reload(self):
+        """在主循环线程中切换热加载的动作列表，同时更新唤醒器中注册的文件描述符。"""
+        actions, added, removed = self._pending_reload
+        if self._waker is not None:
+            for name, module, params in removed:
+                fileno = module.get_fileno(params) if module.is_active else None
+                if fileno is not None:
+                    self._waker.unregister(fileno)
+            for name, module, params in added:
+                fileno = module.get_fileno(params) if module.is_active else None
+                if fileno is not None:
+                    self._waker.register(fileno, module)
+        self._actions = actions
+        self._plan = None
+        if self._stats is not None:
+            self._stats.rebuild(actions)
+        self._pending_reload = None
+        self._reloaded.set()
+
+    def _load_strategy(self, strategy, modules, actions):
+        """加载方案中的模块以及动作。
+
+        :param str strategy: 方案的名称，用于错误信息。
+        :param modules: 模块名称与初始化参数的序列。
+        :param list actions: 方案中的动作列表。
+
+        :raises ImportError: 当模块未找到时。
+        :raises ValueError: 多进程模式下同一个模块的动作被指定到不同的进程。
+        """
+        # 验证动作参数是否合规
+        validated_actions = []
         for action in actions:
-            # 遍历动作中所有的模块以及参数
             for module, parameters in action.items():
-                # 验证参数是否合规，并将其添加到引擎中的动作列表
-                validated_parameters = self._validate_action_params(parameters)
-                self._actions.append(
-                    [module, self._modules[module], validated_parameters])
+                validated_actions.append(
+                    (module, self._validate_action_params(parameters)))
+
+        # 多进程模式下，根据动作参数中的'process'确定每个模块所在的进程
+        groups = {}
+        if self._mode == 'multiprocess':
+            for module, parameters in validated_actions:
+                group = parameters.get('process', None)
+                if groups.setdefault(module, group) != group:
+                    raise ValueError("模块 '{}' 的动作被指定到了不同的进程. 检查你的策略文件 '{}'.".format(
+                        module, strategy))
+            if self._procs is None:
+                # 多进程模块依赖multiprocessing与共享内存，只在多进程模式下导入，不影响命令行的启动时间
+                from frame.kernel.multiproc import ProcessManager
+                self._procs = ProcessManager(self)
+
+        for module, init_params in modules:
+            key = module.replace(os.sep, '/').rsplit('/', 1)[-1]
+            self._module_params[key] = copy.deepcopy(init_params)
+            if groups.get(key) is None:
+                self._load_module(module, init_params, strategy)
+            else:
+                self._modules[key] = self._procs.add_module(
+                    groups[key], module, init_params)
+
+        # 加载方案中的动作并添加到引擎中的动作列表
+        for module, parameters in validated_actions:
+            self._actions.append([module, self._modules[module], parameters])
+
+        if self._procs is not None:
+            self._procs.spawn(self._actions, strategy)
+
+    def _load_module(self, module, init_params, strategy):
+        """在所有搜索路径中找寻模块并进行加载。
+
+        :param str module: 方案中的模块名称。
+        :param dict init_params: 模块的初始化参数。
+        :param str strategy: 方案的名称，用于错误信息。
+
+        :raises ImportError: 当模块未找到时。
+        """
+        for path in self._get_load_paths():
+            if not os.path.exists(path):
+                continue
+            try:
+                self.dprint(1, '搜索模块 {} 从 {}'.format(module, path))
+                # 对在方案中的模块进行动态加载并初始化
+                self._init_module(path, module, init_params)
+                break
+            except ImportError:
+                self.dprint(1, '模块 {} 未发现在 {}'.format(module, path))
+                continue
+        else:
+            raise ImportError(
+                "不能找到模块 '{}'. 检查你的策略文件 '{}' 是否有效.".format(module, strategy))
 
     def _init_module(self, path, mod, params):
         """动态初始化模块。
@@ -454,6 +1092,8 @@ class L6Engine:
         #
         self._modules[mod] = getattr(
             loaded_module, mod_name)(params, self.module_ios)
+        self._modules[mod].bind_pacer(self._pacer)
+        self._module_sources[mod] = (loaded_module.__file__, os.path.getmtime(loaded_module.__file__))
 
     @staticmethod
     def _validate_action_params(params):
@@ -461,9 +1101,12 @@ class L6Engine:
 
         :param dict params: 要验证的参数。
 
+        :raises ValueError: 调度策略无效。
+
         :return: 验证后的参数。
         :rtype: dict
         """
         if 'pipe' not in params:
             params['pipe'] = 1
+        ActionSchedule.parse(params.get('schedule'))
         return params
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import ast
+import glob
+import json
+import collections
+
+
+class ModuleManifest:
+
+    """
+    模块清单的缓存。列出模块时不再导入每一个模块文件，而是通过`ast`静态解析出与文件同名的类及其`name`属性，
+    结果按照文件路径连同修改时间与大小保存在缓存文件中，文件没有变化时直接使用缓存，变化后重新解析。
+
+    缓存文件的格式：
+
+    ```json
+    {"version": 1, "files": {"/path/modules/tools/fuzz.py": {"mtime": 0.0, "size": 0, "class": "fuzz", "name": "FUZZ"}}}
+    ```
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_path=None):
+        """
+        :param str cache_path: 缓存文件的路径，None表示不使用缓存文件。
+        """
+        self._cache_path = cache_path
+        self._files = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self._cache_path or not os.path.exists(self._cache_path):
+            return
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') == self.VERSION:
+                self._files = cache.get('files', {})
+        except (OSError, ValueError):
+            self._files = {}        # 缓存损坏时重新解析
+
+    def save(self):
+        """缓存有变化时保存到缓存文件，无法写入时忽略。"""
+        if not self._cache_path or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._cache_path), exist_ok=True)
+            tmp_path = self._cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'files': self._files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._cache_path)
+            self._dirty = False
+        except OSError:
+            pass
+
+    @staticmethod
+    def inspect(fullpath):
+        """静态解析一个模块文件，查找与文件同名的类以及类属性`name`。
+
+        :param str fullpath: 模块文件的路径。
+
+        :return: (类名, 模块名称)，没有找到同名的类时类名为None，没有`name`属性时模块名称为类名。
+        :rtype: tuple
+        """
+        class_name = os.path.splitext(os.path.basename(fullpath))[0]
+        try:
+            with open(fullpath, 'rb') as f:
+                tree = ast.parse(f.read(), fullpath)
+        except (OSError, SyntaxError, ValueError):
+            return None, None
+        for node in tree.body:
+            if not isinstance(node, ast.ClassDef) or node.name != class_name:
+                continue
+            for item in node.body:
+                if isinstance(item, ast.Assign) and isinstance(item.value, ast.Constant) and \
+                        any(isinstance(target, ast.Name) and target.id == 'name' for target in item.targets):
+                    return class_name, str(item.value.value)
+            return class_name, class_name
+        return None, None
+
+    def entry(self, fullpath):
+        """获取一个模块文件的清单项，文件的修改时间或者大小变化后重新解析。
+
+        :param str fullpath: 模块文件的路径。
+
+        :return: 清单项，文件不存在时返回None。
+        :rtype: dict
+        """
+        try:
+            st = os.stat(fullpath)
+        except OSError:
+            return None
+        entry = self._files.get(fullpath)
+        if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            class_name, name = self.inspect(fullpath)
+            entry = {'mtime': st.st_mtime, 'size': st.st_size, 'class': class_name, 'name': name}
+            self._files[fullpath] = entry
+            self._dirty = True
+        return entry
+
+    def scan(self, search_paths):
+        """列出所有搜索路径中的模块，只做静态解析，不导入模块。
+
+        :param list search_paths: 模块的搜索路径，靠前的路径优先。
+
+        :return: 模块名称(子目录中的模块为'子目录/模块')与(描述, 目录)的字典。
+        :rtype: collections.OrderedDict
+        """
+        modules = collections.OrderedDict()
+        for search_path in search_paths[::-1]:
+            for fullpath in sorted(glob.iglob(os.path.join(search_path, '**', '*.py'))):
+                if fullpath.endswith('__init__.py'):
+                    continue        # 跳过包初始化文件
+                entry = self.entry(fullpath)
+                if entry is None or entry['class'] is None:
+                    continue        # 没有与文件同名的类，不是模块
+                path, filename = os.path.split(fullpath)
+                subdir = os.path.split(path)[1]
+                filename = os.path.splitext(filename)[0]
+                key = filename if subdir == 'modules' else os.path.join(subdir, filename)
+                modules[key] = (entry['name'], path)
+        self.save()
+        return modules
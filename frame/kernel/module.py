@@ -5,7 +5,8 @@ import threading
 import traceback
 import collections
 
-from frame.stream.iostream import IOStream
+from frame.kernel.pacer import TokenBucket
+from frame.stream.iostream import IOStream, TraceMessage
 from frame.stream.cmdres import CmdResult, CMDRES_STR, CMDRES_INT
 
 
@@ -13,7 +14,7 @@ class Command(object):
 
     """给模块添加的命令结构。"""
 
-    def __init__(self, description, num_params, desc_params, callback, is_enabled, index=None):
+    def __init__(self, description, num_params, desc_params, callback, is_enabled, index=None, blocking=False):
         #: str -- 命令的描述。
         self.description = description
         #: int -- 参数的数量。
@@ -26,6 +27,8 @@ class Command(object):
         self.is_enabled = is_enabled
         #: int -- 命令的索引
         self.index = index
+        #: bool -- 命令是否会长时间阻塞(例如按照速率发送、等待主循环处理)，为True时回调函数不持有模块锁执行
+        self.blocking = blocking
 
 
 class CANModule:
@@ -56,6 +59,8 @@ class CANModule:
             '停止/激活 当前模块', 0, '', self.do_activate, True)
         self.commands['outscr'] = Command(
             '停止/激活 标准输出', 0, '', self.do_output_screen, True)
+        self.commands['trace'] = Command(
+            '停止/激活 逐帧的跟踪信息', 0, '', self.do_trace, True)
 
         #
         # 输出流
@@ -69,15 +74,34 @@ class CANModule:
         self._DEBUG = int(params.get('debug', 0))
         self._output_screen = True if params.get('output_screen', False) in [
             "True", "true", "1"] else False
+        #: bool -- 是否输出逐帧的跟踪信息，热点代码中可以直接判断此属性跳过跟踪信息的准备工作
+        self.trace_enabled = params.get('trace', False) in [True, "True", "true", "1"]
         self._bus = params.get('bus', self.__class__.__name__)
         self._active = False if params.get('active', False) in [
             "False", "false", "0", "-1"] else True
         self._timeout = int(params.get('timeout', 3))
 
         #
-        # 线程事件
+        # 模块锁，主循环执行模块的动作与命令行调用模块的命令互斥，同一个线程中可以重入。
+        # 会长时间阻塞的命令(Command的blocking为True)不持有模块锁执行
         #
-        self._thr_block = threading.Event()
+        self._thr_block = threading.RLock()
+
+        #
+        # 事件驱动调度时由引擎绑定的唤醒器
+        #
+        self._waker = None
+
+        #
+        # 批量管道模式下每次调用最多处理的数据帧数量，0表示非批量模式，由引擎设置
+        #
+        self._batch_size = 0
+
+        #
+        # 由引擎绑定的发送节拍器，以及按照动作参数'delay'创建的令牌桶
+        #
+        self._pacer = None
+        self._tx_buckets = {}
 
         #
         # 调用自定义的初始化函数
@@ -94,6 +118,20 @@ class CANModule:
         if level <= self._DEBUG:
             self.output_dbginfo(msg)
 
+    def trace(self, fmt, *args):
+        """输出逐帧的跟踪信息。没有开启跟踪时直接返回，开启时只记录格式字符串与参数，读取时才进行格式化。
+
+        :param str fmt: `str.format`格式的字符串。
+        :param args: 格式化的参数，`bytes`与`bytearray`格式化为16进制字符串。
+        """
+        if not self.trace_enabled:
+            return
+        msg = TraceMessage('[TRACE]' + fmt, args)
+        if self._output_screen is True:
+            print(msg)
+        else:
+            self._ios.output(self._bus, msg, self._timeout)
+
     def info(self, msg):
         """打印调试信息。"""
         self.set_error_text(msg, level='info')
@@ -162,15 +200,11 @@ class CANModule:
 
         :returns: dict -- 'bar': 模块的进度条以及状态信息。一个字典用于将进度与状态对应。
         """
-        self._thr_block.wait(timeout=self._timeout)
-        self._thr_block.clear()
+        # 状态与错误信息的读取不需要等待模块锁
         status = int(self._status)
-        error_text = ""
-        if self._error_text != "":
-            error_text = self._error_text
-            self._error_text = ""
-        self._thr_block.set()
-        return {'bar': status, 'text': error_text}
+        error_text, self._error_text = self._error_text, ""
+        # 错误信息可以是延迟格式化的`TraceMessage`
+        return {'bar': status, 'text': str(error_text)}
 
     def do_output_screen(self, mode=-1):
         """激活当前模块输出
@@ -194,6 +228,28 @@ class CANModule:
             result_str = '未激活'
         return CmdResult(cmdline='outscr ' + str(mode), describe="标准输出激活状态", result_type=CMDRES_STR, result=result_str)
 
+    def do_trace(self, mode=-1):
+        """激活逐帧的跟踪信息。
+
+        :param int mode: 跟踪信息的激活状态。(默认: `-1`)
+          - `0` 反激活
+          - `-1` 取当前状态相反的状态 (激活 -> 反激活 / 反激活 -> 激活)
+          - `1` 激活
+
+        :returns: str -- 跟踪信息的状态，用字符串描述。
+        """
+        if mode == -1:
+            self.trace_enabled = not self.trace_enabled
+        elif mode == 0:
+            self.trace_enabled = False
+        else:
+            self.trace_enabled = True
+
+        result_str = '激活'
+        if not self.trace_enabled:
+            result_str = '未激活'
+        return CmdResult(cmdline='trace ' + str(mode), describe="跟踪信息激活状态", result_type=CMDRES_STR, result=result_str)
+
     @property
     def is_active(self):
         """模块是否在激活状态。
@@ -242,8 +298,6 @@ class CANModule:
         :returns: CmdResult -- 命令执行结果
         """
         ret = None
-        self._thr_block.wait(timeout=self._timeout)  # 3秒超时设定
-        self._thr_block.clear()
         full_cmd = string.lstrip()
         if ' ' in full_cmd:  # 是否有其他参数指定
             # 通过空格来区分命令以及参数，如果存在将参数提取到parameters中,
@@ -257,7 +311,15 @@ class CANModule:
         if in_cmd in self.commands:
             # 取出命令并检测命令是否开启
             cmd = self.commands[in_cmd]
-            if cmd.is_enabled:
+            if not cmd.is_enabled:
+                ret = CmdResult(
+                    cmdline=string, describe="命令被禁用", last_error=-2)
+            elif not cmd.blocking and not self._thr_block.acquire(timeout=self._timeout):
+                # 主循环正在执行模块的动作，最多等待'timeout'秒(一次动作调用)，超时不再与主循环并发执行
+                ret = CmdResult(
+                    cmdline=string, describe="模块忙, 请稍后重试", last_error=-3)
+            else:
+                # 阻塞的命令不持有模块锁执行，否则主循环会停止，甚至与命令等待的动作互相等待
                 try:
                     if cmd.num_params == 0 or (cmd.num_params == 1 and parameters is None):
                         if cmd.index is None:
@@ -276,10 +338,11 @@ class CANModule:
                     ret = CmdResult(
                         cmdline=string, describe="执行指令发生异常", last_error=-2, e=e)
                     # traceback.print_exc()
-            else:
-                ret = CmdResult(
-                    cmdline=string, describe="命令被禁用", last_error=-2)
-        self._thr_block.set()
+                finally:
+                    if not cmd.blocking:
+                        self._thr_block.release()
+        # 命令可能改变了模块的状态(例如写入了新的数据帧)，唤醒主循环
+        self.notify()
         return ret
 
     def do_effect(self, can_msg, args):
@@ -298,6 +361,164 @@ class CANModule:
             return self.do_effect(can_msg, args)
         return can_msg
 
+    def do_effect_batch(self, batch, args):
+        """
+        [回调函数] 批量管道模式下在引擎主循环中运行，一次处理管道中的一批数据帧。
+
+        默认实现对批量中的每一帧调用`do_effect`，随后再以一个空的消息调用一次`do_effect`，
+        让数据源类的模块有机会向管道中写入新的数据帧。需要一次读取多个数据帧的模块(例如IO模块)
+        应重写此函数，每次最多向管道追加`self._batch_size`个数据帧。
+
+        :param list batch: 在管道变量中的CAN消息结构列表。
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: list -- 在此函数执行过后的批量数据。
+        """
+        from frame.message.can import CANSploitMessage
+        for i in range(len(batch)):
+            batch[i] = self.do_effect(batch[i], args)
+        can_msg = self.do_effect(CANSploitMessage(), args)
+        if can_msg.CANData or can_msg.debugData:
+            batch.append(can_msg)
+        return batch
+
+    def do_batch(self, batch, args):
+        if self._active is True:
+            return self.do_effect_batch(batch, args)
+        return batch
+
+    async def do_effect_async(self, can_msg, args):
+        """
+        [回调函数] 在异步引擎(`AsyncL6Engine`)的事件循环中运行，默认直接调用`do_effect`。
+        需要等待IO的模块(例如发送数据)可以重写此函数，在等待时让出事件循环。
+
+        :param can.CANSploitMessage can_msg: 在管道变量中的CAN消息结构。
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: str -- 在此函数执行过后的can_msg信息。
+        """
+        return self.do_effect(can_msg, args)
+
+    async def do_async(self, can_msg, args):
+        if self._active is True:
+            return await self.do_effect_async(can_msg, args)
+        return can_msg
+
+    async def do_effect_batch_async(self, batch, args):
+        """
+        [回调函数] 异步引擎批量管道模式下运行，默认直接调用`do_effect_batch`。
+
+        :param list batch: 在管道变量中的CAN消息结构列表。
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: list -- 在此函数执行过后的批量数据。
+        """
+        return self.do_effect_batch(batch, args)
+
+    async def do_batch_async(self, batch, args):
+        if self._active is True:
+            return await self.do_effect_batch_async(batch, args)
+        return batch
+
+    def bind_waker(self, waker):
+        """
+        由引擎在事件驱动调度模式下调用，绑定主循环的唤醒器。
+
+        :param waker.EventWaker waker: 唤醒器，None表示解除绑定。
+        """
+        self._waker = waker
+
+    def notify(self):
+        """
+        通知引擎当前模块有新的数据可以处理。模块在其他线程中获取到数据后调用此函数，
+        在非事件驱动模式下此函数不做任何操作。
+        """
+        if self._waker is not None:
+            self._waker.notify()
+
+    def bind_pacer(self, pacer):
+        """
+        由引擎在加载模块时调用，绑定引擎的发送节拍器。
+
+        :param pacer.TxPacer pacer: 发送节拍器，None表示解除绑定。
+        """
+        self._pacer = pacer
+
+    def tx_bucket(self, args):
+        """
+        获取发送数据的动作使用的令牌桶。动作参数`pace`指定了总线名称时使用引擎中对应总线的令牌桶；否则动作参数
+        `delay`(秒)大于0时使用一个每`delay`秒发送一帧的令牌桶。
+
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: pacer.TokenBucket -- 令牌桶，None表示不限制发送速率。
+        """
+        if 'pace' in args and self._pacer is not None:
+            return self._pacer.bucket(args['pace'])
+        entry = self._tx_buckets.get(id(args))
+        if entry is None or entry[0] is not args:
+            delay = float(args.get('delay', 0))
+            entry = (args, TokenBucket(1.0 / delay) if delay > 0 else None)
+            self._tx_buckets[id(args)] = entry
+        return entry[1]
+
+    def tx_ready(self, args):
+        """
+        发送数据的动作在产生数据帧之前调用，判断令牌桶中是否有足够的令牌。
+
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: bool -- 是否可以发送。
+        """
+        bucket = self.tx_bucket(args)
+        return bucket is None or bucket.ready()
+
+    def tx_sent(self, args, can_frame):
+        """
+        发送数据的动作在产生数据帧之后调用，从令牌桶中扣除数据帧消耗的令牌。
+
+        :param dict args: 在方案文件中的动作参数。
+        :param frame.message.can.CANMessage can_frame: 产生的数据帧。
+        """
+        bucket = self.tx_bucket(args)
+        if bucket is not None:
+            bucket.consume(bucket.cost(can_frame))
+
+    def tx_due(self, args):
+        """
+        发送数据的动作下一次可以发送的时间点，用于实现`next_due`。
+
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: float -- `clock.now()`时间点，不限制发送速率时返回0。
+        """
+        bucket = self.tx_bucket(args)
+        if bucket is None:
+            return 0
+        return bucket.next_due()
+
+    def get_fileno(self, args):
+        """
+        [回调函数] 返回一个可以被`selectors`监听的文件描述符，当其可读时表示模块有数据需要处理。
+        在模块启动后由引擎获取。
+
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: int -- 文件描述符，没有则返回None。
+        """
+        return None
+
+    def next_due(self, args):
+        """
+        [回调函数] 事件驱动调度模式下，在管道中没有数据时引擎询问模块下一次需要运行的时间。
+
+        :param dict args: 在方案文件中的动作参数。
+
+        :returns: float -- `clock.now()`时间点，小于等于当前时间表示需要立即运行，
+                           None表示模块只在有事件时运行。
+        """
+        return None
+
     def do_init(self, params):
         """
         [回调函数] 在做所有工作之前进行的初始化工作。在模块的__init__中调用。
@@ -316,11 +537,27 @@ class CANModule:
 
     def stop(self, params):
         if self._active:
-            ret = self.do_stop(params)
-            self._thr_block.set()
-            return ret
+            return self.do_stop(params)
         return 0
 
+    def restart(self, params, running):
+        """修改动作参数后使用新的参数重启模块：暂时反激活模块，引擎运行时停止并重新启动模块，最后恢复原来的激活状态。
+
+        整个过程持有模块锁，主循环不会在模块停止(例如关闭了设备)时执行模块的动作。
+
+        :param dict params: 新的动作参数。
+        :param bool running: 引擎是否在运行，没有运行时只切换激活状态。
+        """
+        with self._thr_block:
+            active = self.is_active
+            if active:
+                self.do_activate(0)
+            if running:
+                self.do_stop(params)
+                self.do_start(params)
+            if active:
+                self.do_activate(1)
+
     def do_start(self, params):
         """
         [回调函数] 模块被激活时被调用的函数。
@@ -334,6 +571,32 @@ class CANModule:
             return self.do_start(params)
         return 0
 
+    async def do_start_async(self, params):
+        """
+        [回调函数] 异步引擎启动模块时在事件循环中调用，默认直接调用`do_start`。
+
+        :returns: int -- 开始状态。
+        """
+        return self.do_start(params)
+
+    async def start_async(self, params):
+        if self._active:
+            return await self.do_start_async(params)
+        return 0
+
+    async def do_stop_async(self, params):
+        """
+        [回调函数] 异步引擎停止模块时在事件循环中调用，默认直接调用`do_stop`。
+
+        :returns: int -- 停止的状态。
+        """
+        return self.do_stop(params)
+
+    async def stop_async(self, params):
+        if self._active:
+            return await self.do_stop_async(params)
+        return 0
+
     def do_exit(self, params):
         """
         [回调函数] 当模块退出时被调用的函数。
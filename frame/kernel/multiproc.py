@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+import pickle
+import threading
+import traceback
+import collections
+import multiprocessing
+
+from frame.kernel.module import Command
+from frame.kernel.waker import EventWaker
+from frame.kernel.pipeline import PipelineStage, connect_stages, pipe_options
+from frame.kernel.shmring import FrameRing, RingPipe
+from frame.stream.cmdres import CmdResult
+
+#
+# 工作进程使用'spawn'方式创建，避免复制主进程中的线程与硬件句柄
+#
+_ctx = multiprocessing.get_context('spawn')
+
+
+def _reply(conn, status, payload=None):
+    """向主进程回复，结果无法序列化时以字符串代替。"""
+    try:
+        pickle.dumps(payload)
+    except Exception:
+        payload = str(payload)
+    conn.send((status, payload))
+
+
+def _module_info(module):
+    commands = [(key, cmd.description, cmd.num_params, cmd.desc_params, cmd.is_enabled)
+                for key, cmd in module.commands.items()]
+    return {'name': module.name, 'help': module.help, 'version': module.version,
+            'commands': commands, 'active': module.is_active}
+
+
+def worker_main(spec, conn):
+    """
+    工作进程的入口。在工作进程中加载属于本组的模块，随后按照主进程发送的指令启动、停止模块或者调用模块的命令。
+    本组的动作在一个`PipelineStage`中执行，与其他进程之间通过共享内存环形缓冲区交换数据帧。
+
+    :param dict spec: 工作进程的描述，由`ProcessManager`生成。
+    :param multiprocessing.connection.Connection conn: 与主进程通信的连接。
+    """
+    from frame.kernel.engine import L6Engine
+
+    try:
+        engine = L6Engine(spec['engine'])
+        for module, init_params in spec['modules']:
+            engine._load_module(module, init_params, spec['strategy'])
+        actions = collections.OrderedDict()
+        for index, name, params in spec['actions']:
+            actions[index] = [name, engine._modules[name], params]
+        stage = PipelineStage(engine, spec['group'], list(actions.values()))
+        stage.waker.close()     # 每次启动时重新创建唤醒器
+        for pipe_name, ring_name, doorbell, lock, space, policy in spec['inputs']:
+            stage.inputs[pipe_name] = RingPipe(
+                pipe_name, FrameRing(ring_name), doorbell, lock, space, engine._batch, policy)
+        for pipe_name, ring_name, doorbell, lock, space, policy in spec['outputs']:
+            stage.outputs[pipe_name] = RingPipe(
+                pipe_name, FrameRing(ring_name), doorbell, lock, space, engine._batch, policy)
+    except Exception:
+        _reply(conn, 'error', traceback.format_exc())
+        return
+    _reply(conn, 'ok', {name: _module_info(module)
+                        for name, module in engine._modules.items()})
+
+    stop_e = threading.Event()
+    running = False
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            msg = ('exit',)
+        cmd = msg[0]
+        try:
+            if cmd == 'start' and not running:
+                stage.waker = EventWaker()
+                for name, module, params in stage.actions:
+                    module.bind_waker(stage.waker)
+                    module._batch_size = engine._batch
+                    module.start(params)
+                for name, module, params in stage.actions:
+                    fileno = module.get_fileno(params) if module.is_active else None
+                    if fileno is not None:
+                        stage.waker.register(fileno, module)
+                for link in stage.inputs.values():
+                    stage.waker.register(link.fileno(), None, link.drain)
+                stop_e.clear()
+                stage.start(stop_e)
+                running = True
+                _reply(conn, 'ok')
+            elif cmd == 'stop' or cmd == 'exit':
+                if running:
+                    stop_e.set()
+                    stage.waker.notify()
+                    stage.join()
+                    for name, module, params in stage.actions:
+                        module.stop(params)
+                        module.bind_waker(None)
+                    stage.waker.close()
+                    running = False
+                if cmd == 'exit':
+                    for name, module, params in stage.actions:
+                        module.exit(params)
+                    for link in list(stage.inputs.values()) + list(stage.outputs.values()):
+                        link.close()
+                    _reply(conn, 'ok')
+                    return
+                _reply(conn, 'ok')
+            elif cmd == 'call':
+                module = engine._modules[msg[1]]
+                result = getattr(module, msg[2])(*msg[3])
+                _reply(conn, 'ok', (result, module.is_active))
+            elif cmd == 'edit':
+                actions[msg[1]][2] = msg[2]
+                _reply(conn, 'ok')
+            elif cmd == 'restart':
+                module = engine._modules[msg[1]]
+                module.restart(msg[2], running)
+                _reply(conn, 'ok', module.is_active)
+            else:
+                _reply(conn, 'error', "不支持的指令 '{}'.".format(cmd))
+        except Exception:
+            _reply(conn, 'error', traceback.format_exc())
+
+
+class WorkerGroup:
+
+    """主进程中对一个工作进程的描述。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.modules = []       # (模块名称, 初始化参数)
+        self.actions = []       # (动作索引, 模块名称, 动作参数)
+        self.inputs = []
+        self.outputs = []
+        self._conn = None
+        self._process = None
+        self._lock = threading.Lock()
+
+    def spawn(self, engine_params, strategy):
+        self._conn, child_conn = _ctx.Pipe()
+        spec = {
+            'group': self.name,
+            'strategy': strategy,
+            'engine': engine_params,
+            'modules': self.modules,
+            'actions': self.actions,
+            'inputs': self.inputs,
+            'outputs': self.outputs,
+        }
+        self._process = _ctx.Process(target=worker_main, args=(spec, child_conn),
+                                     name='canfuzz-{}'.format(self.name))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        return self._recv()
+
+    def _recv(self):
+        try:
+            status, payload = self._conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError("工作进程 '{}' 已经退出.".format(self.name))
+        if status != 'ok':
+            raise RuntimeError("工作进程 '{}' 执行出错:\n{}".format(self.name, payload))
+        return payload
+
+    def request(self, *msg):
+        """向工作进程发送一条指令并等待回复。
+
+        :return: 工作进程的回复内容。
+
+        :raises RuntimeError: 工作进程执行出错或者已经退出。
+        """
+        with self._lock:
+            try:
+                self._conn.send(msg)
+            except (EOFError, OSError):
+                raise RuntimeError("工作进程 '{}' 已经退出.".format(self.name))
+            return self._recv()
+
+    def join(self, timeout=None):
+        if self._process is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RemoteModule:
+
+    """
+    运行在工作进程中的模块在主进程中的代理。命令行与引擎通过它查询模块的信息、调用模块的命令，
+    模块的启动、停止与执行都在工作进程中完成。
+    """
+
+    def __init__(self, group, key):
+        self.group = group
+        self.key = key
+        self.name = key
+        self.help = None
+        self.version = 0.0
+        self.commands = collections.OrderedDict()
+        self._active = True
+        self._batch_size = 0
+        self._thr_block = threading.RLock()
+
+    def update_info(self, info):
+        self.name = info['name']
+        self.help = info['help']
+        self.version = info['version']
+        self._active = info['active']
+        self.commands.clear()
+        for key, description, num_params, desc_params, is_enabled in info['commands']:
+            self.commands[key] = Command(description, num_params, desc_params, None, is_enabled)
+
+    def _call(self, method, *args):
+        result, self._active = self.group.request('call', self.key, method, args)
+        return result
+
+    @property
+    def is_active(self):
+        return self._active
+
+    def raw_write(self, string):
+        try:
+            return self._call('raw_write', string)
+        except RuntimeError as e:
+            return CmdResult(cmdline=string, describe=str(e), last_error=-2, e=e)
+
+    def get_status(self):
+        return self._call('get_status')
+
+    def do_activate(self, mode=-1):
+        return self._call('do_activate', mode)
+
+    def do_output_screen(self, mode=-1):
+        return self._call('do_output_screen', mode)
+
+    def do_trace(self, mode=-1):
+        return self._call('do_trace', mode)
+
+    def do_start(self, params):
+        return self._call('do_start', params)
+
+    def do_stop(self, params):
+        return self._call('do_stop', params)
+
+    def start(self, params):
+        return 0    # 由工作进程启动
+
+    def stop(self, params):
+        return 0    # 由工作进程停止
+
+    def exit(self, params):
+        return 0    # 由工作进程退出
+
+    def bind_waker(self, waker):
+        pass
+
+    def notify(self):
+        pass
+
+    def get_fileno(self, args):
+        return None
+
+    def next_due(self, args):
+        return None
+
+
+class ProcessManager:
+
+    """
+    多进程执行模式。动作参数中的`process`指定动作所在的工作进程，没有指定的动作在主进程中执行。
+    同一个管道变量在不同进程之间通过共享内存环形缓冲区(`shmring.RingPipe`)连接，数据按照动作列表的
+    顺序从前一个进程流向后一个进程。
+
+    注意：一个模块的所有动作必须在同一个进程中，跨进程只传递携带CAN数据的帧，调试信息不会跨进程传递。
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._groups = collections.OrderedDict()
+        self._rings = []
+        self._stop_e = threading.Event()
+        self.stage = None
+        self.links = []
+
+    def add_module(self, group, module, init_params):
+        """添加一个在工作进程中加载的模块。
+
+        :param str group: 工作进程的名称。
+        :param str module: 策略文件中的模块名称。
+        :param dict init_params: 模块的初始化参数。
+
+        :return: 模块在主进程中的代理。
+        :rtype: RemoteModule
+        """
+        group = str(group)
+        if group not in self._groups:
+            self._groups[group] = WorkerGroup(group)
+        self._groups[group].modules.append((module, init_params))
+        return RemoteModule(self._groups[group], module.rsplit('/', 1)[-1])
+
+    def spawn(self, actions, strategy=''):
+        """按照动作列表创建进程之间的环形缓冲区并启动所有的工作进程。
+
+        :param list actions: 引擎的动作列表。
+        :param str strategy: 策略名称，用于错误信息。
+        """
+        engine = self._engine
+        group_of = []
+        local_actions = []
+        for index, (name, module, params) in enumerate(actions):
+            if isinstance(module, RemoteModule):
+                module.group.actions.append((index, name, params))
+                group_of.append(module.group.name)
+            else:
+                local_actions.append([name, module, params])
+                group_of.append(None)
+        self.stage = PipelineStage(engine, 'main', local_actions)
+        self.stage.waker.close()    # 每次启动时重新创建唤醒器
+
+        for pipe_name, prev, stage in connect_stages(actions, group_of):
+            depth, policy = pipe_options(engine, pipe_name)
+            ring = FrameRing(capacity=depth)
+            self._rings.append(ring)
+            recv_end, send_end = _ctx.Pipe(duplex=False)
+            lock = _ctx.Lock()
+            space = _ctx.Event()
+            if prev is None:
+                link = RingPipe(pipe_name, ring, send_end, lock, space, engine._batch, policy)
+                self.stage.outputs[pipe_name] = link
+                self.links.append(link)
+            else:
+                self._groups[prev].outputs.append((pipe_name, ring.name, send_end, lock, space, policy))
+            if stage is None:
+                link = RingPipe(pipe_name, ring, recv_end, lock, space, engine._batch, policy)
+                self.stage.inputs[pipe_name] = link
+                self.links.append(link)
+            else:
+                self._groups[stage].inputs.append((pipe_name, ring.name, recv_end, lock, space, policy))
+
+        engine_params = {
+            'timeout': engine._timeout,
+            'debug': engine._DEBUG,
+            'path_modules': engine._path_modules,
+            'output_screen': str(engine._output_screen),
+            'idle_timeout': engine._idle_timeout,
+            'batch': engine._batch,
+            'pacer': engine._pacer.config,
+        }
+        for group in self._groups.values():
+            infos = group.spawn(engine_params, strategy)
+            for name, module, params in actions:
+                if isinstance(module, RemoteModule) and module.group is group:
+                    module.update_info(infos[module.key])
+
+    def bind(self):
+        """创建主进程阶段的唤醒器并绑定到主进程中的模块，需要在模块启动之前调用。"""
+        self.stage.waker = EventWaker()
+        for name, module, params in self.stage.actions:
+            module.bind_waker(self.stage.waker)
+        return self
+
+    def register_sources(self):
+        """将主进程中模块的文件描述符以及环形缓冲区的门铃注册到唤醒器中。"""
+        waker = self.stage.waker
+        for name, module, params in self.stage.actions:
+            if not module.is_active:
+                continue
+            fileno = module.get_fileno(params)
+            if fileno is not None:
+                waker.register(fileno, module)
+        for link in self.stage.inputs.values():
+            waker.register(link.fileno(), None, link.drain)
+
+    def start(self):
+        for group in self._groups.values():
+            group.request('start')
+        self._stop_e.clear()
+        self.stage.start(self._stop_e)
+
+    def stop(self):
+        self._stop_e.set()
+        self.stage.waker.notify()
+        self.stage.join()
+        for group in self._groups.values():
+            group.request('stop')
+
+    def close(self):
+        """解除主进程中模块与唤醒器的绑定。"""
+        for name, module, params in self.stage.actions:
+            module.bind_waker(None)
+        self.stage.waker.close()
+
+    def edit(self, index, module, params):
+        """修改工作进程中动作的参数，进程之间的连接在加载策略时已经确定，不会随之改变。"""
+        module.group.request('edit', index, params)
+
+    def restart(self, module, params):
+        """在工作进程中使用新的参数重启模块，参见`CANModule.restart`。"""
+        module._active = module.group.request('restart', module.key, params)
+
+    def status(self):
+        """获取主进程一侧各个环形缓冲区的状态。
+
+        :return: 一个列表，每项为(管道名称, 当前长度, 深度, 丢弃计数)。
+        :rtype: list
+        """
+        return [(link.name, len(link), link.depth, link.dropped) for link in self.links]
+
+    def shutdown(self):
+        """退出所有的工作进程并释放共享内存。"""
+        for group in self._groups.values():
+            try:
+                group.request('exit')
+            except RuntimeError:
+                pass
+            group.join(3)
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+        self._groups.clear()
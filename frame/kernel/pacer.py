@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+
+from frame.kernel import clock
+from frame.message.can import FD_BRS, FD_FDF
+
+
+def fd_frame_bits(length, extended, brs=False, data_ratio=1.0):
+    """计算一个CAN FD数据帧在总线上最多占用的位数，按照ISO 11898-1:2015的帧格式：
+
+    * 仲裁段按照标称波特率发送：标准帧17位、扩展帧36位(到BRS为止)，CRC界定符、应答、帧结束与帧间隔共13位。
+    * 数据段从ESI开始：ESI与DLC共5位、数据8n位、填充计数4位，数据不超过16字节时CRC为17位，否则为21位，
+      CRC与填充计数中每4位有一个固定填充位(6或者7位)。
+    * 从SOF到数据结束的动态填充位按照最坏情况(每4位一个)计算。
+
+    设置了BRS时数据段按照更高的波特率发送，其位数乘以`data_ratio`(标称波特率/数据段波特率)折算为标称的位数。
+
+    :param int length: 数据长度(已经是`DLC_TO_LEN`中的值)。
+    :param bool extended: 是否扩展帧。
+    :param bool brs: 数据段是否切换波特率。
+    :param float data_ratio: 标称波特率与数据段波特率的比值。
+
+    :return: 折算为标称波特率的位数，向上取整。
+    :rtype: int
+    """
+    arbitration = 36 if extended else 17
+    data = 5 + 8 * length
+    stuff = (arbitration + data - 1) // 4
+    arbitration_stuff = (arbitration - 1) // 4
+    if length <= 16:
+        crc = 4 + 17 + 6
+    else:
+        crc = 4 + 21 + 7
+    nominal = arbitration + arbitration_stuff + 13
+    data_phase = data + stuff - arbitration_stuff + crc
+    if brs:
+        return nominal + int(math.ceil(data_phase * data_ratio))
+    return nominal + data_phase
+
+
+def frame_bits(can_frame, data_ratio=1.0):
+    """计算一个CAN数据帧在总线上最多占用的位数(包含最坏情况下的填充位与帧间隔)。
+
+    经典CAN的标准帧为`8n + 47 + (34 + 8n - 1) // 4`，扩展帧为`8n + 67 + (54 + 8n - 1) // 4`，n为数据长度。
+    CAN FD数据帧(`FD_FDF`)参见`fd_frame_bits`。
+
+    :param frame.message.can.CANMessage can_frame: CAN数据帧，None时按照8字节的扩展帧计算。
+    :param float data_ratio: 标称波特率与数据段波特率的比值，用于设置了`FD_BRS`的CAN FD数据帧。
+
+    :rtype: int
+    """
+    if can_frame is None:
+        length, extended = 8, True
+    else:
+        length, extended = can_frame.frame_length, can_frame.frame_ext
+        flags = can_frame.frame_flags
+        if flags & FD_FDF:
+            return fd_frame_bits(length, extended, flags & FD_BRS, data_ratio)
+    if extended:
+        return 8 * length + 67 + (54 + 8 * length - 1) // 4
+    return 8 * length + 47 + (34 + 8 * length - 1) // 4
+
+
+#: 一个经典CAN数据帧最多占用的位数，用于计算突发的容量
+MAX_FRAME_BITS = frame_bits(None)
+
+
+class TokenBucket:
+
+    """
+    令牌桶，按照GCRA(虚拟调度)的方式实现：只保存理论上的下一次到达时间，不需要定时补充令牌。
+
+    每秒产生`rate`个令牌，最多可以积累`burst`次发送的令牌。每次发送消耗`cost`个令牌，令牌不足时
+    `ready`返回False，`next_due`给出可以发送的时间点，引擎在事件驱动模式下据此休眠而不是空转。
+    """
+
+    def __init__(self, rate, burst=1, unit=1):
+        """
+        :param float rate: 每秒产生的令牌数。
+        :param int burst: 突发的容量，最多可以连续发送的次数。
+        :param int unit: 一次发送的标称令牌数，用于计算突发的容量。
+        """
+        if rate <= 0:
+            raise ValueError("无效的速率 '{}'.".format(rate))
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._interval = 1.0 / self.rate
+        self._tolerance = (self.burst - 1) * unit * self._interval
+        self._tat = 0.0     # 理论上的下一次到达时间
+        self._lock = threading.Lock()
+
+    def next_due(self):
+        """可以发送的最早时间点。
+
+        :return: `clock.now()`时间点。
+        :rtype: float
+        """
+        return self._tat - self._tolerance
+
+    def ready(self, now=None):
+        """当前是否可以发送。
+
+        :param float now: 当前的`clock.now()`时间点，None时自动获取。
+
+        :rtype: bool
+        """
+        if now is None:
+            now = clock.now()
+        return now >= self._tat - self._tolerance
+
+    def consume(self, cost=1, now=None):
+        """发送后消耗令牌。
+
+        :param float cost: 消耗的令牌数。
+        :param float now: 当前的`clock.now()`时间点，None时自动获取。
+        """
+        if now is None:
+            now = clock.now()
+        with self._lock:
+            self._tat = max(self._tat, now) + cost * self._interval
+
+    def try_consume(self, cost=1, now=None):
+        """如果可以发送则消耗令牌。
+
+        :return: 是否可以发送。
+        :rtype: bool
+        """
+        if now is None:
+            now = clock.now()
+        with self._lock:
+            if now < self._tat - self._tolerance:
+                return False
+            self._tat = max(self._tat, now) + cost * self._interval
+            return True
+
+    def wait(self, cost=1, stop_e=None):
+        """休眠直到可以发送，随后消耗令牌。用于命令等不在主循环中发送的场景。
+
+        :param float cost: 消耗的令牌数。
+        :param threading.Event stop_e: 停止事件，设置后立即返回。
+
+        :return: 是否可以发送，被停止时返回False。
+        :rtype: bool
+        """
+        while not self.try_consume(cost):
+            delay = self.next_due() - clock.now()
+            if stop_e is not None:
+                if clock.wait(stop_e, delay):
+                    return False
+            else:
+                clock.sleep(delay)
+        return True
+
+    def cost(self, can_frame):
+        """一个数据帧消耗的令牌数。"""
+        return 1
+
+
+class BusBucket(TokenBucket):
+
+    """
+    一条总线的令牌桶。
+
+    * 指定`rate`时按照帧计数，每秒最多发送`rate`个数据帧。
+    * 否则按照位计数，每秒产生`bitrate * load / 100`个令牌，每个数据帧按照`frame_bits`消耗令牌，
+      因此不同长度的数据帧都可以精确地达到目标的总线负载。CAN FD数据帧的数据段按照`data_bitrate`折算。
+
+    `burst`为可以连续发送的数据帧数量，`fd`为True时按照最长的CAN FD数据帧(64字节)计算突发的容量。
+    """
+
+    def __init__(self, bitrate=500000, load=100, burst=1, rate=None, data_bitrate=None, fd=False):
+        self.bitrate = int(bitrate)
+        self.data_bitrate = int(data_bitrate) if data_bitrate else self.bitrate
+        self.load = float(load)
+        self.per_frame = rate is not None
+        if not 0 < self.load <= 100:
+            raise ValueError("无效的总线负载 '{}'.".format(load))
+        if self.data_bitrate < self.bitrate:
+            raise ValueError("无效的数据段波特率 '{}'.".format(data_bitrate))
+        self.data_ratio = self.bitrate / float(self.data_bitrate)
+        if self.per_frame:
+            super().__init__(float(rate), burst)
+        else:
+            unit = fd_frame_bits(64, True, True, self.data_ratio) if fd else MAX_FRAME_BITS
+            super().__init__(self.bitrate * self.load / 100.0, burst, unit)
+
+    def cost(self, can_frame):
+        if self.per_frame:
+            return 1
+        return frame_bits(can_frame, self.data_ratio)
+
+
+class TxPacer:
+
+    """
+    引擎的发送节拍器，每条总线对应一个`BusBucket`。策略文件中通过引擎参数`pacer`配置：
+
+    ```python
+    engine = {'pacer': {'can0': {'bitrate': 500000, 'load': 30, 'burst': 4},
+                        'can1': {'rate': 1000}}}
+    ```
+
+    发送数据的动作通过动作参数`pace`指定总线名称来使用对应的令牌桶，没有配置的总线按照默认参数
+    (500kbit/s, 100%负载)创建。同一条总线上的所有动作共用一个令牌桶。
+    """
+
+    def __init__(self, config=None):
+        self._config = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        if config:
+            self.configure(config)
+
+    @property
+    def config(self):
+        return dict(self._config)
+
+    def configure(self, config):
+        """更新总线的配置，已有的令牌桶会被重新创建。
+
+        :param dict config: 总线名称与令牌桶参数的字典。
+
+        :raises ValueError: 参数无效。
+        """
+        buckets = {}
+        for bus, params in config.items():
+            try:
+                buckets[str(bus)] = BusBucket(**params)
+            except TypeError:
+                raise ValueError("无效的总线参数 '{}': {}.".format(bus, params))
+        with self._lock:
+            self._config.update({str(bus): dict(params) for bus, params in config.items()})
+            self._buckets.update(buckets)
+
+    def bucket(self, bus):
+        """获取总线对应的令牌桶，没有配置时按照默认参数创建。
+
+        :param str bus: 总线名称。
+
+        :rtype: BusBucket
+        """
+        bus = str(bus)
+        bucket = self._buckets.get(bus)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(bus, BusBucket())
+        return bucket
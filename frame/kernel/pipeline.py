@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+import threading
+import collections
+
+from frame.kernel.waker import EventWaker
+
+
+class BoundedPipe:
+
+    """
+    流水线模式下连接两个阶段的有界队列，对应策略文件中的一个管道变量。
+
+    当队列满时，按照策略进行处理：
+
+    * `'block'` 上游阶段阻塞等待，直到下游阶段取走数据。
+    * `'drop'`  丢弃新放入的数据，并增加丢弃计数。
+    """
+
+    def __init__(self, name, depth=1024, policy='block'):
+        if policy not in ['block', 'drop']:
+            raise ValueError("不支持的队列策略 '{}'.".format(policy))
+        self.name = name
+        self.depth = max(1, int(depth))
+        self.policy = policy
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._not_full = threading.Condition(threading.Lock())
+        self._consumer = None       # 下游阶段的唤醒器
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, item, stop_e):
+        """放入一个管道变量。
+
+        :param item: 管道变量，单个CAN消息结构或者批量列表。
+        :param threading.Event stop_e: 流水线的停止事件，阻塞时用于退出。
+
+        :return: 放入成功返回True，被丢弃返回False。
+        :rtype: bool
+        """
+        with self._not_full:
+            while len(self._queue) >= self.depth:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    return False
+                if stop_e.is_set():
+                    return False
+                self._not_full.wait(0.1)
+            self._queue.append(item)
+        if self._consumer is not None:
+            self._consumer.notify()
+        return True
+
+    def get(self):
+        """取出一个管道变量，队列为空时返回None。"""
+        with self._not_full:
+            if not self._queue:
+                return None
+            item = self._queue.popleft()
+            self._not_full.notify()
+        return item
+
+    def arm(self):
+        """下游阶段准备休眠前调用，进程内的队列在放入数据时总会唤醒下游阶段，这里什么也不做。"""
+        pass
+
+    def wakeup(self):
+        """唤醒所有阻塞在此队列上的上游阶段。"""
+        with self._not_full:
+            self._not_full.notify_all()
+
+
+def pipe_options(engine, pipe_name):
+    """获取管道变量对应队列的深度与策略。
+
+    :return: (深度, 策略)
+    :rtype: tuple
+    """
+    pipe_params = engine._pipe_params
+    params = pipe_params.get(pipe_name, pipe_params.get(str(pipe_name), {}))
+    depth = int(params.get('depth', engine._queue_depth))
+    policy = str(params.get('policy', engine._queue_policy)).lower()
+    return depth, policy
+
+
+def connect_stages(actions, stage_of):
+    """按照动作的顺序，找出使用相同管道变量的相邻阶段之间的连接。
+
+    :param list actions: 动作列表。
+    :param list stage_of: 与动作列表一一对应的阶段名称。
+
+    :raises ValueError: 同一个管道变量在阶段之间形成了环。
+
+    :return: 一个列表，每项为(管道名称, 上游阶段名称, 下游阶段名称)。
+    :rtype: list
+    """
+    links = []
+    last = {}
+    outputs = set()
+    inputs = set()
+    for action, stage in zip(actions, stage_of):
+        pipe_name = action[2]['pipe']
+        prev = last.get(pipe_name, stage)
+        if prev != stage:
+            if (prev, pipe_name) in outputs or (stage, pipe_name) in inputs or (stage, pipe_name) in outputs:
+                raise ValueError("管道 '{}' 在阶段 '{}' 与 '{}' 之间形成了环.".format(
+                    pipe_name, prev, stage))
+            outputs.add((prev, pipe_name))
+            inputs.add((stage, pipe_name))
+            links.append((pipe_name, prev, stage))
+        last[pipe_name] = stage
+    return links
+
+
+class _WakerFanout:
+
+    """当一个模块出现在多个阶段中时，模块的`notify`需要唤醒所有这些阶段。"""
+
+    def __init__(self, wakers):
+        self._wakers = wakers
+
+    def notify(self):
+        for waker in self._wakers:
+            waker.notify()
+
+
+class PipelineStage:
+
+    """
+    流水线中的一个阶段，在独立的线程中依次执行属于自己的动作。阶段开始时从输入队列中取出管道变量，
+    执行完毕后将携带数据的管道变量放入输出队列。
+    """
+
+    def __init__(self, engine, name, actions):
+        self.name = name
+        self.actions = actions
+        self.inputs = collections.OrderedDict()     # 管道名称 -> BoundedPipe
+        self.outputs = collections.OrderedDict()    # 管道名称 -> BoundedPipe
+        self.waker = EventWaker()
+        self._engine = engine
+        self._thread = None
+
+    def _inputs_pending(self):
+        for link in self.inputs.values():
+            if len(link) > 0:
+                return True
+        return False
+
+    def run(self, stop_e):
+        """阶段线程的主循环。"""
+        engine = self._engine
+        while not stop_e.is_set():
+            pipes = {}
+            for pipe_name, link in self.inputs.items():
+                item = link.get()
+                if item is not None:
+                    pipes[pipe_name] = item
+
+            engine._run_pass(self.actions, pipes)
+
+            for pipe_name, link in self.outputs.items():
+                item = pipes.get(pipe_name)
+                if item is not None and engine._pipe_has_data(item):
+                    link.put(item, stop_e)
+
+            for link in self.inputs.values():
+                link.arm()
+            if self._inputs_pending():
+                continue
+            engine._wait_event(pipes, self.actions, self.waker)
+
+    def start(self, stop_e):
+        self._thread = threading.Thread(target=self.run, args=(stop_e,), name='stage-{}'.format(self.name))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class Pipeline:
+
+    """
+    流水线执行模式。将引擎的动作列表按照动作参数中的`stage`划分为多个阶段，没有指定`stage`的动作
+    单独成为一个阶段。同一个管道变量在不同阶段之间通过`BoundedPipe`连接，数据按照动作列表的顺序
+    从前一个阶段流向后一个阶段。
+
+    注意：同一个模块对象出现在多个阶段中时会被多个线程同时调用，如果模块不是线程安全的，需要将其
+    所有动作指定为同一个`stage`。
+    """
+
+    def __init__(self, engine, actions):
+        self._engine = engine
+        self._stop_e = threading.Event()
+        self.stages = []
+        self.links = []
+        self._build(actions)
+        self._bind_modules()
+
+    def _build(self, actions):
+        stages = collections.OrderedDict()
+        stage_of = []
+        for index, action in enumerate(actions):
+            name, module, params = action
+            if 'stage' in params:
+                key = ('stage', params['stage'])
+                stage_name = str(params['stage'])
+            else:
+                key = ('action', index)
+                stage_name = '{}:{}'.format(index, name)
+            if key not in stages:
+                stages[key] = PipelineStage(self._engine, stage_name, [])
+            stages[key].actions.append(action)
+            stage_of.append(stages[key])
+        self.stages = list(stages.values())
+        stages_by_name = {stage.name: stage for stage in self.stages}
+
+        for pipe_name, prev, stage in connect_stages(actions, [s.name for s in stage_of]):
+            depth, policy = pipe_options(self._engine, pipe_name)
+            link = BoundedPipe(pipe_name, depth, policy)
+            link._consumer = stages_by_name[stage].waker
+            stages_by_name[prev].outputs[pipe_name] = link
+            stages_by_name[stage].inputs[pipe_name] = link
+            self.links.append(link)
+
+    def _bind_modules(self):
+        """将模块绑定到其所在阶段的唤醒器上。"""
+        wakers = collections.OrderedDict()
+        for stage in self.stages:
+            for name, module, params in stage.actions:
+                wakers.setdefault(id(module), (module, []))
+                if stage.waker not in wakers[id(module)][1]:
+                    wakers[id(module)][1].append(stage.waker)
+        for module, module_wakers in wakers.values():
+            if len(module_wakers) == 1:
+                module.bind_waker(module_wakers[0])
+            else:
+                module.bind_waker(_WakerFanout(module_wakers))
+
+    def register_sources(self):
+        """将已经启动模块的文件描述符注册到所在阶段的唤醒器中。"""
+        for stage in self.stages:
+            for name, module, params in stage.actions:
+                if not module.is_active:
+                    continue
+                fileno = module.get_fileno(params)
+                if fileno is not None:
+                    stage.waker.register(fileno, module)
+            for link in stage.inputs.values():
+                if hasattr(link, 'drain'):
+                    stage.waker.register(link.fileno(), None, link.drain)
+
+    def start(self):
+        self._stop_e.clear()
+        for stage in self.stages:
+            stage.start(self._stop_e)
+
+    def stop(self):
+        self._stop_e.set()
+        for link in self.links:
+            link.wakeup()
+        for stage in self.stages:
+            stage.waker.notify()
+        for stage in self.stages:
+            stage.join()
+
+    def close(self):
+        """解除模块与唤醒器的绑定并释放资源。"""
+        for stage in self.stages:
+            for name, module, params in stage.actions:
+                module.bind_waker(None)
+            stage.waker.close()
+
+    def status(self):
+        """获取各个队列的状态。
+
+        :return: 一个列表，每项为(管道名称, 当前长度, 深度, 丢弃计数)。
+        :rtype: list
+        """
+        return [(link.name, len(link), link.depth, link.dropped) for link in self.links]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from frame.kernel import clock
+from frame.message.can import CANSploitMessage
+
+
+class ActionPlan:
+
+    """
+    预先编译的动作计划。主循环每一轮都要遍历动作列表、查找管道变量并创建新的CAN消息结构，编译后：
+
+    * 每个管道变量对应一个固定的槽位，动作中保存的是槽位的索引而不是管道名称。
+    * 模块的`do_effect`(批量模式下为`do_effect_batch`)方法与模块锁在编译时绑定，执行时直接检查模块的
+      激活状态，省去`is_active`与`do`的调用。
+    * 指定了调度策略(`schedule`)的动作在编译时取得其`ActionSchedule`，没有指定的动作不需要任何额外的判断。
+    * 槽位中的CAN消息结构在下一轮中复用，没有携带数据的消息原地重置。携带了数据的消息可能被模块保存
+      (例如`analyze`,`sniffer`会缓存收到的消息)，因此不会被复用，而是换成新的消息结构。
+
+    动作列表或者动作参数改变后需要重新编译。
+    """
+
+    def __init__(self, actions, batch=False, schedule_of=None):
+        # schedule_of: 根据动作参数获取调度策略的函数，为None时忽略动作的调度策略
+        self.batch = batch
+        self.steps = []         # (模块, 绑定的方法, 模块锁, 动作参数, 槽位, 调度策略)
+        self.pipe_names = []
+        slots = {}
+        for name, module, params in actions:
+            pipe_name = params['pipe']
+            if pipe_name not in slots:
+                slots[pipe_name] = len(self.pipe_names)
+                self.pipe_names.append(pipe_name)
+            method = module.do_effect_batch if batch else module.do_effect
+            schedule = schedule_of(params) if schedule_of is not None else None
+            self.steps.append((module, method, module._thr_block, params, slots[pipe_name], schedule))
+        self.slots = [self._new_slot() for _ in self.pipe_names]
+
+    def _new_slot(self):
+        return [] if self.batch else CANSploitMessage()
+
+    def run(self):
+        """依次执行一轮动作，结果保存在槽位中。"""
+        slots = self.slots
+        for module, method, block, params, slot, schedule in self.steps:
+            if module._active is not True:
+                continue
+            if schedule is not None and not schedule.ready(slots[slot]):
+                continue
+            with block:
+                slots[slot] = method(slots[slot], params)
+
+    def pipes(self):
+        """以管道名称为键获取本轮的管道变量，用于事件驱动模式下判断是否需要休眠。
+
+        :rtype: dict
+        """
+        return dict(zip(self.pipe_names, self.slots))
+
+    def recycle(self):
+        """为下一轮准备槽位。"""
+        slots = self.slots
+        for index, item in enumerate(slots):
+            if self.batch:
+                if item:
+                    slots[index] = []
+            elif item.CANData or item.debugData:
+                slots[index] = CANSploitMessage()
+            else:
+                item.reset()
+
+
+class ActionSchedule:
+
+    """
+    动作的调度策略，对应动作参数中的`schedule`，没有指定时动作每一轮都执行：
+
+    * `{'every': N}`      每N轮执行一次。
+    * `{'period': T}`     每隔T毫秒执行一次。
+    * `'on_data'`或者`{'on_data': True}`   只有管道中携带数据时执行。
+
+    字典形式的几个条件可以组合，例如`{'on_data': True, 'every': 4}`。
+    """
+
+    def __init__(self, every=1, period=0, on_data=False):
+        self.every = max(1, int(every))
+        self.period = max(0.0, float(period)) / 1000.0
+        self.on_data = bool(on_data)
+        self._tick = 0
+        self._next = 0.0
+
+    @staticmethod
+    def parse(spec):
+        """解析动作参数中的`schedule`。
+
+        :param spec: 调度策略的描述。
+
+        :raises ValueError: 调度策略无效。
+
+        :return: 调度策略，没有指定时返回None。
+        :rtype: ActionSchedule
+        """
+        if spec is None:
+            return None
+        if spec == 'on_data':
+            return ActionSchedule(on_data=True)
+        if not isinstance(spec, dict) or not set(spec) <= {'every', 'period', 'on_data'}:
+            raise ValueError("无效的调度策略 '{}'.".format(spec))
+        return ActionSchedule(spec.get('every', 1), spec.get('period', 0), spec.get('on_data', False))
+
+    def ready(self, item):
+        """判断本轮是否执行动作。
+
+        :param item: 动作对应的管道变量，管道还没有创建时为None。
+
+        :rtype: bool
+        """
+        if self.on_data:
+            if item is None:
+                return False
+            if isinstance(item, list):
+                if not item:
+                    return False
+            elif not (item.CANData or item.debugData):
+                return False
+        if self.every > 1:
+            self._tick += 1
+            if self._tick < self.every:
+                return False
+            self._tick = 0
+        if self.period > 0:
+            now = clock.now()
+            if now < self._next:
+                return False
+            self._next = now + self.period
+        return True
+
+    def next_due(self, due):
+        """事件驱动模式下结合调度策略修正模块给出的下一次运行时间。
+
+        :param float due: 模块`next_due`的返回值。
+
+        :return: 修正后的时间点，None表示只在有事件时运行。
+        :rtype: float
+        """
+        if self.on_data:
+            return None     # 只在上游有数据时执行，数据到达时会唤醒主循环
+        if due is not None and self.period > 0:
+            return max(due, self._next)
+        return due
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import threading
+import collections
+
+
+class SamplingProfiler:
+
+    """
+    采样分析器。后台线程按照固定的间隔通过`sys._current_frames()`获取所有线程(引擎线程、模块线程以及执行模块命令的
+    命令行线程)当前的调用栈并计数，不需要修改被分析的代码，也不需要重启引擎，开销只与采样频率有关。
+
+    结果为折叠格式(collapsed stacks)，每行是以`;`分隔的调用栈(从线程名到最内层的函数)与采样次数，可以直接交给
+    `flamegraph.pl`或者`speedscope`生成火焰图：
+
+    ```
+    Thread-1 (main_loop);engine.py:main_loop;engine.py:_run_pass;filter.py:do_effect 42
+    ```
+
+    采样的是墙上时间，等待中的线程(例如等待输入的命令行线程)同样会被计入。
+    """
+
+    #: 每个调用栈最多记录的层数
+    MAX_DEPTH = 128
+
+    def __init__(self, interval=0.005):
+        """
+        :param float interval: 采样间隔(秒)。
+
+        :raises ValueError: 采样间隔不是正数。
+        """
+        if interval <= 0:
+            raise ValueError("采样间隔必须大于0.")
+        self.interval = interval
+        self.samples = 0
+        self.elapsed = 0.0
+        self._stacks = collections.Counter()
+        self._labels = {}
+        self._names = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._started = 0.0
+
+    @property
+    def running(self):
+        """是否正在采样。"""
+        return self._thread is not None
+
+    def start(self):
+        """在后台线程中开始采样，之前的结果会保留并累加。"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止采样。"""
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self.elapsed += time.perf_counter() - self._started
+
+    def clear(self):
+        """清空采样结果。"""
+        self._stacks = collections.Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    def _label(self, code):
+        # 同一个代码对象的名称只生成一次
+        label = self._labels.get(code)
+        if label is None:
+            label = '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+            self._labels[code] = label
+        return label
+
+    def _thread_name(self, ident):
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._names.get(ident, str(ident))
+        return name
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(own)
+
+    def sample(self, skip=None):
+        """采集一次所有线程的调用栈。
+
+        :param int skip: 不采集的线程标识，通常是采样线程本身。
+        """
+        stacks = self._stacks
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            labels = []
+            while frame is not None and len(labels) < self.MAX_DEPTH:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            labels.append(self._thread_name(ident))
+            labels.reverse()
+            stacks[';'.join(labels)] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """获取折叠格式的结果，按照采样次数从多到少排列。
+
+        :rtype: str
+        """
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self._stacks.most_common())
+
+    def top(self, limit=10):
+        """按照最内层的函数统计采样次数。
+
+        :param int limit: 返回的函数个数。
+
+        :return: (函数, 采样次数)的列表。
+        :rtype: list
+        """
+        leaves = collections.Counter()
+        for stack, count in list(self._stacks.items()):
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(limit)
+
+    def dump(self, path=None):
+        """以折叠格式输出结果。
+
+        :param str path: 保存的文件路径，为None时只返回字符串。
+
+        :rtype: str
+        """
+        text = self.collapsed()
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
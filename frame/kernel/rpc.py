@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import json
+import socket
+import inspect
+import threading
+import socketserver
+
+from frame.stream.cmdres import CmdResult
+
+#: JSON-RPC 2.0 的错误代码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class RPCError(Exception):
+
+    """RPC调用的错误，会转换成JSON-RPC的错误回应。"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def cmdres_to_dict(cmdres):
+    """将`CmdResult`转换成可以JSON序列化的字典。
+
+    :param CmdResult cmdres: 命令的执行结果。
+
+    :rtype: dict
+    """
+    if cmdres is None:
+        return None
+    return {'cmdline': cmdres.cmdline, 'describe': cmdres.describe, 'result_type': cmdres.result_type,
+            'result': cmdres.result, 'last_error': cmdres.last_error,
+            'e': str(cmdres.e) if cmdres.e is not None else None}
+
+
+class _RPCHandler(socketserver.BaseRequestHandler):
+
+    """
+    一个连接的处理线程。客户端可以不等待回应连续发送多个请求(流水线)，每次读取到的完整请求依次执行，
+    所有回应合并成一次发送，回应的顺序与请求的顺序相同。
+    """
+
+    def handle(self):
+        rpc = self.server.rpc
+        buf = b''
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            buf += data
+            if b'\n' not in data:
+                continue
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            replies = []
+            for line in lines:
+                if line.strip():
+                    reply = rpc.handle_line(line)
+                    if reply is not None:
+                        replies.append(reply)
+            if replies:
+                try:
+                    self.request.sendall(('\n'.join(replies) + '\n').encode('utf-8'))
+                except OSError:
+                    break
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+class RPCServer:
+
+    """
+    引擎的本地控制接口。在Unix域套接字上提供JSON-RPC 2.0服务，每个请求或者回应是一行JSON：
+
+    ```
+    --> {"jsonrpc": "2.0", "id": 1, "method": "call_module", "params": [0, "status"]}
+    <-- {"jsonrpc": "2.0", "id": 1, "result": {"cmdline": "status", "describe": "当前状态", ...}}
+    ```
+
+    支持的方法：
+
+    * `start_loop()`, `stop_loop()`, `status()`         启动、停止引擎以及获取引擎的运行状态。
+    * `actions()`                                       获取动作列表。
+    * `call_module(module, cmdline)`                    调用模块命令，`module`是动作的索引或者模块名称，
+                                                        返回`CmdResult`的字典形式。
+    * `edit_module(module, params)`                     修改动作参数并使用新的参数重启模块，与命令行的`edit`相同。
+    * `stats()`, `enable_stats(enable)`, `reset_stats()` 获取、开启/关闭、清空统计信息。
+    * `shutdown()`                                      回应后关闭服务。
+
+    不带`id`的请求是通知，不会回应。参数可以是列表也可以是字典。
+    """
+
+    def __init__(self, engine, path):
+        """
+        :param L6Engine engine: 引擎。
+        :param str path: 套接字文件的路径。
+
+        :raises ValueError: 当前平台不支持Unix域套接字。
+        """
+        if _UnixServer is None:
+            raise ValueError("当前平台不支持Unix域套接字.")
+        self._engine = engine
+        self.path = path
+        self._server = None
+        self._thread = None
+        self._control = threading.Lock()    # 启动、停止引擎等操作不能并发执行
+        self.closed = threading.Event()
+        self._methods = {
+            'start_loop': self.rpc_start_loop,
+            'stop_loop': self.rpc_stop_loop,
+            'status': self.rpc_status,
+            'actions': self.rpc_actions,
+            'call_module': self.rpc_call_module,
+            'edit_module': self.rpc_edit_module,
+            'stats': self.rpc_stats,
+            'enable_stats': self.rpc_enable_stats,
+            'reset_stats': self.rpc_reset_stats,
+            'shutdown': self.rpc_shutdown,
+        }
+        # 调用前按照方法的签名检查参数，执行中抛出的TypeError不会被当作参数错误
+        self._signatures = {name: inspect.signature(method) for name, method in self._methods.items()}
+
+    def start(self):
+        """在后台线程中启动服务。已经存在的套接字文件会被删除。"""
+        if self._server is not None:
+            return
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = _UnixServer(self.path, _RPCHandler)
+        self._server.rpc = self
+        self.closed.clear()
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.1})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止服务并删除套接字文件。"""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        if self._thread is not threading.current_thread():
+            server.shutdown()
+        server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.closed.set()
+
+    def handle_line(self, line):
+        """处理一行请求。
+
+        :param bytes line: JSON格式的请求，可以是单个请求或者请求的列表(批量请求)。
+
+        :return: JSON格式的回应，全部是通知时返回None。
+        :rtype: str
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return self._dumps(self._error(None, PARSE_ERROR, "无效的JSON: {}".format(e)))
+        if isinstance(request, list):
+            replies = [reply for reply in map(self.dispatch, request) if reply is not None]
+            return self._dumps(replies) if replies else None
+        reply = self.dispatch(request)
+        return self._dumps(reply) if reply is not None else None
+
+    def dispatch(self, request):
+        """执行一个请求。
+
+        :param dict request: JSON-RPC请求。
+
+        :return: 回应，通知时返回None。
+        :rtype: dict
+        """
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return self._error(None, INVALID_REQUEST, "无效的请求.")
+        req_id = request.get('id')
+        method = self._methods.get(request['method'])
+        try:
+            if method is None:
+                raise RPCError(METHOD_NOT_FOUND, "方法 '{}' 不存在.".format(request['method']))
+            params = request.get('params', [])
+            if isinstance(params, dict):
+                args, kwargs = [], params
+            elif isinstance(params, list):
+                args, kwargs = params, {}
+            else:
+                raise RPCError(INVALID_PARAMS, "无效的参数.")
+            try:
+                self._signatures[request['method']].bind(*args, **kwargs)
+            except TypeError as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+            result = method(*args, **kwargs)
+        except RPCError as e:
+            reply = self._error(req_id, e.code, str(e))
+        except Exception as e:
+            # 执行中发生的异常是服务内部的错误
+            reply = self._error(req_id, INTERNAL_ERROR, repr(e))
+        else:
+            reply = {'jsonrpc': '2.0', 'id': req_id, 'result': result}
+        return reply if 'id' in request else None
+
+    @staticmethod
+    def _error(req_id, code, message):
+        return {'jsonrpc': '2.0', 'id': req_id, 'error': {'code': code, 'message': message}}
+
+    @staticmethod
+    def _dumps(obj):
+        # 模块的返回值中可能有无法序列化的对象，转换成字符串
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+    def _index(self, module):
+        """动作的索引或者模块名称转换成动作的索引。"""
+        if isinstance(module, str) and not module.isdigit():
+            index = self._engine.find_module(module)
+        else:
+            index = int(module)
+        if index < 0 or index >= len(self._engine.actions):
+            raise RPCError(INVALID_PARAMS, "模块 '{}' 未找到.".format(module))
+        return index
+
+    def rpc_start_loop(self):
+        with self._control:
+            return self._engine.start_loop()
+
+    def rpc_stop_loop(self):
+        with self._control:
+            return self._engine.stop_loop()
+
+    def rpc_status(self):
+        return {'running': self._engine.status_loop, 'stats': self._engine.get_stats() is not None}
+
+    def rpc_actions(self):
+        return [{'index': index, 'name': name, 'params': params, 'active': module.is_active}
+                for index, (name, module, params) in enumerate(self._engine.actions)]
+
+    def rpc_call_module(self, module, cmdline):
+        return cmdres_to_dict(self._engine.call_module(self._index(module), str(cmdline)))
+
+    def rpc_edit_module(self, module, params):
+        if not isinstance(params, dict):
+            raise RPCError(INVALID_PARAMS, "动作参数必须是字典.")
+        with self._control:
+            index = self._index(module)
+            try:
+                result = self._engine.edit_module(index, params)
+            except (AttributeError, ValueError) as e:
+                raise RPCError(INVALID_PARAMS, str(e))
+            # 与命令行的edit相同，使用新的参数重启模块
+            self._engine.restart_module(index, params)
+            return result
+
+    def rpc_stats(self):
+        return self._engine.get_stats()
+
+    def rpc_enable_stats(self, enable=True):
+        self._engine.enable_stats(bool(enable))
+        return bool(enable)
+
+    def rpc_reset_stats(self):
+        self._engine.reset_stats()
+        return True
+
+    def rpc_shutdown(self):
+        # 在其他线程中关闭，保证本次请求的回应可以发送出去
+        threading.Timer(0.05, self.stop).start()
+        return True
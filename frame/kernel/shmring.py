@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import struct
+
+from multiprocessing import shared_memory
+
+from frame.kernel import clock
+from frame.message.can import CANMessage, CANSploitMessage
+
+#
+# 共享内存的布局:
+#
+#   [0:8]    head      生产者写入的记录总数
+#   [8:16]   tail      消费者读取的记录总数
+#   [16:24]  waiting   消费者准备休眠时置1，生产者写入数据后置0并按门铃
+#   [24:32]  full      缓冲区已满、生产者准备休眠时置1，消费者取出数据后置0并设置空间事件
+#   [32:64]  保留
+#   [64:]    capacity个固定大小的CAN记录
+#
+# head与tail各自只有一个写者(单生产者单消费者)，通过memoryview以对齐的8字节整数读写。
+#
+HEADER_SIZE = 64
+
+# 时间戳, CANID, 标志位, 长度, 总线名称长度, 数据(CAN FD最长64字节), 总线名称
+RECORD = struct.Struct('<dIBBBx64s32s')
+RECORD_SIZE = RECORD.size
+
+FLAG_EXT = 0x01
+# CAN FD标志位(CANMessage.frame_flags)的偏移
+FD_SHIFT = 1
+
+# 生产者等待空间事件的最长时间(秒)，超时后重新检查缓冲区与停止事件
+SPACE_WAIT = 0.05
+
+
+class FrameRing:
+
+    """
+    基于`multiprocessing.shared_memory`的单生产者单消费者CAN数据帧环形缓冲区，每条记录大小固定。
+    """
+
+    def __init__(self, name=None, capacity=4096):
+        """
+        :param str name: 共享内存的名称，为None时创建新的共享内存。
+        :param int capacity: 可以容纳的记录数量，仅在创建时使用。
+        """
+        self._owner = name is None
+        if self._owner:
+            self.capacity = max(2, int(capacity))
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=HEADER_SIZE + self.capacity * RECORD_SIZE)
+            self._shm.buf[:HEADER_SIZE] = b'\x00' * HEADER_SIZE
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.capacity = (self._shm.size - HEADER_SIZE) // RECORD_SIZE
+        self.name = self._shm.name
+        self._index = self._shm.buf[0:32].cast('Q')
+
+    def __len__(self):
+        return self._index[0] - self._index[1]
+
+    @property
+    def waiting(self):
+        return self._index[2]
+
+    @waiting.setter
+    def waiting(self, value):
+        self._index[2] = value
+
+    @property
+    def full_waiting(self):
+        return self._index[3]
+
+    @full_waiting.setter
+    def full_waiting(self, value):
+        self._index[3] = value
+
+    def push(self, fid, length, data, ext, bus, ts=0.0, fd_flags=0):
+        """写入一条记录。
+
+        :param float ts: 数据帧的`clock.now()`时间点。
+
+        :return: 缓冲区已满返回False。
+        :rtype: bool
+        """
+        head = self._index[0]
+        if head - self._index[1] >= self.capacity:
+            return False
+        bus = bus.encode('utf-8')[:32]
+        offset = HEADER_SIZE + (head % self.capacity) * RECORD_SIZE
+        RECORD.pack_into(self._shm.buf, offset, ts, fid, (FLAG_EXT if ext else 0) | (fd_flags << FD_SHIFT),
+                         length, len(bus), bytes(data), bus)
+        self._index[0] = head + 1
+        return True
+
+    def pop(self):
+        """读取一条记录。
+
+        :return: (时间戳, CANID, 长度, 数据, 是否扩展帧, 总线名称, CAN FD标志位)，缓冲区为空返回None。
+        :rtype: tuple
+        """
+        tail = self._index[1]
+        if tail >= self._index[0]:
+            return None
+        offset = HEADER_SIZE + (tail % self.capacity) * RECORD_SIZE
+        ts, fid, flags, length, bus_len, data, bus = RECORD.unpack_from(
+            self._shm.buf, offset)
+        self._index[1] = tail + 1
+        return ts, fid, length, data[:length], bool(flags & FLAG_EXT), bus[:bus_len].decode('utf-8'), flags >> FD_SHIFT
+
+    def close(self):
+        self._index.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class RingPipe:
+
+    """
+    跨进程的管道变量，接口与`pipeline.BoundedPipe`一致，供`PipelineStage`使用。只有携带CAN数据的消息
+    会被写入环形缓冲区，消息的时间点(`CANSploitMessage.stamp`，没有时为写入时的`clock.now()`)随数据帧一起传递。
+    写入数据时如果消费者已经准备休眠，则通过门铃(`multiprocessing`的连接)唤醒它。'block'策略下缓冲区已满时，
+    生产者在空间事件上休眠，消费者取出数据后设置事件唤醒它。
+
+    `waiting`标志的读写放在跨进程的锁中进行，锁同时起到内存屏障的作用，保证消费者置位后读取的`head`
+    与生产者写入`head`后读取的`waiting`不会同时读到旧值(否则消费者会一直休眠到超时)。
+    """
+
+    def __init__(self, name, ring, doorbell, lock, space, batch=0, policy='block'):
+        if policy not in ['block', 'drop']:
+            raise ValueError("不支持的队列策略 '{}'.".format(policy))
+        self.name = name
+        self.depth = ring.capacity
+        self.policy = policy
+        self.dropped = 0
+        self._ring = ring
+        self._doorbell = doorbell
+        self._lock = lock
+        self._space = space
+        self._batch = batch
+        self._consumer = None
+
+    def __len__(self):
+        return len(self._ring)
+
+    def put(self, item, stop_e):
+        msgs = item if self._batch > 0 else [item]
+        ring = self._ring
+        ret = True
+        now = clock.now()
+        for can_msg in msgs:
+            if not can_msg.CANData:
+                continue
+            frame = can_msg.CANFrame
+            while not ring.push(frame.frame_id, frame.frame_length, frame.frame_raw_data, frame.frame_ext,
+                                str(can_msg.bus), can_msg.stamp or now, frame.frame_flags):
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    ret = False
+                    break
+                if stop_e.is_set():
+                    return False
+                self._wait_space()
+        with self._lock:
+            waiting = ring.waiting
+            ring.waiting = 0
+        if waiting:
+            try:
+                self._doorbell.send_bytes(b'\x00')
+            except (OSError, EOFError):
+                pass
+        return ret
+
+    def _wait_space(self):
+        """缓冲区已满时等待消费者取出数据。"""
+        ring = self._ring
+        with self._lock:
+            self._space.clear()
+            ring.full_waiting = 1
+        # 置位之后再次检查，消费者可能在置位之前已经取出了数据
+        if len(ring) >= ring.capacity:
+            self._space.wait(SPACE_WAIT)
+
+    def _notify_space(self):
+        """消费者取出数据后调用，唤醒等待空间的生产者。"""
+        if self._ring.full_waiting:
+            with self._lock:
+                self._ring.full_waiting = 0
+            self._space.set()
+
+    def _pop_msg(self):
+        record = self._ring.pop()
+        if record is None:
+            return None
+        ts, fid, length, data, ext, bus, fd_flags = record
+        can_msg = CANSploitMessage()
+        can_msg.CANFrame = CANMessage(fid, length, data, ext, CANMessage.DataFrame, fd_flags)
+        can_msg.CANData = True
+        can_msg.bus = bus
+        can_msg.stamp = ts
+        return can_msg
+
+    def get(self):
+        if self._batch <= 0:
+            can_msg = self._pop_msg()
+            if can_msg is not None:
+                self._notify_space()
+            return can_msg
+        batch = []
+        while len(batch) < self._batch:
+            can_msg = self._pop_msg()
+            if can_msg is None:
+                break
+            batch.append(can_msg)
+        if not batch:
+            return None
+        self._notify_space()
+        return batch
+
+    def arm(self):
+        """消费者准备休眠前调用，随后生产者写入数据时会按门铃。"""
+        with self._lock:
+            self._ring.waiting = 1
+
+    def drain(self):
+        """清空门铃中的数据。"""
+        try:
+            while self._doorbell.poll():
+                self._doorbell.recv_bytes()
+        except (OSError, EOFError):
+            pass
+
+    def fileno(self):
+        return self._doorbell.fileno()
+
+    def wakeup(self):
+        pass
+
+    def close(self):
+        self._ring.close()
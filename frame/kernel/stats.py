@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+
+class LatencyHistogram:
+
+    """
+    HDR风格的对数线性直方图，记录以纳秒为单位的整数值。
+
+    小于`2 ** sub_bucket_bits`的值每个值一个桶；更大的值按照2的幂次分段，每段再线性地分为
+    `2 ** (sub_bucket_bits - 1)`个桶，因此相对误差不超过`2 ** (1 - sub_bucket_bits)`，
+    默认的5位约为6%。记录一个值只需要几次位运算和一次列表自增。
+    """
+
+    def __init__(self, sub_bucket_bits=5):
+        self._bits = sub_bucket_bits
+        self._sub = 1 << sub_bucket_bits
+        self._half = self._sub >> 1
+        self._counts = [0] * (self._sub + 64 * self._half)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        if value < self._sub:
+            return value
+        shift = value.bit_length() - self._bits
+        return self._sub + (shift - 1) * self._half + (value >> shift) - self._half
+
+    def _upper(self, index):
+        """桶中可以表示的最大值。"""
+        if index < self._sub:
+            return index
+        shift, mantissa = divmod(index - self._sub, self._half)
+        shift += 1
+        return ((mantissa + self._half + 1) << shift) - 1
+
+    def record(self, value):
+        """记录一个值。
+
+        :param int value: 要记录的值(纳秒)，负数按0记录。
+        """
+        if value < 0:
+            value = 0
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """获取百分位数。
+
+        :param float percent: 百分比，0到100。
+
+        :return: 百分位数的近似值(纳秒)，没有记录时返回0。
+        :rtype: int
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            if count:
+                seen += count
+                if seen >= target:
+                    return min(self._upper(index), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ns': self.total,
+            'min_ns': self.min or 0,
+            'max_ns': self.max,
+            'mean_ns': self.mean,
+            'p50_ns': self.percentile(50),
+            'p90_ns': self.percentile(90),
+            'p99_ns': self.percentile(99),
+            'p999_ns': self.percentile(99.9),
+        }
+
+
+class ActionStats:
+
+    """一个动作的统计信息。"""
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+        self.calls = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.block_wait = 0         # 等待模块锁(_thr_block)的总时间(纳秒)
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'name': self.name,
+            'calls': self.calls,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'block_wait_ns': self.block_wait,
+            'latency': self.latency.to_dict(),
+        }
+
+
+class EngineStats:
+
+    """
+    引擎中所有动作的统计信息，按照动作对象索引，因此在流水线模式下各个阶段的线程可以共用。
+    """
+
+    def __init__(self, actions):
+        self.started = time.time()
+        self._by_action = {}
+        self.actions = []
+        for index, action in enumerate(actions):
+            action_stats = ActionStats(index, action[0])
+            self._by_action[id(action)] = action_stats
+            self.actions.append(action_stats)
+
+    def rebuild(self, actions):
+        """动作列表被替换后(热加载)重新建立索引，保留下来的动作沿用原来的统计信息。
+
+        :param list actions: 新的动作列表。
+        """
+        by_action = {}
+        self.actions = []
+        for index, action in enumerate(actions):
+            action_stats = self._by_action.get(id(action))
+            if action_stats is None:
+                action_stats = ActionStats(index, action[0])
+            action_stats.index = index
+            by_action[id(action)] = action_stats
+            self.actions.append(action_stats)
+        self._by_action = by_action
+
+    def get(self, action):
+        """获取动作对应的统计信息，没有找到返回None。"""
+        return self._by_action.get(id(action))
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'actions': [action_stats.to_dict() for action_stats in self.actions],
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=indent)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import socket
+import selectors
+import threading
+
+
+class EventWaker:
+
+    """
+    事件驱动调度模式下主循环使用的唤醒器。
+
+    主循环在所有管道都没有数据时阻塞在`wait`上，直到以下任意一种情况发生：
+
+    * 通过`register`注册的文件描述符(例如CANSocket的原始套接字)可读。
+    * 其他线程(例如TCP2CAN的处理线程、命令行)调用了`notify`。
+    * 等待超时(定时类模块到期)。
+
+    `notify`通过一对本地套接字实现，因此可以与文件描述符一起被`selectors`监听。
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._wsock.setblocking(False)
+        self._selector.register(
+            self._rsock, selectors.EVENT_READ, (None, None))
+        self._lock = threading.Lock()
+        self._pending = False
+
+    def register(self, fileobj, owner=None, drain=None):
+        """注册一个可读事件源。
+
+        :param fileobj: 文件描述符或者带有`fileno()`的对象。
+        :param owner: 事件源的所有者，一般是模块对象。
+        :param callable drain: 事件源可读时由唤醒器调用，用于清空只作为通知使用的事件源(例如门铃)。
+        """
+        try:
+            self._selector.register(fileobj, selectors.EVENT_READ, (owner, drain))
+        except (KeyError, ValueError):
+            pass
+
+    def unregister(self, fileobj):
+        """注销一个可读事件源。"""
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def notify(self):
+        """唤醒正在`wait`中的主循环，可以在任意线程中调用。"""
+        with self._lock:
+            if self._pending:
+                return
+            self._pending = True
+        try:
+            self._wsock.send(b'\x00')
+        except OSError:
+            pass
+
+    def wait(self, timeout=None):
+        """等待事件的发生。
+
+        :param float timeout: 最长等待的秒数，None表示一直等待。
+
+        :return: 被事件唤醒返回True，超时返回False。
+        :rtype: bool
+        """
+        if timeout is not None and timeout < 0:
+            timeout = 0
+        events = self._selector.select(timeout)
+        for key, _ in events:
+            if key.fileobj is self._rsock:
+                self._drain()
+            elif key.data[1] is not None:
+                key.data[1]()
+        return len(events) > 0
+
+    def _drain(self):
+        """清空唤醒套接字中的数据。"""
+        with self._lock:
+            self._pending = False
+        try:
+            while self._rsock.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def close(self):
+        """关闭唤醒器。"""
+        self._selector.close()
+        self._rsock.close()
+        self._wsock.close()
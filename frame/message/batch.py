@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy
+
+from frame.message.can import CANMessage, CANSploitMessage
+
+#: 标志位：扩展帧，与共享内存环形缓冲区中的记录相同
+FLAG_EXT = 0x01
+#: 标志位中CAN FD标志位(`CANMessage.frame_flags`)的偏移，与共享内存环形缓冲区中的记录相同
+FD_SHIFT = 1
+FD_BITS = 0x07
+#: 标志位中数据帧类型(`CANMessage.frame_type`)的偏移
+TYPE_SHIFT = 4
+
+#: 数据字段的宽度：经典CAN为8字节，CAN FD为64字节
+WIDTHS = (8, 64)
+
+_DTYPES = {}
+
+#: 总线名称与编号的对应关系，进程内的所有数据帧批次共用，因此拼接时不需要转换编号
+_BUS_NAMES = []
+_BUS_CODES = {}
+_BUS_LOCK = threading.Lock()
+
+
+def frame_dtype(width=8):
+    """数据帧批次的结构化数据类型。
+
+    |字段|类型|说明|
+    |----|----|----|
+    |`ts`|`float64`|时间戳，没有时间戳时为-1.0|
+    |`id`|`uint32`|消息ID|
+    |`dlc`|`uint8`|数据长度|
+    |`flags`|`uint8`|`FLAG_EXT`、左移`FD_SHIFT`位的CAN FD标志位以及左移`TYPE_SHIFT`位的数据帧类型|
+    |`bus`|`uint16`|总线编号，参见`bus_code`|
+    |`data`|`uint8[width]`|数据，长度之外的字节为0|
+
+    :param int width: 数据字段的宽度，8或者64。
+
+    :rtype: numpy.dtype
+
+    :raises ValueError: 宽度不是8或者64。
+    """
+    dtype = _DTYPES.get(width)
+    if dtype is None:
+        if width not in WIDTHS:
+            raise ValueError("数据宽度只能是8或者64.")
+        dtype = _DTYPES[width] = numpy.dtype([
+            ('ts', '<f8'), ('id', '<u4'), ('dlc', 'u1'), ('flags', 'u1'), ('bus', '<u2'), ('data', 'u1', (width,))])
+    return dtype
+
+
+def bus_code(name):
+    """获取总线名称对应的编号，第一次出现的名称分配新的编号。
+
+    :param str name: 总线名称。
+
+    :rtype: int
+    """
+    code = _BUS_CODES.get(name)
+    if code is None:
+        with _BUS_LOCK:
+            code = _BUS_CODES.get(name)
+            if code is None:
+                code = _BUS_CODES[name] = len(_BUS_NAMES)
+                _BUS_NAMES.append(name)
+    return code
+
+
+def bus_name(code):
+    """获取总线编号对应的名称。
+
+    :param int code: 总线编号。
+
+    :rtype: str
+    """
+    return _BUS_NAMES[code]
+
+
+class FrameBatch:
+
+    """
+    按列保存的数据帧批次，底层是一个或者多个`numpy`结构化数组(参见`frame_dtype`)。
+
+    与`CANSploitMessage`的列表相比，每个数据帧只占用一条固定大小的记录(经典CAN为24字节)，而且可以直接对整列做向量化的运算，
+    例如按照消息ID筛选、统计每个消息ID的数量等。只保存携带数据的数据帧，调试数据与时间点标记不会被保存。
+
+    拼接(`concat`、`+`)时不复制数据，只是把各个批次的数组作为分段保存；需要连续的数组时(`array`)才合并一次，之后保存合并的结果。
+    切片(步长为1)返回原数组的视图，布尔掩码与整数索引返回新的批次。
+
+    迭代与整数索引得到的是`(时间戳, CANSploitMessage)`，与`Replay`相同，因此可以直接交给遍历`Replay`的代码。
+    """
+
+    def __init__(self, chunks=None, width=8):
+        """
+        :param list chunks: 结构化数组的列表，数据类型必须是`frame_dtype(width)`。
+        :param int width: 数据字段的宽度，8或者64。
+
+        :raises ValueError: 数组的数据类型与宽度不一致。
+        """
+        self.width = width
+        self.dtype = frame_dtype(width)
+        self._chunks = []
+        for chunk in chunks or []:
+            if chunk.dtype != self.dtype:
+                raise ValueError("数组的数据类型与批次的宽度不一致.")
+            if len(chunk):
+                self._chunks.append(chunk)
+
+    @classmethod
+    def empty(cls, count, width=8):
+        """创建包含`count`条全为0的记录的批次。
+
+        :param int count: 记录数量。
+        :param int width: 数据字段的宽度。
+
+        :rtype: FrameBatch
+        """
+        return cls([numpy.zeros(count, dtype=frame_dtype(width))], width)
+
+    @classmethod
+    def from_messages(cls, messages, times=-1.0, width=8):
+        """由`CANSploitMessage`或者`CANMessage`创建批次，不携带数据的消息结构被跳过。
+
+        :param messages: 消息结构或者数据帧的序列，也可以是`(时间戳, 消息结构)`的序列(例如`Replay`)。
+        :param times: 时间戳，可以是一个数值(所有数据帧相同)或者与`messages`等长的序列；`messages`中带有时间戳时忽略。
+        :param int width: 数据字段的宽度，数据帧的长度超过宽度时被截断。
+
+        :rtype: FrameBatch
+        """
+        batch_times = isinstance(times, (int, float))
+        ts, ids, dlcs, flags, buses, data = [], [], [], [], [], []
+        default_bus = bus_code("Default")
+        for index, item in enumerate(messages):
+            if isinstance(item, (tuple, list)):
+                stamp, item = item
+            else:
+                stamp = times if batch_times else times[index]
+            if isinstance(item, CANSploitMessage):
+                if not item.CANData:
+                    continue
+                frame = item.CANFrame
+                bus = bus_code(item.bus)
+            else:
+                frame = item
+                bus = default_bus
+            length = min(frame.frame_length, width)
+            ts.append(stamp)
+            ids.append(frame.frame_id)
+            dlcs.append(length)
+            flags.append((FLAG_EXT if frame.frame_ext else 0) | (frame.frame_flags << FD_SHIFT) |
+                         ((frame.frame_type or 0) << TYPE_SHIFT))
+            buses.append(bus)
+            data.append(frame.frame_data[:length].ljust(width, b'\x00'))
+
+        array = numpy.zeros(len(ids), dtype=frame_dtype(width))
+        if ids:
+            array['ts'] = ts
+            array['id'] = ids
+            array['dlc'] = dlcs
+            array['flags'] = flags
+            array['bus'] = buses
+            array['data'] = numpy.frombuffer(b''.join(data), dtype=numpy.uint8).reshape(len(ids), width)
+        return cls([array], width)
+
+    @classmethod
+    def concat(cls, batches):
+        """拼接多个批次，不复制数据。
+
+        :param list batches: 宽度相同的批次。
+
+        :rtype: FrameBatch
+
+        :raises ValueError: 批次的宽度不一致。
+        """
+        batches = list(batches)
+        width = batches[0].width if batches else 8
+        chunks = []
+        for batch in batches:
+            if batch.width != width:
+                raise ValueError("只能拼接宽度相同的批次.")
+            chunks.extend(batch._chunks)
+        return cls(chunks, width)
+
+    def __add__(self, other):
+        return FrameBatch.concat([self, other])
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    @property
+    def chunks(self):
+        """组成批次的各个数组。
+
+        :rtype: list
+        """
+        return list(self._chunks)
+
+    @property
+    def array(self):
+        """批次的连续数组，有多个分段时合并一次并保存合并的结果。
+
+        :rtype: numpy.ndarray
+        """
+        if len(self._chunks) != 1:
+            array = numpy.concatenate(self._chunks) if self._chunks else numpy.zeros(0, dtype=self.dtype)
+            self._chunks = [array] if len(array) else []
+            return array
+        return self._chunks[0]
+
+    def column(self, name):
+        """获取一列，只有一个分段时为视图。
+
+        :param str name: 字段名称，参见`frame_dtype`。
+
+        :rtype: numpy.ndarray
+        """
+        if len(self._chunks) == 1:
+            return self._chunks[0][name]
+        return self.array[name]
+
+    def _split(self, mask):
+        # 将整个批次的掩码按照分段切开
+        chunks, start = [], 0
+        for chunk in self._chunks:
+            end = start + len(chunk)
+            chunks.append(chunk[mask[start:end]])
+            start = end
+        return FrameBatch(chunks, self.width)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return FrameBatch([self.array[key]], self.width)
+            chunks, offset = [], 0
+            for chunk in self._chunks:
+                end = offset + len(chunk)
+                if start < end and stop > offset:
+                    chunks.append(chunk[max(start - offset, 0):min(stop, end) - offset])
+                offset = end
+            return FrameBatch(chunks, self.width)
+        if isinstance(key, numpy.ndarray):
+            if key.dtype == numpy.bool_:
+                if len(key) != len(self):
+                    raise ValueError("掩码的长度与批次不一致.")
+                return self._split(key)
+            return FrameBatch([self.array[key]], self.width)
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        for chunk in self._chunks:
+            if index < len(chunk):
+                return self._record(chunk, index)
+            index -= len(chunk)
+        raise IndexError("批次索引超出范围.")
+
+    def _record(self, chunk, index):
+        row = chunk[index]
+        dlc = int(row['dlc'])
+        flags = int(row['flags'])
+        msg = CANSploitMessage()
+        msg.CANFrame = CANMessage(int(row['id']), dlc, row['data'][:dlc].tobytes(), flags & FLAG_EXT,
+                                  flags >> TYPE_SHIFT, (flags >> FD_SHIFT) & FD_BITS)
+        msg.CANData = True
+        msg.bus = _BUS_NAMES[int(row['bus'])]
+        return float(row['ts']), msg
+
+    def __iter__(self):
+        width = self.width
+        for chunk in self._chunks:
+            raw = numpy.ascontiguousarray(chunk['data']).tobytes()
+            columns = zip(chunk['ts'].tolist(), chunk['id'].tolist(), chunk['dlc'].tolist(),
+                          chunk['flags'].tolist(), chunk['bus'].tolist())
+            for index, (stamp, fid, dlc, flags, bus) in enumerate(columns):
+                offset = index * width
+                msg = CANSploitMessage()
+                msg.CANFrame = CANMessage(fid, dlc, raw[offset:offset + dlc], flags & FLAG_EXT, flags >> TYPE_SHIFT,
+                                          (flags >> FD_SHIFT) & FD_BITS)
+                msg.CANData = True
+                msg.bus = _BUS_NAMES[bus]
+                yield stamp, msg
+
+    def to_messages(self):
+        """转换为`CANSploitMessage`的列表，例如作为管道中的一批数据。
+
+        :rtype: list
+        """
+        return [msg for _, msg in self]
+
+    def mask_ids(self, ids):
+        """获取消息ID属于`ids`的掩码。
+
+        :param ids: 一个消息ID或者消息ID的序列。
+
+        :rtype: numpy.ndarray
+        """
+        if isinstance(ids, int):
+            return self.column('id') == ids
+        return numpy.isin(self.column('id'), numpy.asarray(list(ids), dtype=numpy.uint32))
+
+    def select_ids(self, ids, invert=False):
+        """筛选消息ID属于(或者不属于)`ids`的数据帧。
+
+        :param ids: 一个消息ID或者消息ID的序列。
+        :param bool invert: 为True时筛选不属于`ids`的数据帧。
+
+        :rtype: FrameBatch
+        """
+        mask = self.mask_ids(ids)
+        return self[~mask if invert else mask]
+
+    def id_counts(self):
+        """统计每个消息ID的数据帧数量。
+
+        :return: 消息ID到数量的字典，按照消息ID从小到大排列。
+        :rtype: dict
+        """
+        ids, counts = numpy.unique(self.column('id'), return_counts=True)
+        return dict(zip(ids.tolist(), counts.tolist()))
@@ -1,28 +1,123 @@
 # -*- coding: utf-8 -*-
 import struct
-import binascii
-import bitstring
 
-from frame.kernel.module import CANModule
+from frame.utils import bits
+
+#: 消息ID的二进制形式的缓存，总线上的消息ID数量有限，所有数据帧共用
+_RAW_IDS = {}
+
+#: CAN FD的数据长度码(DLC)对应的数据长度
+DLC_TO_LEN = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+LEN_TO_DLC = {length: dlc for dlc, length in enumerate(DLC_TO_LEN)}
+
+#: CAN FD数据帧的标志位，与SocketCAN中`canfd_frame.flags`的取值相同
+FD_BRS = 0x01   # 数据段切换到更高的波特率(Bit Rate Switch)
+FD_ESI = 0x02   # 发送节点处于被动错误状态(Error State Indicator)
+FD_FDF = 0x04   # CAN FD数据帧
+FD_MASK = FD_BRS | FD_ESI | FD_FDF
+
+
+def fd_length(length):
+    """CAN FD的数据长度只能是`DLC_TO_LEN`中的值，其他长度向上取整。
+
+    :param int length: 数据长度。
+
+    :rtype: int
+    """
+    for size in DLC_TO_LEN:
+        if size >= length:
+            return size
+    return DLC_TO_LEN[-1]
 
 
 class CANMessage:
 
     """
     此类主要用于对CAN消息结构的封装。
+
+    数据帧创建后是不可变的值(数据为`bytes`)，因此可以被多个管道与缓冲区按引用共享，复制时直接返回自身。
+    需要修改时通过`replace`创建新的数据帧(写时复制)，不要直接修改属性。
+
+    使用`__slots__`而不是实例字典，分析与嗅探的缓冲区中保存大量数据帧时可以节省内存。数据的二进制形式就是`frame_data`本身，
+    16进制形式在第一次使用时生成并保存在`_hex`中，消息ID的二进制形式在所有数据帧之间共用。
+
+    `frame_flags`为CAN FD的标志位(`FD_FDF`,`FD_BRS`,`FD_ESI`)，经典CAN数据帧为0。数据长度超过8或者设置了标志位时为
+    CAN FD数据帧，数据最长64字节，长度不是`DLC_TO_LEN`中的值时向上取整并以0填充。
     """
 
+    __slots__ = ('frame_id', 'frame_length', 'frame_data', 'frame_ext', 'frame_type', 'frame_flags', '_hex')
+
     DataFrame = 1
     RemoteFrame = 2
     ErrorFrame = 3
     OverloadFrame = 4
 
-    def __init__(self, fid, length, data, extended, type):
+    def __init__(self, fid, length, data, extended, type, flags=0):
         self.frame_id = min(0x1FFFFFFF, int(fid))           # 消息ID
-        self.frame_length = min(8, int(length))             # 数据长度
-        self.frame_data = list(data)[0:self.frame_length]   # 数据
+        length = int(length)
+        if length <= 8 and not flags:
+            self.frame_length = length                      # 数据长度
+            self.frame_data = bytes(data[0:length])         # 数据
+            self.frame_flags = 0                            # CAN FD标志位
+        else:
+            self.frame_length = fd_length(length)
+            self.frame_data = bytes(data[0:self.frame_length])
+            if self.frame_length != length:
+                self.frame_data = self.frame_data.ljust(self.frame_length, b'\x00')
+            self.frame_flags = (int(flags) & FD_MASK) | FD_FDF
         self.frame_ext = bool(extended)                     # 是否使用帧扩展
         self.frame_type = type                              # 数据帧的类型
+        self._hex = None                                    # 数据的16进制形式，第一次使用时生成
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # 序列化时不包含缓存
+        return CANMessage, (self.frame_id, self.frame_length, self.frame_data, self.frame_ext, self.frame_type,
+                            self.frame_flags)
+
+    def replace(self, fid=None, length=None, data=None, extended=None, type=None, flags=None):
+        """创建修改了部分字段的新数据帧，原数据帧不变。
+
+        :param int fid: 消息ID，None表示不变，下同。
+        :param int length: 数据长度。
+        :param data: 数据。
+        :param bool extended: 是否使用帧扩展。
+        :param int type: 数据帧的类型。
+        :param int flags: CAN FD标志位。
+
+        :rtype: CANMessage
+        """
+        return CANMessage(self.frame_id if fid is None else fid,
+                          self.frame_length if length is None else length,
+                          self.frame_data if data is None else data,
+                          self.frame_ext if extended is None else extended,
+                          self.frame_type if type is None else type,
+                          self.frame_flags if flags is None else flags)
+
+    @property
+    def frame_fd(self):
+        """是否为CAN FD数据帧。"""
+        return bool(self.frame_flags)
+
+    @property
+    def frame_brs(self):
+        """CAN FD数据帧的数据段是否切换到更高的波特率。"""
+        return bool(self.frame_flags & FD_BRS)
+
+    @property
+    def frame_esi(self):
+        """CAN FD数据帧的发送节点是否处于被动错误状态。"""
+        return bool(self.frame_flags & FD_ESI)
+
+    @property
+    def frame_dlc(self):
+        """数据长度码，CAN FD数据帧的长度超过8时与长度不同。"""
+        return LEN_TO_DLC.get(self.frame_length, self.frame_length)
 
     def __bytes__(self):
         return self.frame_raw_data
@@ -36,56 +131,66 @@ class CANMessage:
     def __str__(self):
         return hex(self.frame_id)
 
+    @property
+    def frame_bits(self):
+        """数据的整数形式，第一个字节是最高位，用于按位比较、异或以及`bits.popcount`统计改变的位数。
+
+        :rtype: int
+        """
+        return int.from_bytes(self.frame_data, 'big')
+
     def get_bits(self):
-        fill = 8 - self.frame_length
-        bits_array = '0b'
-        bits_array += '0' * fill * 8
-        for byte in self.frame_data:
-            bits_array += bin(byte)[2:].zfill(8)
-        return bitstring.BitArray(bits_array, length=64)
+        """数据的位序列，长度不足8字节时在前面补0，兼容原来返回`bitstring.BitArray`的调用者。
+
+        :rtype: frame.utils.bits.Bits
+        """
+        return bits.Bits(self.frame_bits, max(8, self.frame_length) * 8)
+
+    @property
+    def data_hex(self):
+        """数据的16进制字符串，生成后缓存。"""
+        text = self._hex
+        if text is None:
+            text = self._hex = self.frame_data.hex()
+        return text
 
     def get_text(self):
         """
-        将当前的CAN数据组成一组形如： '消息ID：数据长度：十六进制数据' 的字符串
+        将当前的CAN数据组成一组形如： '消息ID：数据长度：十六进制数据' 的字符串，CAN FD数据帧在最后加上 '：标志位'
         """
-        return hex(self.frame_id) + ":" + str(self.frame_length) + ":" + CANModule.get_hex(self.frame_raw_data)
+        if self.frame_flags:
+            return '{:#x}:{}:{}:{:x}'.format(self.frame_id, self.frame_length, self.data_hex, self.frame_flags)
+        return '{:#x}:{}:{}'.format(self.frame_id, self.frame_length, self.data_hex)
 
     @property
     def frame_raw_id(self):
-        if not self.frame_ext:
-            return struct.pack("!H", self.frame_id)
-        else:
-            return struct.pack("!I", self.frame_id)
+        key = self.frame_id if not self.frame_ext else -self.frame_id - 1
+        raw = _RAW_IDS.get(key)
+        if raw is None:
+            raw = _RAW_IDS[key] = struct.pack("!I" if self.frame_ext else "!H", self.frame_id)
+        return raw
 
     @property
     def frame_raw_length(self):
-        return struct.pack("!B", self.frame_length)
+        return bytes((self.frame_length,))
 
     @property
     def frame_raw_data(self):
-        return bytes(self.frame_data)
-
-    @frame_raw_data.setter
-    def frame_raw_data(self, value):
-        self.frame_data = list(value)[0:self.frame_length]  # DATA
+        return self.frame_data
 
     def to_hex(self):
-        """CAN frame in HEX format ready to be sent (include ID, length and data)"""
+        """CAN frame in HEX format ready to be sent (include ID, length and data)，CAN FD数据帧的长度为数据长度码"""
         if not self.frame_ext:
-            id = binascii.hexlify(struct.pack('!H', self.frame_id))[
-                1:].zfill(3)
+            text = '{:03x}{:x}{}'.format(self.frame_id & 0xFFF, self.frame_dlc & 0xF, self.data_hex)
         else:
-            id = binascii.hexlify(struct.pack('!I', self.frame_id)).zfill(8)
-        length = binascii.hexlify(struct.pack(
-            '!B', self.frame_length))[1:].zfill(1)
-        data = binascii.hexlify(bytes(self.frame_data)
-                                ).zfill(self.frame_length * 2)
-        return id + length + data
+            text = '{:08x}{:x}{}'.format(self.frame_id, self.frame_dlc & 0xF, self.data_hex)
+        return text.encode('ascii')
 
     @staticmethod
-    def init_data(fid, length, data):  # Init
-        if length > 8:
-            length = 8
+    def init_data(fid, length, data, flags=0):  # Init
+        """按照消息ID的范围决定是否为扩展帧，长度超过8或者指定了`flags`时创建CAN FD数据帧(最长64字节)。"""
+        if length > 64:
+            length = 64
         if 0 <= fid <= 0x7FF:
             extended = False
         elif 0x7FF < fid <= 0x1FFFFFFF:
@@ -94,7 +199,7 @@ class CANMessage:
             fid = 0
             extended = False
 
-        return CANMessage(fid, length, data, extended, 1)
+        return CANMessage(fid, length, data, extended, 1, flags)
 
 
 class CANSploitMessage:
@@ -103,9 +208,114 @@ class CANSploitMessage:
     负载了CAN消息与其他数据的封装类。
     """
 
+    __slots__ = ('debugText', 'CANFrame', 'debugData', 'CANData', 'bus', 'stamp')
+
     def __init__(self):
         self.debugText = ""
         self.CANFrame = None
         self.debugData = False
         self.CANData = False
         self.bus = "Default"
+        #: float -- 数据帧产生时的`clock.now()`时间点，0表示未知(使用处理时的时间)，跨进程传递时保留
+        self.stamp = 0.0
+
+    def share(self):
+        """创建一个共享同一个数据帧的新消息结构，用于将数据帧分发到其他管道或者缓冲区而不需要深复制。
+
+        消息结构本身是可变的(例如`filter`会修改`CANData`)，因此每个持有者需要自己的消息结构，数据帧则是不可变的。
+
+        :rtype: CANSploitMessage
+        """
+        msg = CANSploitMessage.__new__(CANSploitMessage)
+        msg.debugText = self.debugText
+        msg.CANFrame = self.CANFrame
+        msg.debugData = self.debugData
+        msg.CANData = self.CANData
+        msg.bus = self.bus
+        msg.stamp = self.stamp
+        return msg
+
+    def reset(self):
+        """将消息原地恢复为初始状态，用于复用消息结构。"""
+        self.debugText = ""
+        self.CANFrame = None
+        self.debugData = False
+        self.CANData = False
+        self.bus = "Default"
+        self.stamp = 0.0
+
+
+class FrameInterner:
+
+    """
+    数据帧的驻留表(享元)。抓包中大量重复相同的(消息ID, 数据)，数据帧又是不可变的值，因此内容相同的数据帧可以共用一个实例，
+    缓冲区中只保存引用。
+
+    表的大小有上限，满了之后新的数据帧不再加入表中(原样返回)，避免随机数据(例如模糊测试)使表无限增长。
+    `lookups`与`hits`为查询与命中的次数，多个线程同时使用时只是近似值。
+    """
+
+    def __init__(self, max_size=65536):
+        """
+        :param int max_size: 表中最多保存的数据帧数量。
+        """
+        self.max_size = max_size
+        self.lookups = 0
+        self.hits = 0
+        self._table = {}
+
+    def __len__(self):
+        return len(self._table)
+
+    def intern(self, frame):
+        """获取与`frame`内容相同的共用实例。
+
+        :param CANMessage frame: 数据帧。
+
+        :return: 表中内容相同的数据帧，没有时加入表中并返回`frame`本身。
+        :rtype: CANMessage
+        """
+        key = (frame.frame_id, frame.frame_ext, frame.frame_type, frame.frame_flags, frame.frame_length,
+               frame.frame_data)
+        self.lookups += 1
+        found = self._table.get(key)
+        if found is not None:
+            self.hits += 1
+            return found
+        if len(self._table) < self.max_size:
+            self._table[key] = frame
+        return frame
+
+    @property
+    def hit_rate(self):
+        """命中率，没有查询时为0。
+
+        :rtype: float
+        """
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        """
+        :return: 包含`size`,`lookups`,`hits`,`hit_rate`的字典。
+        :rtype: dict
+        """
+        return {'size': len(self._table), 'lookups': self.lookups, 'hits': self.hits,
+                'hit_rate': round(self.hit_rate, 4)}
+
+    def clear(self):
+        """清空表以及统计。"""
+        self._table = {}
+        self.lookups = 0
+        self.hits = 0
+
+
+#: 进程内共用的驻留表，不同的缓冲区之间也可以共用数据帧
+_INTERNER = FrameInterner()
+
+
+def get_interner():
+    """获取进程内共用的数据帧驻留表。
+
+    :rtype: FrameInterner
+    """
+    return _INTERNER
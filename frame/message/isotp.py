@@ -30,7 +30,7 @@ class ISOTPMessage:
         :param bool finished: True表明没有更多数据被添加了
         """
         self.message_id = id
-        self.message_data = [] or data
+        self.message_data = data or []
         self.message_length = length
         self.message_finished = finished
         self._counterSize = 0
@@ -47,7 +47,7 @@ class ISOTPMessage:
         :return: Padding of the ISO TP message.
         :rtype: int
         """
-        array2 = array + []
+        array2 = list(array)
         array2.reverse()
         cnt = 1
         std = array2[0]
@@ -72,14 +72,14 @@ class ISOTPMessage:
             return -1
         if can.frame_length != 8:
             if length + 1 == can.frame_length:
-                self.message_data = can.frame_data[1:length + 1]
+                self.message_data = list(can.frame_data[1:length + 1])
                 self.message_length = length
                 self.message_finished = True
                 return 1
         else:
             padded = self._get_padding(can.frame_data)
             if padded > 0 and length + 1 == 8 - padded:
-                self.message_data = can.frame_data[1:length + 1]
+                self.message_data = list(can.frame_data[1:length + 1])
                 self.message_length = length
                 self.message_finished = True
                 self.padded = True
@@ -102,7 +102,7 @@ class ISOTPMessage:
         if self._counterSize == 0:
             self.message_length = message_length
             self._counterSize = 6
-            self.message_data = can.frame_data[2:8]
+            self.message_data = list(can.frame_data[2:8])
             self._seq = 1  # Wait for first packet
             return 2
         return -2
@@ -178,6 +178,8 @@ class UDSMessage:
 
     # Method to handle messages ISO TP messages
     def handle_message(self, _input_message):
+        if not _input_message.message_data:  # 流控帧等没有数据的ISO TP消息
+            return False
         uds_type = self.check_status(_input_message)
         if uds_type == 2:  # Possible response came
             sts = self.sessions[_input_message.message_id -
@@ -209,6 +211,18 @@ class UDSMessage:
         byte_data = [_service] + _subcommand + _data
         return ISOTPMessage.generate_can(_id, byte_data, self.padding)
 
+    def add_raw_request(self, _input_message):
+        # 记录新的请求：有子服务时以子服务为键，同时以0x1ff记录无子服务的另外一种解释
+        _data = _input_message.message_data
+        if len(_data) == 0:
+            return False
+        services = self.sessions.setdefault(_input_message.message_id, {})
+        subs = services.setdefault(_data[0], {})
+        if len(_data) > 1:
+            subs[_data[1]] = {'status': 0, 'data': _data[2:], 'response': {'id': None, 'data': None, 'error': None}}
+        subs[0x1ff] = {'status': 0, 'data': _data[1:], 'response': {'id': None, 'data': None, 'error': None}}
+        return True
+
     def add_raw_response(self, _input_message):
         response_id = _input_message.message_id - self.shift
         if len(_input_message.message_data) >= 2:
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from collections import Iterable
+from collections.abc import Iterable
 from itertools import combinations_with_replacement as combinations
 
 from frame.stream.processor import Processor
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from collections import Iterable, deque
+from collections import deque
+from collections.abc import Iterable
 
 from frame.stream.processor import Processor
 
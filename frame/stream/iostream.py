@@ -1,40 +1,176 @@
-# -*- coding: utf-8 -*-
-import copy
-import time
-import threading
-
-
-class IOStream:
-    def __init__(self):
-        self._mutex = threading.Event()
-        self.output_buffer = {}
-
-    def output(self, source, msg, timeout=3):
-        self._mutex.wait(timeout)
-        self._mutex.clear()
-
-        if source not in self.output_buffer:
-            self.output_buffer[source] = []
-        outmsg = {time.time(), msg}
-        self.output_buffer[source].append(outmsg)
-
-        self._mutex.set()
-
-    def copy(self, timeout=3):
-        self._mutex.wait(timeout)
-        self._mutex.clear()
-        return copy.deepcopy(self.output_buffer)
-        self._mutex.set()
-
-    def clear(self, timeout=3):
-        self._mutex.wait(timeout)
-        self._mutex.clear()
-        self.output_buffer = {}
-        self._mutex.set()
-
-    def wait_clear(self, timeout=3):
-        self._mutex.wait(timeout)
-        self._mutex.clear()
-
-    def clear_mutex(self):
-        self._mutex.set()
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import threading
+
+
+class TraceMessage:
+
+    """
+    延迟格式化的跟踪信息。记录时只保存格式字符串与参数，转换成字符串(打印或者读取输出流)时才进行格式化，
+    参数中的`bytes`与`bytearray`格式化为16进制字符串。参数在记录时应当是不可变的对象，例如`bytes`。
+    """
+
+    __slots__ = ('fmt', 'args')
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt.format(*[arg.hex() if isinstance(arg, (bytes, bytearray)) else arg for arg in self.args])
+
+
+class _Ring:
+
+    """
+    一个数据源中一个写入线程对应的有界环形缓冲区。
+
+    只有一个写入方，不需要加锁：写入方先写入槽位，再增加单调递增的写入计数`written`。读取方按照seqlock的方式检查计数：
+    读取槽位之前取得计数确定可以读取的范围，读取之后再次取得计数，读取期间被写入方覆盖的槽位作为丢弃的数据。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.written = 0
+
+    def append(self, item):
+        seq = self.written
+        self.slots[seq % self.capacity] = (time.time(), item)
+        self.written = seq + 1
+
+    @property
+    def dropped(self):
+        """被覆盖的数据条数。"""
+        return max(0, self.written - self.capacity)
+
+    def read(self, cursor, limit=None):
+        """从游标开始读取数据。
+
+        :return: (数据列表, 新的游标, 游标之后被覆盖的条数)
+        :rtype: tuple
+        """
+        capacity = self.capacity
+        end = self.written
+        dropped = 0
+        if cursor < end - capacity:
+            # 游标处的数据已经被覆盖，跳到仍然保留的最早的数据
+            dropped = end - capacity - cursor
+            cursor = end - capacity
+        if limit is not None:
+            end = min(end, cursor + limit)
+        slots = self.slots
+        items = [slots[seq % capacity] for seq in range(cursor, end)]
+        # 读取期间写入方可能已经覆盖了最早的槽位
+        lost = min(len(items), self.written - capacity - cursor)
+        if lost > 0:
+            del items[:lost]
+            dropped += lost
+        # 跟踪信息在读取时格式化，读取方得到的都是字符串
+        items = [(stamp, str(item)) if type(item) is TraceMessage else (stamp, item) for stamp, item in items]
+        return items, max(cursor, end), dropped
+
+
+class IOStream:
+
+    """
+    模块与引擎的输出流。每个数据源(`source`)中的每个写入线程对应一个固定容量的环形缓冲区，每个环形缓冲区只有一个写入方，
+    写入不需要加锁，复杂度为O(1)。缓冲区满时覆盖最早的数据并计入丢弃计数，因此内存占用有上限。读取方通过游标增量读取，
+    而不是复制整个缓冲区，同一个数据源中不同线程写入的数据按照时间合并。
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        :param int capacity: 每个数据源的每个写入线程最多保存的条数。
+        """
+        self.capacity = max(1, int(capacity))
+        self._rings = {}
+
+    def _ring(self, source):
+        rings = self._rings.get(source)
+        if rings is None:
+            # setdefault是原子操作，多个线程同时创建时只有一个生效
+            rings = self._rings.setdefault(source, {})
+        ident = threading.get_ident()
+        ring = rings.get(ident)
+        if ring is None:
+            # 每个写入线程使用各自的环形缓冲区，保证只有一个写入方
+            ring = rings.setdefault(ident, _Ring(self.capacity))
+        return ring
+
+    def output(self, source, msg, timeout=3):
+        """向输出流写入数据。
+
+        :param str source: 数据源的标识。
+        :param msg: 要记录的数据。
+        :param timeout: 保留的参数，写入不会阻塞。
+        """
+        self._ring(source).append(msg)
+
+    def sources(self):
+        """获取所有的数据源。
+
+        :rtype: list
+        """
+        return list(self._rings)
+
+    def read(self, source, cursor=0, limit=None):
+        """从游标开始增量读取一个数据源的数据。
+
+        :param str source: 数据源的标识。
+        :param cursor: 游标，第一次读取时为0，之后使用上一次返回的游标。
+        :param int limit: 最多读取的条数，None表示全部读取。
+
+        :return: (数据列表, 新的游标, 两次读取之间被覆盖而丢失的条数)，数据列表中每项为(时间, 数据)。
+        :rtype: tuple
+        """
+        rings = self._rings.get(source)
+        if not rings:
+            return [], cursor, 0
+        # 游标记录每个写入线程的环形缓冲区读取到的位置
+        cursors = cursor if isinstance(cursor, dict) else {}
+        new_cursor = {}
+        merged = []
+        dropped = 0
+        for ident, ring in list(rings.items()):
+            items, end, lost = ring.read(cursors.get(ident, 0), limit)
+            dropped += lost
+            # 先记录第一条未读取的位置，合并后再加上实际读取的条数
+            new_cursor[ident] = end - len(items)
+            merged.append([(stamp, ident, item) for stamp, item in items])
+        if len(merged) == 1:
+            result = merged[0]
+        else:
+            # 每个环形缓冲区中的数据已经按照写入顺序排列，按照时间合并
+            result = list(heapq.merge(*merged, key=lambda entry: entry[0]))
+        if limit is not None:
+            result = result[:limit]
+        for stamp, ident, item in result:
+            new_cursor[ident] += 1
+        return [(stamp, item) for stamp, ident, item in result], new_cursor, dropped
+
+    def stats(self):
+        """获取每个数据源的写入条数、丢弃条数与容量。
+
+        :rtype: dict
+        """
+        stats = {}
+        for source, rings in list(self._rings.items()):
+            rings = list(rings.values())
+            stats[source] = {'written': sum(ring.written for ring in rings),
+                             'dropped': sum(ring.dropped for ring in rings),
+                             'capacity': self.capacity * len(rings)}
+        return stats
+
+    def copy(self, timeout=3):
+        """获取所有数据源当前保存的数据。
+
+        :return: 数据源与数据列表的字典，数据列表中每项为(时间, 数据)。
+        :rtype: dict
+        """
+        return {source: self.read(source)[0] for source in list(self._rings)}
+
+    def clear(self, timeout=3):
+        """清空所有数据源。"""
+        self._rings = {}
@@ -2,7 +2,8 @@
 import math
 import numpy
 
-from collections import Iterable, deque
+from collections import deque
+from collections.abc import Iterable
 
 from frame.stream.processor import Processor
 
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from collections import Iterable
+from collections.abc import Iterable
 
 
 class Processor:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from collections import Counter, deque, Iterable
+from collections import Counter, deque
+from collections.abc import Iterable
 
 from frame.stream.processor import Processor
 from frame.utils import bits
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import json
+import time
+import random
+import socket
+import platform
+
+from frame.kernel.clock import get_clock, set_clock
+from frame.kernel.stats import LatencyHistogram
+from frame.message.can import CANMessage, CANSploitMessage
+from frame.message.isotp import ISOTPMessage
+from frame.message.uds import UDSMessage
+from frame.utils.replay import Replay
+
+#: 基准测试结果的格式版本
+VERSION = 1
+
+#: 每次调用作为一个样本的测试项(解析整个文件、执行一条命令)最少的重复次数，否则延迟的分位数只有一个样本
+MIN_ROUNDS = 5
+
+#: 仓库中自带的转储文件目录
+DUMPS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'dumps')
+
+
+def _latency(hist):
+    return {key: hist.to_dict()[key] for key in ('mean_ns', 'p50_ns', 'p90_ns', 'p99_ns', 'max_ns')}
+
+
+def measure(name, func, items, chunk=100, unit='frames'):
+    """测量对一组输入逐块调用`func`的速度。
+
+    每次调用处理`chunk`个输入，按照每块的平均耗时记录延迟，因此计时本身的开销可以忽略。
+
+    :param str name: 测试项的名称。
+    :param callable func: 处理一块输入的函数，参数为输入的列表。
+    :param list items: 所有的输入。
+    :param int chunk: 每块的数量。
+    :param str unit: 计数的单位。
+
+    :return: 测试结果。
+    :rtype: dict
+    """
+    hist = LatencyHistogram()
+    clock = time.perf_counter_ns
+    started = clock()
+    for index in range(0, len(items), chunk):
+        part = items[index:index + chunk]
+        t0 = clock()
+        func(part)
+        hist.record((clock() - t0) // len(part))
+    return _result(name, unit, len(items), clock() - started, hist)
+
+
+def _result(name, unit, count, elapsed_ns, hist, **extra):
+    seconds = elapsed_ns / 1e9
+    result = {'name': name, 'unit': unit, 'count': count, 'seconds': seconds,
+              'rate': count / seconds if seconds > 0 else 0.0, 'latency_ns': _latency(hist)}
+    result.update(extra)
+    return result
+
+
+def _random_frames(rnd, count):
+    ids = [rnd.randrange(0x7ff) for _ in range(32)]
+    return [(rnd.choice(ids), 8, bytes(rnd.randrange(256) for _ in range(8))) for _ in range(count)]
+
+
+def _messages(frames):
+    messages = []
+    for fid, length, data in frames:
+        msg = CANSploitMessage()
+        msg.CANFrame = CANMessage.init_data(fid, length, data)
+        msg.CANData = True
+        msg.bus = 'bench'
+        messages.append(msg)
+    return messages
+
+
+def bench_can_message(scale):
+    """CANMessage的创建。"""
+    rnd = random.Random(1)
+    frames = _random_frames(rnd, int(100000 * scale))
+    return [measure('can_message.init_data', lambda part: [CANMessage.init_data(*args) for args in part], frames)]
+
+
+def bench_isotp_uds(scale):
+    """ISOTP的重组与UDS会话的处理。"""
+    rnd = random.Random(2)
+    count = int(20000 * scale)
+    sequences = []
+    for _ in range(count):
+        length = rnd.choice([3, 7, 20, 62])
+        sequences.append(ISOTPMessage.generate_can(0x7e0, [0x22] + [rnd.randrange(256) for _ in range(length - 1)]))
+
+    def reassemble(part):
+        for frames in part:
+            message = ISOTPMessage(0x7e0)
+            for can_frame in frames:
+                message.add_can(can_frame)
+
+    # UDS请求与回应成对出现，请求ID为0x7e0，回应ID为0x7e8
+    messages = []
+    for index in range(count):
+        did = [0xf1, index & 0xff]
+        messages.append(ISOTPMessage(0x7e0, 3, [0x22] + did, True))
+        messages.append(ISOTPMessage(0x7e8, 6, [0x62] + did + [1, 2, 3], True))
+
+    def handle(part):
+        uds = UDSMessage(0x08)
+        for message in part:
+            uds.handle_message(message)
+
+    return [measure('isotp.add_can', reassemble, sequences, unit='messages'),
+            measure('uds.handle_message', handle, messages, unit='messages')]
+
+
+def bench_replay(scale):
+    """`Replay.parse_file`解析仓库中的转储文件。"""
+    results = []
+    for path in sorted(glob.glob(os.path.join(DUMPS_DIR, '*.dump'))):
+        hist = LatencyHistogram()
+        frames = 0
+        started = time.perf_counter_ns()
+        for _ in range(max(MIN_ROUNDS, int(10 * scale))):
+            replay = Replay()
+            t0 = time.perf_counter_ns()
+            replay.parse_file(path, 'bench')
+            elapsed = time.perf_counter_ns() - t0
+            frames += len(replay)
+            hist.record(elapsed // max(1, len(replay)))
+        results.append(_result('replay.parse_file[{}]'.format(os.path.basename(path)), 'frames', frames,
+                               time.perf_counter_ns() - started, hist))
+    return results
+
+
+def _engine(config):
+    # 只在需要时导入引擎，避免循环导入
+    from frame.kernel.engine import L6Engine
+    engine = L6Engine()
+    engine.load_config_by_json(config)
+    return engine
+
+
+def bench_analyze(scale):
+    """`analyze`的'protocol','statistic','hypothesis'命令，使用虚拟时钟跳过命令中的等待。"""
+    dumps = sorted(glob.glob(os.path.join(DUMPS_DIR, '*.dump')))
+    if len(dumps) < 2:
+        return []
+    engine = _engine({'name': 'bench', 'modules': {'tools/analyze': {}},
+                      'actions': [{'analyze': {'action': 'read', 'pipe': 1}}]})
+    previous = get_clock()
+    set_clock('virtual')
+    results = []
+    try:
+        engine.call_module(0, 'load ' + dumps[0] + ', ' + dumps[1])
+        frames = len(engine.actions[0][1].all_frames[1]['buf'])
+        for cmdline in ('protocol ALL,1', 'statistic 1', 'hypothesis 2'):
+            hist = LatencyHistogram()
+            started = time.perf_counter_ns()
+            rounds = max(MIN_ROUNDS, int(10 * scale))
+            for _ in range(rounds):
+                t0 = time.perf_counter_ns()
+                ret = engine.call_module(0, cmdline)
+                hist.record((time.perf_counter_ns() - t0) // max(1, frames))
+                if ret.last_error < 0:
+                    raise RuntimeError("{}: {}".format(cmdline, ret.describe))
+            results.append(_result('analyze.' + cmdline.split()[0], 'frames', frames * rounds,
+                                   time.perf_counter_ns() - started, hist))
+    finally:
+        set_clock(previous)
+        engine.engine_exit()
+    return results
+
+
+def bench_filter(scale):
+    """`filter`的黑名单过滤。"""
+    engine = _engine({'name': 'bench', 'modules': {'tools/filter': {}},
+                      'actions': [{'filter': {'pipe': 1, 'black_list': [0x10, 0x20, 0x30]}}]})
+    try:
+        module, params = engine.actions[0][1], engine.actions[0][2]
+        messages = _messages(_random_frames(random.Random(3), int(100000 * scale)))
+        return [measure('filter.do_effect', lambda part: [module.do_effect(msg, params) for msg in part], messages)]
+    finally:
+        engine.engine_exit()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _run_chain(name, make_config, count, timeout):
+    """向第一个动作(hw_fakeIO写)中放入数据帧，运行引擎直到最后一个动作(hw_fakeIO读)收到所有数据帧。
+
+    第一次运行不开启统计，测量整个动作链的速度；第二次开启统计，获取每个动作的延迟。每次运行都通过`make_config`
+    重新生成配置，例如使用新的端口。
+    """
+    frames = [CANMessage.init_data(*args) for args in _random_frames(random.Random(4), count)]
+    result = None
+    for stats in (False, True):
+        engine = _engine(make_config())
+        try:
+            source, sink = engine.actions[0][1], engine.actions[-1][1]
+            source.CANList = list(frames)
+            engine.enable_stats(stats)
+            started = time.perf_counter_ns()
+            engine.start_loop()
+            deadline = time.perf_counter() + timeout
+            while len(sink.CANList) < count and time.perf_counter() < deadline:
+                time.sleep(0.001)
+            elapsed = time.perf_counter_ns() - started
+            received = len(sink.CANList)    # 停止时hw_fakeIO会清空数据帧队列
+            engine.stop_loop()
+            if not stats:
+                hist = LatencyHistogram()
+                hist.record(elapsed // max(1, received))
+                result = _result(name, 'frames', received, elapsed, hist, expected=count)
+            else:
+                result['actions'] = [{'name': action['name'], 'frames_in': action['frames_in'],
+                                      'frames_out': action['frames_out'],
+                                      'latency_ns': {key: action['latency'][key]
+                                                     for key in ('mean_ns', 'p50_ns', 'p99_ns', 'max_ns')}}
+                                     for action in engine.get_stats()['actions']]
+        finally:
+            engine.engine_exit()
+    return result
+
+
+def bench_engine(scale):
+    """完整的引擎动作链：hw_fakeIO -> filter -> hw_fakeIO，以及经过本地回环的hw_TCP2CAN。"""
+    count = int(20000 * scale)
+    results = [_run_chain('engine.fakeIO_chain', lambda: {
+        'name': 'bench',
+        'modules': {'io/hw_fakeIO': {}, 'tools/filter': {}, 'io/hw_fakeIO~2': {}},
+        'actions': [{'hw_fakeIO': {'action': 'write', 'pipe': 1}},
+                    {'filter': {'pipe': 1, 'black_list': [0x800]}},
+                    {'hw_fakeIO~2': {'action': 'read', 'pipe': 1}}]}, count, 60)]
+
+    def tcp2can():
+        port = _free_port()
+        return {
+            'name': 'bench',
+            'modules': {'io/hw_fakeIO': {},
+                        'io/hw_TCP2CAN~1': {'mode': 'server', 'port': port, 'address': '127.0.0.1'},
+                        'io/hw_TCP2CAN~2': {'mode': 'client', 'port': port, 'address': '127.0.0.1'},
+                        'io/hw_fakeIO~2': {}},
+            'actions': [{'hw_fakeIO': {'action': 'write', 'pipe': 1}},
+                        {'hw_TCP2CAN~2': {'action': 'write', 'pipe': 1}},
+                        {'hw_TCP2CAN~1': {'action': 'read', 'pipe': 2}},
+                        {'hw_fakeIO~2': {'action': 'read', 'pipe': 2}}]}
+
+    # hw_TCP2CAN每次轮询只交换一批数据帧，数量减少到1/20，避免测试时间过长
+    results.append(_run_chain('engine.tcp2can_loopback', tcp2can, max(1, count // 20), 30))
+    return results
+
+
+#: 所有的测试组，名称与函数
+SUITES = [
+    ('can', bench_can_message),
+    ('isotp', bench_isotp_uds),
+    ('replay', bench_replay),
+    ('analyze', bench_analyze),
+    ('filter', bench_filter),
+    ('engine', bench_engine),
+]
+
+
+def run_bench(scale=1.0, only=None):
+    """运行基准测试，不需要任何硬件。
+
+    :param float scale: 测试规模的倍数，1为默认规模。
+    :param list only: 只运行指定名称的测试组，None表示全部运行。
+
+    :raises ValueError: 测试组不存在。
+
+    :return: 可以直接保存为JSON的测试结果。
+    :rtype: dict
+    """
+    names = [name for name, _ in SUITES]
+    for name in only or []:
+        if name not in names:
+            raise ValueError("测试组 '{}' 不存在，可选: {}.".format(name, ', '.join(names)))
+    results = []
+    for name, suite in SUITES:
+        if only and name not in only:
+            continue
+        results.extend(suite(scale))
+    return {'version': VERSION, 'timestamp': time.time(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'scale': scale, 'results': results}
+
+
+def dump_bench(report, path=None):
+    """以JSON格式输出测试结果。
+
+    :param dict report: `run_bench`的返回值。
+    :param str path: 保存的文件路径，为None时只返回字符串。
+
+    :rtype: str
+    """
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    return text
@@ -73,3 +73,133 @@ def read(frame: bytes, offset: int, limit: int) -> (int, bytes):
         result[result_size - i - 1] = byte
 
     return result_size, bytes(result)
+
+
+# 数据帧数据的整数形式：按大端解释，第一个字节是最高位，与按位比较的结果相同
+def from_bytes(data: bytes) -> int:
+    return int.from_bytes(data, 'big')
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(value: int) -> int:
+        return value.bit_count()
+else:
+    def popcount(value: int) -> int:
+        return bin(value).count('1')
+
+
+def to_bin(value: int, width: int = 64) -> str:
+    return format(value, '0{}b'.format(width))
+
+
+def to_hex(value: int, width: int = 64) -> str:
+    return format(value, '0{}x'.format((width + 3) // 4))
+
+
+def signed(value: int, width: int) -> int:
+    if width and value >> (width - 1):
+        return value - (1 << width)
+    return value
+
+
+def slice_int(value: int, width: int, start: int, stop: int) -> int:
+    # 按照从最高位开始的位置取出[start, stop)之间的位
+    return (value >> (width - stop)) & ((1 << (stop - start)) - 1)
+
+
+class Bits:
+
+    """
+    定长的位序列，以整数保存，接口与`bitstring.BitArray`中常用的部分相同(`int`,`uint`,`hex`,`bin`,`bytes`,
+    切片以及按位运算)，用于兼容原来使用`bitstring`的代码。需要大量比较时直接使用整数与`popcount`等函数更快。
+
+    第0位是最高位，与`bitstring`相同。
+    """
+
+    __slots__ = ('uint', 'length')
+
+    def __init__(self, value: int = 0, length: int = 64):
+        if value < 0 or value >> length:
+            raise ValueError("数值超出了位序列的长度.")
+        self.uint = value
+        self.length = length
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Bits':
+        return cls(from_bytes(data), len(data) * 8)
+
+    @property
+    def int(self) -> int:
+        return signed(self.uint, self.length)
+
+    @property
+    def bin(self) -> str:
+        return to_bin(self.uint, self.length) if self.length else ''
+
+    @property
+    def hex(self) -> str:
+        if self.length % 4:
+            raise ValueError("位序列的长度不是4的倍数，不能转换为16进制.")
+        return to_hex(self.uint, self.length) if self.length else ''
+
+    @property
+    def bytes(self) -> bytes:
+        if self.length % 8:
+            raise ValueError("位序列的长度不是8的倍数，不能转换为字节.")
+        return self.uint.to_bytes(self.length // 8, 'big')
+
+    def popcount(self):
+        return popcount(self.uint)
+
+    def __len__(self):
+        return self.length
+
+    def __int__(self):
+        return self.uint
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __hash__(self):
+        return hash((self.uint, self.length))
+
+    def __eq__(self, other):
+        if isinstance(other, Bits):
+            return self.uint == other.uint and self.length == other.length
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def _other(self, other):
+        if not isinstance(other, Bits) or other.length != self.length:
+            raise ValueError("按位运算的两个位序列长度必须相同.")
+        return other.uint
+
+    def __xor__(self, other):
+        return Bits(self.uint ^ self._other(other), self.length)
+
+    def __or__(self, other):
+        return Bits(self.uint | self._other(other), self.length)
+
+    def __and__(self, other):
+        return Bits(self.uint & self._other(other), self.length)
+
+    def __invert__(self):
+        return Bits(self.uint ^ ((1 << self.length) - 1), self.length)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                raise ValueError("位序列的切片不支持步长.")
+            stop = max(start, stop)
+            return Bits(slice_int(self.uint, self.length, start, stop), stop - start)
+        index = key + self.length if key < 0 else key
+        if not 0 <= index < self.length:
+            raise IndexError("位序列索引超出范围.")
+        return bool(slice_int(self.uint, self.length, index, index + 1))
+
+    def __repr__(self):
+        return "Bits('0x{}', {})".format(to_hex(self.uint, self.length), self.length)
@@ -1,15 +1,83 @@
 # -*- coding: utf-8 -*-
-import copy
-import time
-
-from frame.message.can import CANSploitMessage, CANMessage
+from frame.kernel import clock
+from frame.message.can import CANSploitMessage, CANMessage, get_interner
+
+
+def parse_dump_line(line, bus):
+    """解析转储文件中的一行。
+
+    文件中的一行为`[时间戳]消息ID:数据长度:十六进制数据`，时间戳可以省略(记为-1.0)；`<时间戳>`表示一个时间点标记。
+    CAN FD数据帧在最后加上`:标志位`(16进制，参见`CANMessage.frame_flags`)，数据最长64字节。
+
+    :param str line: 文件中的一行。
+    :param str bus: 数据帧的总线名称。
+
+    :return: (时间戳, CAN消息结构)，时间点标记的消息结构为None，无效的行返回None。
+    :rtype: tuple
+    """
+    fields = line.split(":")
+    if len(fields) < 3:
+        return None
+    fid = fields[0].strip()
+
+    if fid[0] == "[" and fid.find(']') > 0:
+        time_stamp = float(fid[1:fid.find(']')])
+        fid = fid.split(']')[1].strip()
+    elif fid[0] == "<" and fid.find('>') > 0:
+        return float(fid[1:fid.find('>')]), None
+    else:
+        time_stamp = -1.0
+
+    num_fid = int(fid, 0)
+
+    length = fields[1]
+    data = fields[2]
+    if data[-1:] == "\n":
+        data = data[:-1]
+    if data[-1:] == "\r":
+        data = data[:-1]
+    flags = int(fields[3], 16) if len(fields) > 3 else 0
+    msg = CANSploitMessage()
+    msg.CANFrame = CANMessage.init_data(
+        num_fid, int(length), bytes.fromhex(data)[:64], flags)
+    msg.CANData = True
+    msg.bus = bus
+    return time_stamp, msg
+
+
+def iter_dump(name, bus):
+    """逐行读取转储文件中的数据帧，不会将整个文件读入内存，用于处理较大的文件。
+
+    :param str name: 文件路径。
+    :param str bus: 数据帧的总线名称。
+
+    :return: 依次产生(时间戳, CAN消息结构)的生成器，跳过时间点标记与无效的行。
+    """
+    with open(name.strip(), "r") as ins:
+        for line in ins:
+            parsed = parse_dump_line(line, bus)
+            if parsed is not None and parsed[1] is not None:
+                yield parsed
 
 
 class Replay:
 
-    def __init__(self):
+    """
+    数据帧缓冲区，`_stream`中每一项为`(时间戳, CAN消息结构)`。
+
+    抓包中大量重复相同的数据帧，因此携带数据的消息结构在加入时按值去重：数据帧经过驻留表(`FrameInterner`)得到共用的实例，
+    同一个缓冲区中(数据帧, 总线)相同的消息结构也只保存一个，每一项只是时间戳加上引用。保存的消息结构是只读的，
+    取出(`next`、`stream`)时返回副本。
+    """
+
+    def __init__(self, interner=None):
+        """
+        :param FrameInterner interner: 数据帧驻留表，默认使用进程内共用的驻留表(`get_interner`)。
+        """
+        self._interner = interner if interner is not None else get_interner()
+        self._messages = {}
         self._stream = []
-        self._last = time.clock()
+        self._last = clock.now()
         self._curr = 0
         self._pre_last = 0
         self._shift = 0
@@ -17,23 +85,50 @@ class Replay:
         self.add_timestamp()
 
     def reset(self):
-        self._last = time.clock()
+        self._last = clock.now()
         self._curr = 0
         self._pre_last = 0
 
     @property
     def stream(self):
-        return copy.deepcopy(self._stream)
+        return [[times, msg.share()] for times, msg in self._stream]
 
     def passed_time(self):
-        return time.clock() + self._shift - self._last
+        return clock.now() + self._shift - self._last
 
     def restart_time(self, shift=.0):
-        self._last = time.clock() - shift
+        self._last = clock.now() - shift
+
+    def _shared(self, can_msg):
+        # 按值去重，(数据帧, 总线)相同的消息结构共用一个；带有调试数据的消息结构不去重
+        frame = self._interner.intern(can_msg.CANFrame)
+        if can_msg.debugText or can_msg.debugData:
+            msg = can_msg.share()
+            msg.CANFrame = frame
+            return msg
+        key = (frame, can_msg.bus)
+        msg = self._messages.get(key)
+        if msg is None:
+            msg = CANSploitMessage()
+            msg.CANFrame = frame
+            msg.CANData = True
+            msg.bus = can_msg.bus
+            if len(self._messages) < self._interner.max_size:
+                self._messages[key] = msg
+        return msg
+
+    def intern_stats(self):
+        """数据帧驻留表的统计，参见`FrameInterner.stats`；`messages`为本缓冲区中共用的消息结构数量。
+
+        :rtype: dict
+        """
+        stats = self._interner.stats()
+        stats['messages'] = len(self._messages)
+        return stats
 
     def append_time(self, times, can_msg):
         if can_msg.CANData:
-            self._stream.append([times, copy.deepcopy(can_msg)])
+            self._stream.append((times, self._shared(can_msg)))
             self._size += 1
 
     def append(self, can_msg):
@@ -42,11 +137,13 @@ class Replay:
         没有时间搓信息。
         """
         if can_msg.CANData:
-            self._stream.append([self.passed_time(), copy.deepcopy(can_msg)])
+            # 跨进程传递的消息带有产生时的时间点，不计入在缓冲区中排队的时间
+            times = can_msg.stamp + self._shift - self._last if can_msg.stamp else self.passed_time()
+            self._stream.append((times, self._shared(can_msg)))
             self._size += 1
 
         elif can_msg.debugData:
-            self._stream.append([0.0, copy.deepcopy(can_msg)])
+            self._stream.append((0.0, can_msg.share()))
 
     def set_index(self, i=0):
         if i < len(self):
@@ -73,7 +170,7 @@ class Replay:
     def add_timestamp(self, def_time=None):
         msg = CANSploitMessage()
         if not def_time:
-            msg.debugText = str(time.time())
+            msg.debugText = str(clock.wall())
         else:
             msg.debugText = str(def_time)
         msg.CANFrame = None
@@ -82,7 +179,7 @@ class Replay:
         msg.bus = "TIMESTAMP"
         self._pre_last = 0
         self.restart_time()
-        self._stream.append([0.0, msg])
+        self._stream.append((0.0, msg))
 
     def __iter__(self):
         return iter(self._stream)
@@ -93,7 +190,7 @@ class Replay:
                 if self._stream[self._curr][1].CANData:
                     ret = self._stream[self._curr][1]
                     self._curr += 1
-                    return copy.deepcopy(ret)
+                    return ret.share()
                 else:
                     self._curr += 1
                     return None
@@ -106,43 +203,54 @@ class Replay:
                 if self._stream[self._curr][0] < self._pre_last:
                     self._pre_last = 0
 
-                if self._pre_last != 0.0 and self._stream[self._curr][0] >= 0 and self.passed_time() > (self._stream[self._curr][0]):
-                    time.sleep(offset)
+                if self._pre_last != 0.0 and self._stream[self._curr][0] >= 0 and self.passed_time() >= (self._stream[self._curr][0]):
+                    clock.sleep(offset)
                     self._pre_last = self._stream[self._curr][0]
                     ret = self._stream[self._curr][1]
                     self._curr += 1
-                    return copy.deepcopy(ret)
+                    return ret.share()
                 elif self._pre_last == 0.0:
-                    time.sleep(offset)
+                    clock.sleep(offset)
                     self._pre_last = self._stream[self._curr][0]
                     ret = self._stream[self._curr][1]
                     self.restart_time(self._stream[self._curr][0])
                     self._curr += 1
-                    return copy.deepcopy(ret)
+                    return ret.share()
                 elif self._stream[self._curr][0] < 0:
-                    time.sleep(offset)
+                    clock.sleep(offset)
                     self.restart_time()
                     self._pre_last = 0.0
                     ret = self._stream[self._curr][1]
                     self._curr += 1
-                    return copy.deepcopy(ret)
+                    return ret.share()
                 else:
                     return None
         else:
             self._curr = 0
             return Exception('No more messages!')
 
+    def next_due(self):
+        """按照时间戳回放(`next`的`notime`为False)时，下一个数据帧可以取出的时间点。
+
+        :return: `clock.now()`时间点，需要立即取出时返回0。
+        :rtype: float
+        """
+        if self._curr >= len(self._stream):
+            return 0
+        times, msg = self._stream[self._curr]
+        if msg.debugData or self._pre_last == 0.0 or times < 0 or times < self._pre_last:
+            return 0
+        return times + self._last - self._shift
+
     def __add__(self, other):
         newRep = Replay()
         newRep._size = len(self) + len(other)
-        new = copy.deepcopy(other)
         if (len(self)) > 0:
             last_time = self.get_message(len(self) - 1)[0]
         else:
             last_time = 0
-        for each in new._stream:
-            each[0] += last_time
-        newRep._stream = self._stream + new._stream
+        # 保存的消息结构是只读的，可以直接共用
+        newRep._stream = self._stream + [(times + last_time, msg) for times, msg in other._stream]
 
         return newRep
 
@@ -150,52 +258,58 @@ class Replay:
         return self._size
 
     def parse_file(self, name, _bus):
+        lookups, hits = self._interner.lookups, self._interner.hits
         try:
             with open(name.strip(), "r") as ins:
                 # "[TIME_STAMP]0x111:4:11223344"
                 for line in ins:
-                    if len(line[:].split(":")) >= 3:
-                        fid = line[:].split(":")[0].strip()
-
-                        if fid[0] == "[" and fid.find(']') > 0:
-                            time_stamp = float(fid[1:fid.find(']')])
-                            fid = fid.split(']')[1].strip()
-                        elif fid[0] == "<" and fid.find('>') > 0:
-                            time_stamp = float(fid[1:fid.find('>')])
-                            self.add_timestamp(time_stamp)
-                            continue
-                        elif len(line[:-1].split(":")) >= 3:
-                            time_stamp = -1.0
-                        else:
-                            time_stamp = -1.0
-
-                        num_fid = int(fid, 0)
-
-                        length = line[:].split(":")[1]
-                        data = line[:].split(":")[2]
-                        if data[-1:] == "\n":
-                            data = data[:-1]
-                        if data[-1:] == "\r":
-                            data = data[:-1]
-                        msg = CANSploitMessage()
-                        msg.CANFrame = CANMessage.init_data(
-                            num_fid, int(length), bytes.fromhex(data)[:8])
-                        msg.CANData = True
-                        msg.bus = _bus
-                        self._stream.append([time_stamp, msg])
-                        self._size += 1
+                    parsed = parse_dump_line(line, _bus)
+                    if parsed is None:
+                        continue
+                    time_stamp, msg = parsed
+                    if msg is None:
+                        self.add_timestamp(time_stamp)
+                        continue
+                    self._stream.append((time_stamp, self._shared(msg)))
+                    self._size += 1
         except Exception as e:
             # print(str(e))
             return "Can't open files with CAN messages: " + str(e)
-        return "Loaded from file: " + str(len(self)) + " messages"
+        lookups = self._interner.lookups - lookups
+        hits = self._interner.hits - hits
+        return "Loaded from file: " + str(len(self)) + " messages, intern hit rate: {:.1%}".format(
+            hits / lookups if lookups else 0.0)
+
+    def to_batch(self, width=None):
+        """将携带数据的数据帧转换为按列保存的批次，时间点标记与调试数据不会被保存。
+
+        :param int width: 数据字段的宽度，8或者64，为None时有超过8字节的CAN FD数据帧则为64，否则为8。
+
+        :rtype: FrameBatch
+        """
+        # 批次依赖numpy，只在使用时导入，不影响命令行的启动时间
+        from frame.message.batch import FrameBatch
+        if width is None:
+            width = 64 if any(msg.CANData and msg.CANFrame.frame_length > 8 for _, msg in self._stream) else 8
+        return FrameBatch.from_messages(self._stream, width=width)
+
+    def extend_batch(self, batch):
+        """在末尾追加批次中的所有数据帧，时间戳使用批次中的时间戳。
+
+        :param FrameBatch batch: 数据帧批次。
+        """
+        for times, msg in batch:
+            self._stream.append((times, self._shared(msg)))
+            self._size += 1
 
     def remove_by_id(self, idf):
-        i = 0
-        for times, msg in self._stream:
+        # 消息结构是共用的，不能直接修改，替换为不携带数据的副本
+        for i, (times, msg) in enumerate(self._stream):
             if msg.CANData and msg.CANFrame.frame_id == idf:
-                self._stream[i][1].CANData = False
+                removed = msg.share()
+                removed.CANData = False
+                self._stream[i] = (times, removed)
                 self._size -= 1
-            i += 1
 
     def search_messages_by_id(self, idf):
         i = 0
@@ -7,6 +7,8 @@ import sys
 import traceback
 
 from frame.kernel.engine import L6Engine
+from frame.kernel.batch import BatchRunner
+from frame.kernel.clock import set_clock
 from frame.stream.cmdres import CmdResult, CMDRES_ERROR, CMDRES_NULL, CMDRES_INT, CMDRES_STR, CMDRES_TAB, CMDRES_OBJ
 
 
@@ -78,14 +80,37 @@ class FrameCLI(cmd.Cmd):
         print('编辑模块 {}'.format(self.l6engine.actions[module][0]))
         print('添加参数: {}'.format(self.l6engine.actions[module][2]))
 
-        active = self.l6engine.actions[module][1].is_active
-        if active:
-            self.l6engine.actions[module][1].do_activate(0, 0)
-        if self.l6engine.status_loop:
-            self.l6engine.actions[module][1].do_stop(paramz)
-            self.l6engine.actions[module][1].do_start(paramz)
-        if active:
-            self.l6engine.actions[module][1].do_activate(0, 1)
+        self.l6engine.restart_module(module, paramz)
+
+    def do_reload(self, arg):
+        """热加载策略文件或者模块，引擎运行时不需要停止，没有变化的模块保留原来的状态与打开的设备。
+
+        reload                  重新加载当前的策略文件
+        reload <策略文件>        加载新的策略文件
+        reload -m <模块名> ...   重新导入指定的模块
+
+        例如:
+            reload -m analyze
+        """
+        args = arg.split()
+        fullpath = None
+        modules = []
+        if args and args[0] == '-m':
+            modules = args[1:]
+            if not modules:
+                print('丢失/无效的参数. 参见: help reload')
+                return
+        elif args:
+            fullpath = args[0]
+        try:
+            kept, created, removed = self.l6engine.reload_config(fullpath, modules)
+        except Exception:
+            print('热加载发生错误 {}:'.format(arg))
+            traceback.print_exc()
+            return
+        print('保留模块: {}'.format(', '.join(kept) or '无'))
+        print('重新加载: {}'.format(', '.join(created) or '无'))
+        print('移除模块: {}'.format(', '.join(removed) or '无'))
 
     def do_cmd(self, arg):
         """调用模块命令。
@@ -123,6 +148,106 @@ class FrameCLI(cmd.Cmd):
         if len(text) != 0:
             print('回应: {}'.format(text))
 
+    def do_stats(self, arg):
+        """显示每个动作的统计信息。
+
+        stats               显示统计信息
+        stats on|off        开启/关闭统计
+        stats reset         清空统计信息
+        stats json [文件]   以JSON格式输出统计信息，指定文件时保存到文件
+
+        例如:
+            stats json /tmp/stats.json
+        """
+        args = arg.split()
+        if args and args[0] in ['on', 'off']:
+            self.l6engine.enable_stats(args[0] == 'on')
+            print('统计已{}'.format('开启' if args[0] == 'on' else '关闭'))
+            return
+        if args and args[0] == 'reset':
+            self.l6engine.reset_stats()
+            print('统计已清空')
+            return
+
+        stats = self.l6engine.get_stats()
+        if stats is None:
+            print('统计未开启. 参见: help stats')
+            return
+        if args and args[0] == 'json':
+            text = self.l6engine.dump_stats(args[1] if len(args) > 1 else None)
+            if len(args) > 1:
+                print('保存到 {}'.format(args[1]))
+            else:
+                print(text)
+            return
+
+        print('统计时间 {:.1f} 秒:'.format(stats['elapsed']), end='\n' * 2)
+        table = []
+        for action in stats['actions']:
+            latency = action['latency']
+            table.append(['({})'.format(action['index']), action['name'], str(action['calls']),
+                          str(action['frames_in']), str(action['frames_out']),
+                          '{:.1f}'.format(latency['mean_ns'] / 1000.0),
+                          '{:.1f}'.format(latency['p50_ns'] / 1000.0),
+                          '{:.1f}'.format(latency['p99_ns'] / 1000.0),
+                          '{:.1f}'.format(latency['max_ns'] / 1000.0),
+                          '{:.3f}'.format(latency['total_ns'] / 1e9),
+                          '{:.3f}'.format(action['block_wait_ns'] / 1e9)])
+        header = ('索引号', '模块', '调用', '输入帧', '输出帧', '平均(us)',
+                  'p50(us)', 'p99(us)', '最大(us)', '总耗时(s)', '锁等待(s)')
+        print_table(header, table)
+
+    def do_profile(self, arg):
+        """采样分析引擎线程、模块线程与命令行线程，引擎不需要停止。
+
+        profile                     显示采样状态与采样最多的函数
+        profile start [间隔(ms)]    开始采样，默认间隔5ms
+        profile stop                停止采样
+        profile dump [文件]         以折叠格式输出调用栈，可以直接生成火焰图
+        profile reset               清空采样结果
+
+        例如:
+            profile start 2
+            cmd 0 protocol ALL,1
+            profile dump /tmp/canfuzz.folded
+        """
+        args = arg.split()
+        if args and args[0] == 'start':
+            try:
+                interval = float(args[1]) / 1000.0 if len(args) > 1 else 0.005
+                profiler = self.l6engine.start_profiler(interval)
+            except ValueError as e:
+                print('无效的参数: {}'.format(e))
+                return
+            print('采样已开始, 间隔 {:.1f} ms'.format(profiler.interval * 1000.0))
+            return
+
+        profiler = self.l6engine.get_profiler()
+        if profiler is None:
+            print('采样未开始. 参见: help profile')
+            return
+        if args and args[0] == 'stop':
+            self.l6engine.stop_profiler()
+            print('采样已停止, 共 {} 次'.format(profiler.samples))
+            return
+        if args and args[0] == 'reset':
+            profiler.clear()
+            print('采样结果已清空')
+            return
+        if args and args[0] == 'dump':
+            text = profiler.dump(args[1] if len(args) > 1 else None)
+            if len(args) > 1:
+                print('保存到 {}'.format(args[1]))
+            else:
+                print(text)
+            return
+
+        print('采样{}, 共 {} 次:'.format('中' if profiler.running else '已停止', profiler.samples), end='\n' * 2)
+        samples = max(1, profiler.samples)
+        table = [[function, str(count), '{:.1f}'.format(count * 100.0 / samples)]
+                 for function, count in profiler.top(20)]
+        print_table(('函数', '采样', '占比(%)'), table)
+
     def do_help(self, arg):
         """显示帮助。
 
@@ -155,8 +280,123 @@ class FrameCLI(cmd.Cmd):
         raise SystemExit
 
 
-def run_canfuzz():
+def print_table(header, table):
+    """按照列的最大宽度打印表格。"""
+    sizes = [6] * len(header)
+    for row in table + [list(header)]:
+        sizes = list(map(max, zip(map(len, row), sizes)))
+    row_format = ''.join('{{:{}}}'.format(size + 2) for size in sizes)
+    print(row_format.format(*header))
+    print('-' * (sum(sizes) + 2 * len(sizes)))
+    for row in table:
+        print(row_format.format(*row))
+    print()
+
+
+def pop_option(argv, name):
+    """从命令行参数中取出一个带值的选项，没有指定时返回None。"""
+    if name not in argv:
+        return None
+    index = argv.index(name)
+    if index + 1 >= len(argv):
+        raise SystemExit('选项 {} 缺少参数'.format(name))
+    value = argv[index + 1]
+    del argv[index:index + 2]
+    return value
+
+
+def run_batch(strategy, input_path, output_dir, pipe=None, clock=None):
+    """无界面的批处理模式，将转储文件以最快的速度送入策略的动作链，结束后打印每个模块的处理速度。
+
+    :param str strategy: 策略文件。
+    :param str input_path: 转储文件。
+    :param str output_dir: 输出目录，保存各个管道的数据帧与统计信息。
+    :param str pipe: 输入管道，默认为第一个动作的管道。
+    :param str clock: 时钟，'real'或者'virtual'，None表示使用策略文件中的设置。
+    """
     can_engine = L6Engine()
+    can_engine.load_config(strategy)
+    if clock is not None:
+        set_clock(clock)
+    runner = BatchRunner(can_engine, input_path, output_dir, pipe)
+    try:
+        stats = runner.run()
+    finally:
+        can_engine.engine_exit()
+
+    elapsed = stats['elapsed']
+    print('处理 {} 帧, 耗时 {:.3f} 秒, {:.0f} 帧/秒'.format(
+        stats['frames'], elapsed, stats['frames'] / elapsed if elapsed > 0 else 0), end='\n' * 2)
+    table = []
+    for action in stats['actions']:
+        seconds = action['latency']['total_ns'] / 1e9
+        frames = max(action['frames_in'], action['frames_out'])
+        table.append(['({})'.format(action['index']), action['name'], str(action['calls']),
+                      str(action['frames_in']), str(action['frames_out']), '{:.3f}'.format(seconds),
+                      '{:.0f}'.format(frames / seconds if seconds > 0 else 0)])
+    print_table(('索引号', '模块', '调用', '输入帧', '输出帧', '总耗时(s)', '帧/秒'), table)
+    if output_dir:
+        print('输出保存到 {}'.format(output_dir))
+
+
+def run_bench(output, scale=None, only=None):
+    """运行不需要硬件的基准测试，打印结果表格，JSON格式的结果保存到文件或者打印到标准输出。
+
+    :param str output: JSON结果的文件路径，None表示打印到标准输出。
+    :param str scale: 测试规模的倍数。
+    :param str only: 只运行的测试组，以逗号分隔。
+    """
+    # 只在需要时导入，不影响正常启动
+    from frame.utils.bench import run_bench as bench, dump_bench
+    try:
+        report = bench(float(scale) if scale else 1.0, only.split(',') if only else None)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    table = []
+    for result in report['results']:
+        latency = result['latency_ns']
+        table.append([result['name'], str(result['count']), result['unit'], '{:.0f}'.format(result['rate']),
+                      '{:.2f}'.format(latency['p50_ns'] / 1000), '{:.2f}'.format(latency['p99_ns'] / 1000)])
+    print_table(('测试项', '数量', '单位', '速度(个/秒)', 'p50(us)', 'p99(us)'), table)
+    text = dump_bench(report, output)
+    if output:
+        print('结果保存到 {}'.format(output))
+    else:
+        print(text)
+
+
+def run_canfuzz():
+    #
+    # '--bench [--output 结果文件] [--scale 倍数] [--only 测试组,...]' 不需要硬件的基准测试
+    #
+    argv = sys.argv[1:]
+    if '--bench' in argv:
+        argv.remove('--bench')
+        run_bench(pop_option(argv, '--output'), pop_option(argv, '--scale'), pop_option(argv, '--only'))
+        return
+
+    #
+    # '--batch 策略文件 --input 转储文件 [--output 输出目录] [--pipe 管道] [--clock real|virtual]' 无界面的批处理模式
+    #
+    strategy = pop_option(argv, '--batch')
+    if strategy is not None:
+        input_path = pop_option(argv, '--input')
+        if input_path is None:
+            raise SystemExit('批处理模式需要指定 --input')
+        run_batch(strategy, input_path, pop_option(argv, '--output'), pop_option(argv, '--pipe'),
+                  pop_option(argv, '--clock'))
+        return
+
+    #
+    # '--async' 使用基于asyncio的引擎
+    #
+    if '--async' in argv:
+        argv.remove('--async')
+        # 只在需要时导入asyncio，减少启动时间
+        from frame.kernel.async_engine import AsyncL6Engine
+        can_engine = AsyncL6Engine()
+    else:
+        can_engine = L6Engine()
     modules = can_engine.list_modules()
     print('List of available modules (total {}):'.format(len(modules)))
     for name, info in modules.items():
@@ -166,10 +406,26 @@ def run_canfuzz():
     #
     # 这里判断命令行
     #
-    if len(sys.argv) >= 2:
-        can_engine.load_config(sys.argv[1])
+    rpc_path = pop_option(argv, '--rpc')
+    if len(argv) >= 1:
+        can_engine.load_config(argv[0])
     # can_engine.load_config('./config/test_edeck.py')
 
+    #
+    # '--rpc 套接字文件' 启动JSON-RPC控制接口，标准输入不是终端时不进入命令行，直到RPC服务被关闭
+    #
+    if rpc_path is not None:
+        server = can_engine.start_rpc(rpc_path)
+        if not sys.stdin.isatty():
+            try:
+                while not server.closed.wait(0.5):
+                    pass
+            except KeyboardInterrupt:
+                pass
+            can_engine.stop_loop()
+            can_engine.engine_exit()
+            return
+
     # run command line
     prompt = FrameCLI(can_engine)
     prompt.cmdloop()
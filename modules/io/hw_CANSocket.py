@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import socket
 import struct
+import asyncio
 import traceback
 
-from frame.message.can import CANMessage, CANSploitMessage
+from frame.message.can import CANMessage, CANSploitMessage, FD_FDF
 from frame.kernel.module import CANModule, Command
 from frame.stream.cmdres import CmdResult, CMDRES_STR
 
+# struct can_frame与struct canfd_frame的大小
+CAN_MTU = 16
+CANFD_MTU = 72
+
 
 class hw_CANSocket(CANModule):
     name = "CANSocket设备驱动"
@@ -17,6 +22,11 @@ class hw_CANSocket(CANModule):
                 "describe": "设备接口名称。",
                 "type": "str",
                 "default": "vcan0"
+            },
+            "fd": {
+                "describe": "是否收发CAN FD数据帧(CAN_RAW_FD_FRAMES)。",
+                "type": "bool",
+                "default": False
             }
         },
         "action_parameters": {
@@ -37,8 +47,10 @@ class hw_CANSocket(CANModule):
         self._socket = None
         self._device = init_params.get('iface', None)
         self._bus = init_params.get('bus', 'CANSocket')
+        self._fd = bool(init_params.get('fd', False))
         self.commands['write'] = Command(
-            "直接发送CAN数据帧, 类似如下字符串形式: 01A#11223344", 1, " <数据帧字符串> ", self.dev_write, True)
+            "直接发送CAN数据帧, 类似如下字符串形式: 01A#11223344, CAN FD数据帧: 01A##<标志位><数据>", 1, " <数据帧字符串> ",
+            self.dev_write, True)
         self._active = True
         self._run = False
 
@@ -46,13 +58,18 @@ class hw_CANSocket(CANModule):
         ret = CmdResult()
         if self._run:
             try:
-                idf, dataf = data.strip().split('#')
+                idf, dataf = data.strip().split('#', 1)
+                flags = 0
+                if dataf[0:1] == '#':
+                    # 与cansend相同，'##'之后的第一个字符为CAN FD的标志位
+                    flags = int(dataf[1], 16) | FD_FDF
+                    dataf = dataf[2:]
                 dataf = bytes.fromhex(dataf)
                 idf = int(idf, 16)
-                lenf = min(8, len(dataf))
+                lenf = min(64 if flags else 8, len(dataf))
                 message = CANSploitMessage()
                 message.CANData = True
-                can_msg = CANMessage.init_data(idf, lenf, dataf[0:lenf])
+                can_msg = CANMessage.init_data(idf, lenf, dataf[0:lenf], flags)
                 message.CANFrame = can_msg
                 self.do_write(message)
                 ret = CmdResult(cmdline='write ' + data, describe="网络发送数据",
@@ -72,6 +89,8 @@ class hw_CANSocket(CANModule):
                 self._socket = socket.socket(
                     socket.PF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
                 self._socket.setblocking(0)
+                if self._fd:
+                    self._socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FD_FRAMES, 1)
                 self._socket.bind((self._device,))
                 self._run = True
             except Exception as e:
@@ -87,6 +106,11 @@ class hw_CANSocket(CANModule):
                 self._run = False
                 self.fatal_error("停止失败", e)
 
+    def get_fileno(self, args):
+        if self._run and args.get('action') == 'read':
+            return self._socket.fileno()
+        return None
+
     def do_effect(self, can_msg, args):
         if args.get('action') == 'read':
             can_msg = self.do_read(can_msg)
@@ -96,31 +120,80 @@ class hw_CANSocket(CANModule):
             self.fatal_error('命令 ' + args['action'] + ' 没有实现')
         return can_msg
 
+    def do_effect_batch(self, batch, args):
+        if args.get('action') == 'read':
+            # 读取套接字中所有可用的数据帧，直到没有数据或者达到批量上限
+            if self._run:
+                for _ in range(self._batch_size):
+                    can_msg = self.do_read(CANSploitMessage())
+                    if not can_msg.CANData:
+                        break
+                    batch.append(can_msg)
+        elif args.get('action') == 'write':
+            for can_msg in batch:
+                self.do_write(can_msg)
+        else:
+            self.fatal_error('命令 ' + args['action'] + ' 没有实现')
+        return batch
+
+    async def do_effect_async(self, can_msg, args):
+        if args.get('action') == 'write':
+            await self.do_write_async(can_msg)
+            return can_msg
+        return self.do_effect(can_msg, args)
+
+    async def do_effect_batch_async(self, batch, args):
+        if args.get('action') == 'write':
+            for can_msg in batch:
+                await self.do_write_async(can_msg)
+            return batch
+        return self.do_effect_batch(batch, args)
+
     def do_read(self, can_msg):
         if self._run and not can_msg.CANData:
             try:
-                can_frame = self._socket.recv(16)
-                self.info("读取: " + self.get_hex(can_frame))
-                if len(can_frame) == 16:
+                # 开启CAN FD后套接字中同时有两种大小的数据帧
+                can_frame = self._socket.recv(CANFD_MTU if self._fd else CAN_MTU)
+                self.trace("读取: {}", can_frame)
+                if len(can_frame) in (CAN_MTU, CANFD_MTU):
                     idf = struct.unpack("I", can_frame[0:4])[0]
                     if idf & 0x80000000:
                         idf &= 0x7FFFFFFF
+                    flags = can_frame[5] | FD_FDF if len(can_frame) == CANFD_MTU else 0
                     can_msg.CANFrame = CANMessage.init_data(
-                        idf, can_frame[4], can_frame[8:8 + can_frame[4]])
+                        idf, can_frame[4], can_frame[8:8 + can_frame[4]], flags)
                     can_msg.bus = self._bus
                     can_msg.CANData = True
             except:
                 return can_msg
         return can_msg
 
+    @staticmethod
+    def _pack_frame(can_frame):
+        idf = can_frame.frame_id
+        if can_frame.frame_ext:
+            idf |= 0x80000000
+        if can_frame.frame_flags:
+            # struct canfd_frame: CANID, 长度, 标志位, 2字节保留, 64字节数据
+            return struct.pack("IBBxx", idf, can_frame.frame_length, can_frame.frame_flags) + \
+                can_frame.frame_raw_data.ljust(CANFD_MTU - 8, b"\x00")
+        return struct.pack("I", idf) + struct.pack("B", can_frame.frame_length) + b"\xff\xff\xff" + \
+            can_frame.frame_raw_data[0:can_frame.frame_length] + b"0" * (
+                8 - can_frame.frame_length)
+
     def do_write(self, can_msg):
         if can_msg.CANData:
-            idf = can_msg.CANFrame.frame_id
-            if can_msg.CANFrame.frame_ext:
-                idf |= 0x80000000
-            data = struct.pack("I", idf) + struct.pack("B", can_msg.CANFrame.frame_length) + b"\xff\xff\xff" + \
-                can_msg.CANFrame.frame_raw_data[0:can_msg.CANFrame.frame_length] + b"0" * (
-                    8 - can_msg.CANFrame.frame_length)
+            data = self._pack_frame(can_msg.CANFrame)
             self._socket.send(data)
-            self.info("写入: " + self.get_hex(data))
+            self.trace("写入: {}", data)
+        return can_msg
+
+    async def do_write_async(self, can_msg):
+        """
+        异步引擎中发送数据帧，发送队列已满时在事件循环中等待套接字可写，而不是抛出异常。
+        """
+        if can_msg.CANData and self._run:
+            data = self._pack_frame(can_msg.CANFrame)
+            await asyncio.get_running_loop().sock_sendall(self._socket, data)
+            self.trace("写入: {}", data)
         return can_msg
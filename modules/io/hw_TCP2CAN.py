@@ -1,11 +1,13 @@
 import time
 import struct
 import socket
+import asyncio
 import threading
+import collections
 import traceback
 import socketserver
 
-from frame.message.can import CANMessage
+from frame.message.can import CANMessage, CANSploitMessage
 from frame.kernel.module import CANModule, Command
 from frame.stream.cmdres import CmdResult, CMDRES_ERROR, CMDRES_NULL, CMDRES_INT, CMDRES_STR, CMDRES_TAB, CMDRES_OBJ
 
@@ -47,31 +49,20 @@ class CustomTCPClient:
                     inc_size = 16 * ready   # 每16个字节为一组
                     if ready > 0:
                         inc_data = self.socket.recv(inc_size)  # 获取数据
-                        idx = 0
-                        # 循环接收数据
-                        while ready != 0:
-                            packet = inc_data[idx:idx + 16]
-                            # 如果接收到的数据前3个并非'ct\x03'，则协议出错,这个表明是CAN包
-                            if packet[0:3] != b'ct\x03':
-                                self.selfx.error('客户端获取错误协议')
-                                break
-                            else:
-                                # 分别从packet中取出 fid,flen,fdata
-                                fid = struct.unpack("!I", packet[3:7])[0]
-                                flen = packet[7]
-                                fdata = packet[8:16]
-                                # 检查队列是否在使用，如果在使用则停止一段时间
-                                while self._access_in.is_set():
-                                    time.sleep(0.0001)
-                                self._access_in.set()
-                                # 写入列表
-                                self.CANList_in.append(
-                                    CANMessage.init_data(int(fid), flen, fdata)
-                                )
-                                self._access_in.clear()
-                            # 下一组
-                            idx += 16
-                            ready -= 1
+                        # 如果接收到的数据标记并非'ct\x03'(CAN FD为'cf\x03')，则协议出错
+                        frames = _unpack_frames(b'ct\x03', inc_data)
+                        if frames is None:
+                            self.selfx.error('客户端获取错误协议')
+                        else:
+                            # 检查队列是否在使用，如果在使用则停止一段时间
+                            while self._access_in.is_set():
+                                time.sleep(0.0001)
+                            self._access_in.set()
+                            # 写入列表
+                            self.CANList_in.extend(frames)
+                            self._access_in.clear()
+                        # 通知引擎有新的数据到达
+                        self.selfx.notify()
                 #
                 # 从这里开始是处理发送的字段，首先会检测输出队列是否在使用
                 #
@@ -83,21 +74,13 @@ class CustomTCPClient:
                 if ready > 0:
                     #
                     # 进行组包
-                    # 1. 'c\x04' + CAN包的个数
-                    # 2. 'ct\x05' + CAN包数据
+                    # 1. 'c\x04' + 16字节的组数
+                    # 2. 'ct\x05' + CAN包数据，CAN FD数据帧占用多组
                     #
-                    sz = struct.pack("!H", ready)
-                    send_msg = b'c\x04' + sz
+                    send_msg = _pack_frames(b'ct\x05', self.CANList_out)
+                    self.socket.sendall(b'c\x04' + struct.pack("!H", len(send_msg) // 16))
                     self.socket.sendall(send_msg)
-                    send_msg = b''
-                    for can_msg in self.CANList_out:
-                        # 16字节，CAN包数据如果字段没有占用满，则使用0补齐
-                        send_msg += b'ct\x05' + (b'\x00' * (4 - len(can_msg.frame_raw_id))) + can_msg.frame_raw_id + \
-                            can_msg.frame_raw_length + can_msg.frame_raw_data + \
-                            (b'\x00' * (8 - can_msg.frame_length))
-                    if ready > 0:
-                        self.socket.sendall(send_msg)
-                        self.CANList_out = []
+                    self.CANList_out = []
 
                 self._access_out.clear()
             except Exception as e:
@@ -130,6 +113,21 @@ class CustomTCPClient:
         else:
             return None
 
+    def read_can_many(self, limit):
+        """
+        一次读取最多`limit`个CAN数据帧
+        """
+        if len(self.CANList_in) > 0:
+            while self._access_in.is_set():
+                time.sleep(0.0001)
+            self._access_in.set()
+            msgs = self.CANList_in[:limit]
+            del self.CANList_in[:limit]
+            self._access_in.clear()
+            return msgs
+        else:
+            return []
+
     def close(self):
         self._stop_handle = True
         while (self._access_out.is_set() or self._access_in.is_set()):
@@ -183,6 +181,18 @@ class CustomTCPServer(socketserver.ThreadingTCPServer):
         else:
             return None
 
+    def read_can_many(self, limit):
+        if len(self.CANList_in) > 0:
+            while self._access_in.is_set():
+                time.sleep(0.0001)
+            self._access_in.set()
+            msgs = self.CANList_in[:limit]
+            del self.CANList_in[:limit]
+            self._access_in.clear()
+            return msgs
+        else:
+            return []
+
     def close(self):
         self._stop_handle = True
 
@@ -196,7 +206,7 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
         self.server._access_in.clear()
         self.server._access_out.clear()
 
-        while self.server.selfx._server._stop_handle is False:
+        while self.server._stop_handle is False:
             # 获取前四个字节的头
             data = self.request.recv(4)
 
@@ -206,18 +216,9 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
                     while self.server._access_out.is_set():
                         time.sleep(0.0001)
                     self.server._access_out.set()
-                    ready = len(self.server.CANList_out)
-
-                    sz = struct.pack("!H", ready)
-                    send_msg = b'c\x02' + sz
-                    self.request.sendall(send_msg)
-                    send_msg = b''
-                    for can_msg in self.server.CANList_out:
-                        # 16 字节
-                        send_msg += b'ct\x03' + (b'\x00' * (4 - len(can_msg.frame_raw_id))) + can_msg.frame_raw_id + \
-                            can_msg.frame_raw_length + can_msg.frame_raw_data + \
-                            (b'\x00' * (8 - can_msg.frame_length))
-                    if ready > 0:
+                    send_msg = _pack_frames(b'ct\x03', self.server.CANList_out)
+                    self.request.sendall(b'c\x02' + struct.pack("!H", len(send_msg) // 16))
+                    if send_msg:
                         self.request.sendall(send_msg)
                         self.server.CANList_out = []
 
@@ -227,26 +228,228 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
                     inc_size = 16 * ready
                     if ready > 0:
                         inc_data = self.request.recv(inc_size)
-                        idx = 0
-                        while ready != 0:
-                            packet = inc_data[idx:idx + 16]
-                            if packet[0:3] != b'ct\x05':
-                                self.server.selfx.error('服务器获取错误协议')
-                                break
-                            else:
-                                fid = struct.unpack("!I", packet[3:7])[0]
-                                flen = packet[7]
-                                fdata = packet[8:16]
-                                while self.server._access_in.is_set():
-                                    time.sleep(0.0001)
-                                self.server._access_in.set()
-                                self.server.CANList_in.append(
-                                    CANMessage.init_data(int(fid), flen, fdata)
-                                )
-                                self.server._access_in.clear()
-
-                            idx += 16
-                            ready -= 1
+                        frames = _unpack_frames(b'ct\x05', inc_data)
+                        if frames is None:
+                            self.server.selfx.error('服务器获取错误协议')
+                        else:
+                            while self.server._access_in.is_set():
+                                time.sleep(0.0001)
+                            self.server._access_in.set()
+                            self.server.CANList_in.extend(frames)
+                            self.server._access_in.clear()
+                        # 通知引擎有新的数据到达
+                        self.server.selfx.notify()
+
+
+def _pack_frames(tag, frames):
+    """
+    将CAN数据帧打包为协议格式，以16字节为一组。经典CAN数据帧占用一组: 3字节标记 + 4字节CANID + 1字节长度 + 8字节数据。
+
+    CAN FD数据帧的标记为'cf'加上`tag`的第3个字节，第一组为3字节标记 + 4字节CANID + 1字节长度 + 1字节标志位 + 7字节数据，
+    其余的数据依次放在之后的组中，不足16字节以0补齐。协议头中的数量是组的数量。
+    """
+    parts = []
+    for can_msg in frames:
+        raw_id = (b'\x00' * (4 - len(can_msg.frame_raw_id))) + can_msg.frame_raw_id
+        if can_msg.frame_flags:
+            data = can_msg.frame_raw_data
+            parts.append(b'cf' + tag[2:3] + raw_id + can_msg.frame_raw_length +
+                         bytes((can_msg.frame_flags,)) + data[:7].ljust(7, b'\x00'))
+            if len(data) > 7:
+                parts.append(data[7:].ljust((len(data) - 7 + 15) // 16 * 16, b'\x00'))
+        else:
+            parts.append(tag + raw_id + can_msg.frame_raw_length + can_msg.frame_raw_data +
+                         (b'\x00' * (8 - can_msg.frame_length)))
+    return b''.join(parts)
+
+
+def _unpack_frames(tag, data):
+    """
+    从协议数据中解出CAN数据帧，遇到错误的标记时返回None。
+    """
+    frames = []
+    fd_tag = b'cf' + tag[2:3]
+    idx = 0
+    while idx < len(data):
+        packet = data[idx:idx + 16]
+        idx += 16
+        if packet[0:3] not in (tag, fd_tag) or len(packet) < 8:
+            return None
+        fid = struct.unpack("!I", packet[3:7])[0]
+        if packet[0:3] == tag:
+            frames.append(CANMessage.init_data(int(fid), packet[7], packet[8:16]))
+        else:
+            length = packet[7]
+            rest = (max(0, length - 7) + 15) // 16 * 16
+            frames.append(CANMessage.init_data(int(fid), length, packet[9:16] + data[idx:idx + rest], packet[8]))
+            idx += rest
+    return frames
+
+
+class AsyncCANQueues:
+
+    """
+    异步引擎中TCP客户端与服务器共用的收发队列。队列只在事件循环线程与命令行线程之间共享，
+    `collections.deque`的追加与弹出本身是线程安全的，不再需要轮询等待的访问标志。
+    """
+
+    def __init__(self, selfx):
+        self.selfx = selfx
+        self.CANList_in = collections.deque()
+        self.CANList_out = collections.deque()
+        self._loop = asyncio.get_running_loop()
+        self._out_ready = asyncio.Event()
+
+    def write_can(self, can_frame):
+        self.CANList_out.append(can_frame)
+        # 命令行线程写入时需要通过事件循环唤醒发送协程
+        self._loop.call_soon_threadsafe(self._out_ready.set)
+
+    def read_can(self):
+        if self.CANList_in:
+            return self.CANList_in.popleft()
+        return None
+
+    def read_can_many(self, limit):
+        msgs = []
+        while self.CANList_in and len(msgs) < limit:
+            msgs.append(self.CANList_in.popleft())
+        return msgs
+
+    def _take_out(self):
+        frames = []
+        while self.CANList_out:
+            frames.append(self.CANList_out.popleft())
+        return frames
+
+    def _put_in(self, frames):
+        self.CANList_in.extend(frames)
+        # 通知引擎有新的数据到达
+        self.selfx.notify()
+
+    def close(self):
+        """在事件循环以外的线程中关闭。"""
+        asyncio.run_coroutine_threadsafe(self.aclose(), self._loop)
+
+
+class AsyncTCPClient(AsyncCANQueues):
+
+    """
+    基于`asyncio`流的TCP2CAN客户端。协议与`CustomTCPClient`相同，由客户端不断向服务器请求数据；
+    当上一次请求没有收到数据并且没有要发送的数据时，最多等待`poll_interval`秒再进行下一次请求。
+    """
+
+    def __init__(self, selfx, poll_interval):
+        super().__init__(selfx)
+        self._poll_interval = poll_interval
+        self._reader = None
+        self._writer = None
+        self._task = None
+
+    async def connect(self, conn):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(*conn), 5.0)
+        self._task = asyncio.ensure_future(self.handle())
+
+    async def handle(self):
+        reader, writer = self._reader, self._writer
+        try:
+            while True:
+                # 发送头协议 c\x01\x00\x00，等待回应
+                writer.write(b'c\x01\x00\x00')
+                await writer.drain()
+                inc_header = await reader.readexactly(4)
+                if inc_header[0:2] != b'c\x02':
+                    self.selfx.error("协议头错误")
+                    continue
+                ready = struct.unpack("!H", inc_header[2:4])[0]
+                if ready > 0:
+                    frames = _unpack_frames(b'ct\x03', await reader.readexactly(16 * ready))
+                    if frames is None:
+                        self.selfx.error('客户端获取错误协议')
+                    else:
+                        self._put_in(frames)
+
+                self._out_ready.clear()
+                frames = self._take_out()
+                if frames:
+                    writer.write(b'c\x04' + struct.pack("!H", len(frames)) +
+                                 _pack_frames(b'ct\x05', frames))
+                    await writer.drain()
+                elif ready == 0:
+                    # 空闲时等待要发送的数据或者下一次轮询
+                    try:
+                        await asyncio.wait_for(self._out_ready.wait(), self._poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.selfx.error('TCPClient: 接收回应错误', e)
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AsyncTCPServer(AsyncCANQueues):
+
+    """
+    基于`asyncio`流的TCP2CAN服务器，协议与`CustomTCPServer`相同，所有连接在同一个事件循环中处理。
+    """
+
+    def __init__(self, selfx, port):
+        super().__init__(selfx)
+        self.prt = port
+        self._server = None
+        self._writers = set()
+
+    async def listen(self, host, port):
+        self._server = await asyncio.start_server(
+            self.handle, host, port, reuse_address=True)
+
+    async def handle(self, reader, writer):
+        self.selfx.info("TCP2CAN 链接到 " + str(self.prt))
+        self._writers.add(writer)
+        try:
+            while True:
+                data = await reader.readexactly(4)
+                if data[0:1] != b'c':
+                    continue
+                if data[1] == 1:
+                    frames = self._take_out()
+                    writer.write(b'c\x02' + struct.pack("!H", len(frames)) +
+                                 _pack_frames(b'ct\x03', frames))
+                    await writer.drain()
+                elif data[1] == 4:
+                    ready = struct.unpack("!H", data[2:4])[0]
+                    if ready > 0:
+                        frames = _unpack_frames(b'ct\x05', await reader.readexactly(16 * ready))
+                        if frames is None:
+                            self.selfx.error('服务器获取错误协议')
+                        else:
+                            self._put_in(frames)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def aclose(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
 
 
 class hw_TCP2CAN(CANModule):
@@ -270,6 +473,11 @@ class hw_TCP2CAN(CANModule):
                 "type": "str",
                 "default": "127.0.0.1"
             },
+            "poll_interval": {
+                "describe": "异步引擎中客户端空闲时两次请求之间最长的间隔(毫秒)。",
+                "type": "int",
+                "default": 1
+            },
         },
         "action_parameters": {
             "action": {
@@ -284,10 +492,15 @@ class hw_TCP2CAN(CANModule):
     version = 1.0
 
     def get_status(self):
+        if isinstance(self._server, AsyncCANQueues):
+            busy_in = busy_out = False      # 异步队列没有访问标志
+        else:
+            busy_in = self._server._access_in.is_set()
+            busy_out = self._server._access_out.is_set()
         status = "接收: " + str(len(self._server.CANList_in)) + \
-            "是否可接收: " + str(self._server._access_in.is_set()) + "\n" + \
+            "是否可接收: " + str(busy_in) + "\n" + \
             " 发送: " + str(len(self._server.CANList_out)) + \
-            "是否可发送:" + str(self._server._access_out.is_set()) + "\n"
+            "是否可发送:" + str(busy_out) + "\n"
         return CmdResult(cmdline='status', describe="当前状态", result_type=CMDRES_STR, result=status)
 
     def do_start(self, params):
@@ -318,12 +531,33 @@ class hw_TCP2CAN(CANModule):
             # 一系列的关闭流程
             #
             self._server.close()
-            if self._mode == 'server':
+            if isinstance(self._server, CustomTCPServer):
                 self._server.server_close()
                 self._server.shutdown()
                 self._thread._stop()
             self._server = None
 
+    async def do_start_async(self, params):
+        if isinstance(self._server, AsyncCANQueues):
+            return
+        self.do_stop(params)
+        self.info('异步启动 : ' + str(self._mode))
+        if self._mode == 'server':
+            server = AsyncTCPServer(self, self._PORT)
+            await server.listen(self._HOST, self._PORT)
+        else:
+            server = AsyncTCPClient(self, self._poll_interval)
+            await server.connect((self._HOST, self._PORT))
+        self._server = server
+
+    async def do_stop_async(self, params):
+        if isinstance(self._server, AsyncCANQueues):
+            self.info('停止 : ' + str(self._mode))
+            await self._server.aclose()
+            self._server = None
+        else:
+            self.do_stop(params)
+
     def do_init(self, params):
 
         self.describe = hw_TCP2CAN.help.get('describe', hw_TCP2CAN.name)
@@ -339,19 +573,24 @@ class hw_TCP2CAN(CANModule):
 
         self._HOST = params.get('address', '127.0.0.1')
         self._PORT = int(params.get('port', 19780))
+        self._poll_interval = int(params.get('poll_interval', 1)) / 1000.0
         self._bus = self._mode + ":" + self._HOST + ":" + str(self._PORT)
 
         self.commands['write'] = Command(
             "直接发送CAN数据帧, 类似如下字符串形式: 13:8:1122334455667788", 1, " <数据帧字符串> ", self.dev_write, True)
-        self.do_start(params)
+        # 异步引擎中在do_start_async里启动基于asyncio流的实现
+        if not params.get('async_engine', False):
+            self.do_start(params)
         return 0
 
     def dev_write(self, line):
         fid = line.split(":")[0]
         length = line.split(":")[1]
         data = line.split(":")[2]
+        # CAN FD数据帧可以在最后加上16进制的标志位，与转储文件的格式相同
+        flags = int(line.split(":")[3], 16) if line.count(":") > 2 else 0
         can_msg = CANMessage.init_data(int(fid, 0), int(
-            length), bytes.fromhex(data)[:int(length)])
+            length), bytes.fromhex(data)[:int(length)], flags)
         self._server.write_can(can_msg)
         return CmdResult(cmdline='write ' + line, describe="网络发送", result_type=CMDRES_STR, result=can_msg.get_text())
 
@@ -365,6 +604,27 @@ class hw_TCP2CAN(CANModule):
             self.fatal_error('命令 ' + action + ' 未实现')
         return can_msg
 
+    def do_effect_batch(self, batch, args):
+        if args.get('action', 'read') == 'read':
+            for can_frame in self._server.read_can_many(self._batch_size):
+                can_msg = CANSploitMessage()
+                can_msg.CANData = True
+                can_msg.CANFrame = can_frame
+                can_msg.bus = self._bus
+                batch.append(can_msg)
+        elif args.get('action', 'read') == 'write':
+            for can_msg in batch:
+                self.do_write(can_msg)
+        else:
+            action = str(args.get('action', 'None'))
+            self.fatal_error('命令 ' + action + ' 未实现')
+        return batch
+
+    def next_due(self, args):
+        if args.get('action', 'read') == 'read' and self._server is not None and len(self._server.CANList_in) > 0:
+            return 0
+        return None
+
     def do_write(self, can_msg):
         if can_msg.CANData:
             self._server.write_can(can_msg.CANFrame)
@@ -8,11 +8,17 @@ import socket
 import usb1
 import os
 import time
+import asyncio
+import threading
 import traceback
+import collections
 
-from frame.message.can import CANMessage, CANSploitMessage
+from concurrent.futures import ThreadPoolExecutor
+
+from frame.message.can import CANMessage, CANSploitMessage, FD_FDF
 from frame.kernel.module import CANModule, Command
 from frame.stream.cmdres import CmdResult, CMDRES_STR
+from modules.io.edeck.python import pack_can_buffer, unpack_can_buffer
 
 SAFETY_NOOUTPUT = 19
 SAFETY_ALLOUTPUT = 17
@@ -51,6 +57,16 @@ class hw_edeck(CANModule):
                 "describe": "设备波特率。",
                 "type": "int",
                 "default": 500
+            },
+            "fd": {
+                "describe": "是否使用CAN FD，需要支持CAN FD的设备，USB数据使用变长的CAN数据包格式。",
+                "type": "bool",
+                "default": False
+            },
+            "data_speed": {
+                "describe": "CAN FD数据段的波特率。",
+                "type": "int",
+                "default": 2000
             }
         },
         "action_parameters": {
@@ -70,35 +86,140 @@ class hw_edeck(CANModule):
         self.commands['write'] = Command(
             "直接发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000", 1, "<数据帧字符串>", self.dev_write, True)
         self.commands['write2'] = Command(
-            "按照给定次数发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,50,0.05", 1, "<数据帧字符串>", self.write_on_count, True)
+            "按照给定次数发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,50,0.05", 1, "<数据帧字符串>", self.write_on_count, True, blocking=True)
         self.commands['write3'] = Command(
-            "按照给定时间发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,60,0.03", 1, "<数据帧字符串>", self.write_on_time, True)
+            "按照给定时间发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,60,0.03", 1, "<数据帧字符串>", self.write_on_time, True, blocking=True)
 
         self._serial = params.get('serial', None)
         self._claim = params.get('claim', True)
         self._wait = params.get('wait', False)
         self._bus_num = params.get('bus_num', 0)
         self._bus_speed = params.get('bus_speed', 500)
+        self._fd = bool(params.get('fd', False))
+        self._data_speed = params.get('data_speed', 2000)
         self._handle = None
         self._run = False
 
+        #
+        # 事件驱动模式下使用后台线程读取USB数据
+        #
+        self._rx_thread = None
+        self._rx_queue = collections.deque()
+        self._rx_queued = False
+        self._poll_timeout = int(params.get('poll_timeout', 100))
+
+        #
+        # 异步引擎中USB的读写在线程池中执行
+        #
+        self._rx_task = None
+        self._rx_executor = None
+        self._tx_executor = None
+
         return 0
 
+    def _open_device(self):
+        self.connect(self._claim, self._wait)
+        self.set_can_speed_kbps(self._bus_num, self._bus_speed)
+        if self._fd:
+            self.set_can_data_speed_kbps(self._bus_num, self._data_speed)
+        self.set_safety_mode(SAFETY_ALLOUTPUT)
+        self._run = True
+
     def do_start(self, params):
         if self._handle is None and not self._run:
-            self.connect(self._claim, self._wait)
-            self.set_can_speed_kbps(self._bus_num, self._bus_speed)
-            self.set_safety_mode(SAFETY_ALLOUTPUT)
-            self._run = True
+            self._open_device()
+            #
+            # USB设备无法被select监听，事件驱动模式下启动读取线程，
+            # 读取到数据后通知引擎
+            #
+            if self._waker is not None:
+                self._rx_queue.clear()
+                self._rx_queued = True
+                self._rx_thread = threading.Thread(target=self._rx_loop)
+                self._rx_thread.daemon = True
+                self._rx_thread.start()
 
     def do_stop(self, params):
         if self._handle and self._run:
             try:
+                self._run = False
+                if self._rx_thread is not None:
+                    self._rx_thread.join()
+                    self._rx_thread = None
+                self._rx_queued = False
                 self.close()
+            except Exception as e:
                 self._run = False
+                self.error("停止失败: ", e)
+
+    async def do_start_async(self, params):
+        if self._handle is None and not self._run:
+            loop = asyncio.get_running_loop()
+            #
+            # 读与写各使用一个线程，读取等待超时的时候不会阻塞写入，写入的顺序保持不变
+            #
+            self._rx_executor = ThreadPoolExecutor(max_workers=1)
+            self._tx_executor = ThreadPoolExecutor(max_workers=1)
+            await loop.run_in_executor(self._tx_executor, self._open_device)
+            self._rx_queue.clear()
+            self._rx_queued = True
+            self._rx_task = loop.create_task(self._rx_loop_async())
+
+    async def do_stop_async(self, params):
+        if self._handle and self._run:
+            loop = asyncio.get_running_loop()
+            try:
+                self._run = False
+                if self._rx_task is not None:
+                    await self._rx_task
+                    self._rx_task = None
+                self._rx_queued = False
+                await loop.run_in_executor(self._tx_executor, self.close)
             except Exception as e:
                 self._run = False
                 self.error("停止失败: ", e)
+            self._rx_executor.shutdown()
+            self._tx_executor.shutdown()
+            self._rx_executor = self._tx_executor = None
+
+    def _read_frames(self):
+        """
+        以`poll_timeout`毫秒为超时读取设备，保证停止时可以及时退出。
+        """
+        try:
+            dat = self._handle.bulkRead(1, 0x10, timeout=self._poll_timeout)
+        except usb1.USBErrorTimeout:
+            return []
+        except (usb1.USBErrorIO, usb1.USBErrorOverflow):
+            self.error("CAN: 接收失败，重新尝试...")
+            return []
+        return self.parse_can_buffer(dat)
+
+    def _rx_loop(self):
+        """
+        事件驱动模式下的读取线程。
+        """
+        while self._run:
+            frames = self._read_frames()
+            if frames:
+                self._rx_queue.extend(frames)
+                self.notify()
+
+    async def _rx_loop_async(self):
+        """
+        异步引擎中的读取任务，在线程池中读取设备。
+        """
+        loop = asyncio.get_running_loop()
+        while self._run:
+            frames = await loop.run_in_executor(self._rx_executor, self._read_frames)
+            if frames:
+                self._rx_queue.extend(frames)
+                self.notify()
+
+    def next_due(self, args):
+        if args.get('action') == 'read' and len(self._rx_queue) > 0:
+            return 0
+        return None
 
     def write_on_count(self, line):
         loop = 10
@@ -165,11 +286,13 @@ class hw_edeck(CANModule):
                 idf = line.split(":")[0]
                 lenf = line.split(":")[1]
                 dataf = line.split(":")[2]
+                # CAN FD数据帧可以在最后加上16进制的标志位，与转储文件的格式相同
+                flags = int(line.split(":")[3], 16) if line.count(":") > 2 else 0
                 message = CANSploitMessage()
                 message.CANData = True
                 dataf = bytes.fromhex(dataf)
                 can_msg = CANMessage.init_data(
-                    int(idf, 0), int(lenf, 0), dataf)
+                    int(idf, 0), int(lenf, 0), dataf, flags)
                 message.CANFrame = can_msg
                 self.do_write(message)
                 ret = CmdResult(cmdline='write ' + line, describe="Edeck设备写入数据",
@@ -186,7 +309,7 @@ class hw_edeck(CANModule):
     def do_write(self, can_msg):
         if can_msg.CANData:
             idf = can_msg.CANFrame.frame_id
-            self.info("写入 : CANID : {}".format(idf))
+            self.trace("写入 : CANID : {}", idf)
             if can_msg.CANFrame.frame_ext:
                 idf |= 0x80000000
             dataf = bytearray(can_msg.CANFrame.frame_data)
@@ -194,21 +317,74 @@ class hw_edeck(CANModule):
             self.set_safety_mode(SAFETY_ALLOUTPUT)
             self.can_send(idf, dataf, self._bus_num)
             self.set_safety_mode(SAFETY_NOOUTPUT)
-            self.info("数据 : {}, 长度 : {}".format(self.get_hex(dataf), lenf))
+            if self.trace_enabled:
+                self.trace("数据 : {}, 长度 : {}", bytes(dataf), lenf)
         return can_msg
 
     def do_read(self, can_msg):
         if self._run and not can_msg.CANData:
-            can_recv = self.can_recv()
+            if self._rx_queued:
+                can_recv = [self._rx_queue.popleft()] if self._rx_queue else []
+            else:
+                can_recv = self.can_recv()
             for address, _, dat, src in can_recv:
                 idf = address
                 if idf & 0x80000000:
                     idf &= 0x7FFFFFFF
-                can_msg.CANFrame = CANMessage.init_data(idf, len(dat), dat)
+                # CAN FD模式下0到8字节的数据帧同样是CAN FD数据帧
+                can_msg.CANFrame = CANMessage.init_data(idf, len(dat), dat, FD_FDF if self._fd else 0)
                 can_msg.CANData = True
-                self.info("读取数据 : " + str(self.get_hex(dat)))
+                if self.trace_enabled:
+                    self.trace("读取数据 : {}", bytes(dat))
         return can_msg
 
+    def do_effect_batch(self, batch, args):
+        if args.get('action') == 'read':
+            if self._run:
+                if self._rx_queued:
+                    can_recv = []
+                    while self._rx_queue and len(can_recv) < self._batch_size:
+                        can_recv.append(self._rx_queue.popleft())
+                else:
+                    # 一次USB读取可能包含多个数据帧，全部放入管道
+                    can_recv = self.can_recv()
+                for address, _, dat, src in can_recv:
+                    if address & 0x80000000:
+                        address &= 0x7FFFFFFF
+                    can_msg = CANSploitMessage()
+                    can_msg.CANFrame = CANMessage.init_data(
+                        address, len(dat), dat, FD_FDF if self._fd else 0)
+                    can_msg.CANData = True
+                    batch.append(can_msg)
+        elif args.get('action') == 'write':
+            # 将批量中的所有数据帧合并为一次USB写入
+            arr = []
+            for can_msg in batch:
+                if can_msg.CANData:
+                    arr.append([can_msg.CANFrame.frame_id, None,
+                                bytes(can_msg.CANFrame.frame_data), self._bus_num])
+            if arr:
+                self.set_safety_mode(SAFETY_ALLOUTPUT)
+                self.can_send_many(arr)
+                self.set_safety_mode(SAFETY_NOOUTPUT)
+        else:
+            self.fatal_error('命令 ' + args['action'] + ' 没有实现')
+        return batch
+
+    async def do_effect_async(self, can_msg, args):
+        if args.get('action') == 'write' and self._tx_executor is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._tx_executor, self.do_write, can_msg)
+            return can_msg
+        return self.do_effect(can_msg, args)
+
+    async def do_effect_batch_async(self, batch, args):
+        if args.get('action') == 'write' and self._tx_executor is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._tx_executor, self.do_effect_batch, batch, args)
+            return batch
+        return self.do_effect_batch(batch, args)
+
     def do_effect(self, can_msg, args):
         if args.get('action') == 'read':
             can_msg = self.do_read(can_msg)
@@ -286,7 +462,23 @@ class hw_edeck(CANModule):
         except Exception as e:
             self.fatal_error("设置速率失败", e)
 
+    def set_can_data_speed_kbps(self, bus, speed):
+        try:
+            self._handle.controlWrite(
+                REQUEST_OUT, 0xf9, bus, int(speed*10), b'')
+        except Exception as e:
+            self.fatal_error("设置数据段速率失败", e)
+
     def can_send_many(self, arr):
+        if self._fd:
+            # CAN FD使用变长的CAN数据包，数据长度由数据长度码决定，是否扩展帧由消息ID的范围决定
+            snds = pack_can_buffer([[addr & 0x1FFFFFFF, None, bytes(dat), bus] for addr, _, dat, bus in arr])
+            try:
+                for tx in snds:
+                    self._handle.bulkWrite(3, tx)
+            except (usb1.USBErrorIO, usb1.USBErrorOverflow):
+                self.error("CAN: 发送失败，重新尝试...")
+            return
         snds = []
         transmit = 1
         extended = 4
@@ -312,6 +504,8 @@ class hw_edeck(CANModule):
         dat = bytearray()
         while True:
             try:
+                if self._fd:
+                    return unpack_can_buffer(self._handle.bulkRead(1, 16384))
                 dat = self._handle.bulkRead(1, 0x10)
                 break
             except (usb1.USBErrorIO, usb1.USBErrorOverflow):
@@ -1,8 +1,7 @@
-import time
-import copy
-
-from frame.message.can import CANMessage
+from frame.kernel import clock
+from frame.message.can import CANMessage, CANSploitMessage
 from frame.kernel.module import CANModule, Command
+from frame.kernel.pacer import TokenBucket
 from frame.stream.cmdres import CmdResult, CMDRES_INT, CMDRES_STR
 
 
@@ -17,6 +16,18 @@ class hw_fakeIO(CANModule):
                 "type": "str",
                 "default": "read",
                 "range": ["read", "write"]
+            },
+            "pace": {
+                "describe": "'write'动作发送数据使用的总线令牌桶名称，由引擎参数'pacer'配置。",
+                "type": "str",
+                "default": None,
+                "range": []
+            },
+            "delay": {
+                "describe": "'write'动作发送数据的间隔(秒)，指定了pace时忽略。",
+                "type": "float",
+                "default": 0,
+                "range": []
             }
         }
     }
@@ -27,9 +38,9 @@ class hw_fakeIO(CANModule):
         self.commands['write'] = Command(
             "直接发送CAN数据帧, 类似如下字符串形式: 13:8:1122334455667788", 1, " <数据帧字符串> ", self.dev_write, True)
         self.commands['write2'] = Command(
-            "按照给定次数发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,50,0.05", 1, "<数据帧字符串>", self.write_on_count, True)
+            "按照给定次数发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,50,0.05", 1, "<数据帧字符串>", self.write_on_count, True, blocking=True)
         self.commands['write3'] = Command(
-            "按照给定时间发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,60,0.03", 1, "<数据帧字符串>", self.write_on_time, True)
+            "按照给定时间发送CAN数据帧, 类似如下字符串形式: 304:8:07df300101000000,60,0.03", 1, "<数据帧字符串>", self.write_on_time, True, blocking=True)
         self.CANList = []
         return 0
 
@@ -45,9 +56,12 @@ class hw_fakeIO(CANModule):
         fid = line.split(":")[0]
         length = line.split(":")[1]
         data = line.split(":")[2]
+        # CAN FD数据帧可以在最后加上16进制的标志位，与转储文件的格式相同
+        flags = int(line.split(":")[3], 16) if line.count(":") > 2 else 0
         can_msg = CANMessage.init_data(int(fid, 0), int(
-            length, 0), bytes.fromhex(data)[:int(length, 0)])
+            length, 0), bytes.fromhex(data)[:int(length, 0)], flags)
         self.CANList.append(can_msg)
+        self.notify()
         return CmdResult(cmdline='write ' + line, describe="CAN列表添加", result_type=CMDRES_STR, result=can_msg.get_text())
 
     def write_on_count(self, line):
@@ -66,15 +80,17 @@ class hw_fakeIO(CANModule):
             loop = int(params[1], 0)
             delay = float(params[2])
 
-        first_time = time.perf_counter()
-        last_time = 0.0
+        # 按照令牌桶休眠等待，而不是空转查询时间
+        bucket = TokenBucket(1.0 / delay) if delay > 0 else None
+        first_time = clock.now()
+        last_time = first_time
         while loop > 0:
-            curr_time = int(time.perf_counter())
-            if curr_time - last_time >= delay:
-                last_time = time.perf_counter()
-                ret = self.dev_write(canmsg)
-                self.info(ret.result)
-                loop -= 1
+            if bucket is not None:
+                bucket.wait()
+            last_time = clock.now()
+            ret = self.dev_write(canmsg)
+            self.info(ret.result)
+            loop -= 1
         total_time = str(last_time - first_time)
         return CmdResult(cmdline='write2 ' + line, describe="发送总时间", result_type=CMDRES_STR, result=total_time)
 
@@ -94,29 +110,52 @@ class hw_fakeIO(CANModule):
             total_sec = float(params[1])
             delay = float(params[2])
 
-        begin_time = time.perf_counter()
-        end_time = begin_time
-        last_time = 0.0
+        bucket = TokenBucket(1.0 / delay) if delay > 0 else None
+        end_time = clock.now() + total_sec
         count = 0
-        while end_time - begin_time < total_sec:
-            curr_time = time.perf_counter()
-            if curr_time - last_time >= delay:
-                last_time = time.perf_counter()
-                ret = self.dev_write(canmsg)
-                self.info(ret.result)
-                count += 1
-            end_time = time.perf_counter()
+        while True:
+            if bucket is not None:
+                if bucket.next_due() >= end_time:
+                    break
+                bucket.wait()
+            if clock.now() >= end_time:
+                break
+            ret = self.dev_write(canmsg)
+            self.info(ret.result)
+            count += 1
         return CmdResult(cmdline='write3 ' + line, describe="发送总计数", result_type=CMDRES_INT, result=count)
 
     def do_effect(self, can_msg, args):
         if args.get('action') == 'read':
             can_msg = self.do_read(can_msg)
         elif args.get('action') == 'write':
-            can_msg = self.do_write(can_msg)
+            if self.tx_ready(args):
+                can_msg = self.do_write(can_msg)
+                if can_msg.CANData:
+                    self.tx_sent(args, can_msg.CANFrame)
         else:
             self.fatal_error('命令 ' + args['action'] + ' 没有实现')
         return can_msg
 
+    def do_effect_batch(self, batch, args):
+        if args.get('action') == 'read':
+            for can_msg in batch:
+                self.do_read(can_msg)
+        elif args.get('action') == 'write':
+            for _ in range(min(len(self.CANList), self._batch_size)):
+                if not self.tx_ready(args):
+                    break
+                batch.append(self.do_write(CANSploitMessage()))
+                self.tx_sent(args, batch[-1].CANFrame)
+        else:
+            self.fatal_error('命令 ' + args['action'] + ' 没有实现')
+        return batch
+
+    def next_due(self, args):
+        if args.get('action') == 'write' and len(self.CANList) > 0:
+            return self.tx_due(args)
+        return None
+
     def do_write(self, can_msg):
         if len(self.CANList) > 0:
             can_msg.CANData = True
@@ -126,5 +165,5 @@ class hw_fakeIO(CANModule):
 
     def do_read(self, can_msg):
         if can_msg.CANData:
-            self.CANList.append(copy.deepcopy(can_msg.CANFrame))
+            self.CANList.append(can_msg.CANFrame)
         return can_msg
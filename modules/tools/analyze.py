@@ -2,15 +2,15 @@
 import re
 import ast
 import time
-import copy
 import threading
-import bitstring
 import collections
 
+from frame.kernel import clock
 from frame.kernel.module import CANModule, Command
 from frame.message.can import CANMessage
 from frame.message.uds import UDSMessage
 from frame.message.isotp import ISOTPMessage
+from frame.utils import bits
 from frame.utils.frag import FragmentedCAN
 from frame.utils.replay import Replay
 from frame.utils.correl import SeparatedMessage
@@ -138,11 +138,11 @@ class analyze(CANModule):
         # 统计自动分析
         #
         self.commands['statistic'] = Command(
-            "堆栈检查: 在当前流量中进行分析 (统计)", 1, "[缓冲区索引]", self.train, True)
+            "堆栈检查: 在当前流量中进行分析 (统计)", 1, "[缓冲区索引]", self.train, True, blocking=True)
         self.commands['hypothesis'] = Command(
             "堆栈检查: 在当前流量中通过已经学习到的知识，来寻找差异包 (统计)", 1, "[缓冲区索引]", self.find_ab, True)
         self.commands['test'] = Command(
-            "堆栈检查: 在当前流量中找寻动作 (统计)", 0, "", self.act_detect, False)
+            "堆栈检查: 在当前流量中找寻动作 (统计)", 0, "", self.act_detect, False, blocking=True)
         self.commands['dumps'] = Command(
             "堆栈检查: 在当前流量中探索异常包并保存到回访文件 (统计)", 1, "<文件名>", self.dump_ab, False)
         #
@@ -167,7 +167,7 @@ class analyze(CANModule):
         self.commands['save3'] = Command(
             "保存缓冲区全部内容到CSV文件 (如果索引为空则保存所有)", 1, " <文件名>, [缓冲区索引]", self.do_dump_csv2, True)
         self.commands['delay'] = Command(
-            "获取'ping/fuzz'的延迟值", 1, "<总线速率(KB/s)>", self.get_delay, True)
+            "获取'ping/fuzz'的延迟值", 1, "<总线速率(KB/s)>", self.get_delay, True, blocking=True)
 
     def do_activate(self, mode=-1):
         """
@@ -192,7 +192,8 @@ class analyze(CANModule):
         status = "当前状态: " + "\n统计自动分析运行状态:" + str(self._active_check) + "\n缓存的所有CAN数据帧: " + str(self.get_num(-1)) + "\n当前缓存: 索引 - " + str(self._index) + " 名称 - " + self.all_frames[self._index]['name'] + \
             "\n所有的缓冲区: \n\t" + \
             '\n\t'.join([buf['name'] + "\n\t\t索引: " + str(cnt) + ' 当前缓存计数: ' + str(len(buf['buf']))
-                        for buf, cnt in zip(self.all_frames, range(0, len(self.all_frames)))])
+                        for buf, cnt in zip(self.all_frames, range(0, len(self.all_frames)))]) + \
+            "\n数据帧驻留: {size} 个数据帧, 命中率 {hit_rate:.1%}".format(**self.all_frames[0]['buf'].intern_stats())
         return CmdResult(cmdline='status', describe="当前状态", result_type=CMDRES_STR, result=status)
 
     def get_delay(self, speed):
@@ -798,7 +799,7 @@ class analyze(CANModule):
 
             for times, msg in temp_buf._stream:
                 if not msg.debugData and msg.CANData:
-                    data = msg.CANFrame.frame_data[:msg.CANFrame.frame_length] + (
+                    data = list(msg.CANFrame.frame_data[:msg.CANFrame.frame_length]) + (
                         [0] * (8 - msg.CANFrame.frame_length))
 
                     data_ascii = self.escape_csv(self.ret_ascii(
@@ -1069,12 +1070,25 @@ class analyze(CANModule):
         self.commands['dumps'].is_enabled = False
         return CmdResult(cmdline='clean', describe="清空所有缓存区")
 
-    def do_effect(self, can_msg, args):
+    def _update_status(self):
         if self._need_status and not self._action.is_set():
             self._action.set()
             self._status = self._last / (self._full / 100.0)
             self._action.clear()
 
+    def do_effect_batch(self, batch, args):
+        if args.get('action', 'read') != 'read':
+            return super().do_effect_batch(batch, args)
+        self._update_status()
+        buf = self.all_frames[self._index]['buf']
+        for can_msg in batch:
+            if can_msg.CANData or can_msg.debugData:
+                buf.append(can_msg)
+        return batch
+
+    def do_effect(self, can_msg, args):
+        self._update_status()
+
         # 这里判断当前数据为CAN或者是调试数据，并且没有不读标记添加添加包
         if (can_msg.CANData or can_msg.debugData) and args.get('action', 'read') == 'read':
             self.all_frames[self._index]['buf'].append(can_msg)
@@ -1084,18 +1098,23 @@ class analyze(CANModule):
             self._action.set()
             if self._stat_resend:
                 can_msg.CANData = True
-                can_msg.CANFrame = copy.deepcopy(self._stat_resend)
+                can_msg.CANFrame = self._stat_resend
                 can_msg.bus = self._bus
                 self._stat_resend = None
             self._action.clear()
 
         return can_msg
 
+    def next_due(self, args):
+        # 有需要重发的数据帧时需要立即运行
+        if args.get('action', 'read') == 'write' and self._stat_resend:
+            return 0
+        return None
+
     def get_data_in_format(self, data, idx_1, idx_2, format):
-        selected_value_hex = bitstring.BitArray(
-            '0b' + ('0' * ((4 - ((idx_2 - idx_1) % 4)) % 4)) + bitstring.BitArray(data)[idx_1:idx_2].bin)
-        selected_value_bin = bitstring.BitArray(
-            '0b' + bitstring.BitArray(data)[idx_1:idx_2].bin)
+        selected_value_bin = bits.Bits.from_bytes(data)[idx_1:idx_2]
+        # 16进制与整数形式在前面补0到4位的倍数
+        selected_value_hex = bits.Bits(selected_value_bin.uint, (len(selected_value_bin) + 3) // 4 * 4)
         if format.strip() in ["bin", "b", "binary"]:
             return selected_value_bin.bin
         elif format.strip() in ["hex", "h"]:
@@ -1223,49 +1242,52 @@ class analyze(CANModule):
         else:
             temp_buf = self.all_frames[_index]['buf']
 
-        messages = collections.OrderedDict()
-
-        # 遍历缓冲区
-        for timestmp, can_msg in temp_buf:
-            if can_msg.CANData:
-                #
-                # CANID没有遇到过则建立(id, lenght) : message 这样的索引
-                # 这条if是创建新的字典项目
-                #
-                if (can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length) not in messages:
-                    messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)] = [
-                        [can_msg.CANFrame.frame_raw_data], 0, 1]
-                else:
-                    #
-                    # 如果CANID之前遇到过，则追加在此CANID,length为键的数据
-                    #
-                    messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)][0].append(
-                        can_msg.CANFrame.frame_raw_data)
-                    #
-                    # 这里对比当前新添加的与上一个包是否相同，如果不相同则增加改变次数
-                    #
-                    if messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)][0][-1] != messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)][0][-2]:
-                        messages[(can_msg.CANFrame.frame_id,
-                                  can_msg.CANFrame.frame_length)][1] += 1
-                    #
-                    # 这里对比当前新添加的包在之前所有包中都没出现则唯一包计数添加1
-                    #
-                    if messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)][0][-1] not in messages[(can_msg.CANFrame.frame_id, can_msg.CANFrame.frame_length)][0][:-1]:
-                        messages[(can_msg.CANFrame.frame_id,
-                                  can_msg.CANFrame.frame_length)][2] += 1
+        # 按照(消息ID, 数据长度)统计：数据帧数量、与上一个包不同的次数、唯一数据包的个数
+        messages = self.count_changes(temp_buf.to_batch())
 
         #table += "Detected changes (two values):\n\n"
         table += "检查改变 (双值):\n\n"
-        for (fid, flen), data in messages.items():
-            msgs = len(data[0])     # 数据
-            chgs = data[1]          # 发生改变的次数
-            uniq = data[2]          # 有多少个没有发生改变的包(唯一的包)
+        for (fid, flen), (msgs, chgs, uniq) in messages.items():
             if uniq > 1 and msgs > 3 and uniq <= depth:
                 #table += "\t " + hex(fid) + " count of uniq. values: " + str(uniq) + " values/uniq.: " + str(round(float(msgs / uniq), 2)) + " changes/uniq.: " + (str(round(float(chgs / uniq), 2))) + "\n"
                 table += "\t " + hex(fid) + " 唯一数据包个数: " + str(uniq) + \
                     " 总数据个数: " + str(msgs) + " 改变的次数: " + str(chgs) + "\n"
         return CmdResult(cmdline='change ' + str(_index), describe="数据改变", result_type=CMDRES_STR, result=table)
 
+    @staticmethod
+    def count_changes(batch):
+        """
+        按照(消息ID, 数据长度)对数据帧批次做向量化的统计，代替逐帧比较所有之前的数据。
+
+        :param FrameBatch batch: 数据帧批次。
+
+        :return: (消息ID, 数据长度)到(数据帧数量, 与上一个包不同的次数, 唯一数据包的个数)的有序字典，按照第一次出现的顺序排列。
+        :rtype: collections.OrderedDict
+        """
+        import numpy
+        table = collections.OrderedDict()
+        if not len(batch):
+            return table
+        array = batch.array
+        # 数据长度最大为64，占用低7位
+        keys = (array['id'].astype(numpy.int64) << 7) | array['dlc']
+        order = numpy.argsort(keys, kind='stable')
+        keys = keys[order]
+        # 长度之外的字节都是0，同一个键下比较整行等价于比较数据
+        data = numpy.ascontiguousarray(array['data'][order])
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+        counts = numpy.diff(numpy.r_[starts, len(keys)])
+        changed = numpy.r_[False, (data[1:] != data[:-1]).any(axis=1) & (keys[1:] == keys[:-1])]
+        changes = numpy.add.reduceat(changed.astype(numpy.int64), starts)
+        codes = numpy.unique(data, axis=0, return_inverse=True)[1].ravel()
+        pairs = numpy.unique(numpy.stack([keys, codes], axis=1), axis=0)
+        uniques = numpy.unique(pairs[:, 0], return_counts=True)[1]
+        # 排序是稳定的，每组的第一个元素就是这个键第一次出现的位置
+        for group in numpy.argsort(order[starts], kind='stable').tolist():
+            key = int(keys[starts[group]])
+            table[(key >> 7, key & 0x7F)] = (int(counts[group]), int(changes[group]), int(uniques[group]))
+        return table
+
     def show_detect(self, args='-1'):
         """在指定的缓冲区中找寻指定的CANID与CAN数据并以此包作为分界线
         对比了前后数据的差异。
@@ -1409,13 +1431,13 @@ class analyze(CANModule):
                 if can_msg.CANFrame.frame_id not in self.data_set[_index]:
                     self.data_set[_index][can_msg.CANFrame.frame_id] = {
                         # 此ID对应的所有数据包
-                        'values_array': [can_msg.CANFrame.get_bits()],
+                        'values_array': [can_msg.CANFrame.frame_bits],
                         # 在此ID上发生包交换的次数
                         'count': 1,
                         # 在此ID上数据包发生改变的次数
                         'changes': 0,
                         # 在此ID上最后一个CAN包内容
-                        'last': can_msg.CANFrame.get_bits(),
+                        'last': can_msg.CANFrame.frame_bits,
                         # 最后一次数据包内容改变的时间
                         'ch_last_time': round(timestmp, 4),
                         # 数据包改变发生的一个时间区间
@@ -1425,11 +1447,11 @@ class analyze(CANModule):
                         'last_time': round(timestmp, 4),
                         'min_time': 0,
                         'max_time': 0,
-                        'change_bits': bitstring.BitArray('0b' + ('0' * 64), length=64)}    # 发生改变的位
+                        'change_bits': 0}    # 发生改变的位，整数形式，参见CANMessage.frame_bits
                 else:
                     # 如果当前CAN包的ID在数据字典里，则增加引用
                     self.data_set[_index][can_msg.CANFrame.frame_id]['count'] += 1
-                    new_arr = can_msg.CANFrame.get_bits()
+                    new_arr = can_msg.CANFrame.frame_bits
                     # 如果新包的内容与最后一个当前ID的包不一样
                     if new_arr != self.data_set[_index][can_msg.CANFrame.frame_id]['last']:
                         # 增加改变数量
@@ -1484,7 +1506,7 @@ class analyze(CANModule):
                     self._last += 1
                     self._action.clear()
 
-        time.sleep(1)
+        clock.sleep(1)
         if not self._action.is_set():
             self._action.set()
             self._need_status = False
@@ -1532,13 +1554,13 @@ class analyze(CANModule):
                     self.data_set[_index][can_msg.CANFrame.frame_id] = {
                         'count': 1,                                                 # 当前ID被发生包交换的次数
                         'changes': 0,                                               # CAN包发生改变的次数
-                        'last': can_msg.CANFrame.get_bits(),                        # 最后一个CAN包的内容
+                        'last': can_msg.CANFrame.frame_bits,                        # 最后一个CAN包的内容
                         # 最后一次接收的时间
                         'last_time': round(timestmp, 4),
                         # 最后一次发生改变的时间
                         'ch_last_time': round(timestmp, 4),
                         # 变换包的不同
-                        'diff': bitstring.BitArray('0b' + '0' * 64, length=64),
+                        'diff': 0,
                         'history': [],
                         'curr_comm': 0,
                         'comm': []
@@ -1548,7 +1570,7 @@ class analyze(CANModule):
                     # 这里如果此CANID在数据字典中出现
                     #
                     self.data_set[_index][can_msg.CANFrame.frame_id]['count'] += 1
-                    new_arr = can_msg.CANFrame.get_bits()
+                    new_arr = can_msg.CANFrame.frame_bits
 
                     # 对数据字典新建设一些值
                     chg = self.data_set[_index][can_msg.CANFrame.frame_id].get(
@@ -1571,8 +1593,7 @@ class analyze(CANModule):
                         # 读取上一次改变的位数
                         orig = self.data_set[self._train_buffer].get(
                             can_msg.CANFrame.frame_id, {})
-                        orig_bits = orig.get('change_bits', bitstring.BitArray(
-                            '0b' + '0' * 64, length=64))
+                        orig_bits = orig.get('change_bits', 0)
 
                         # 判断上次改变的位置与这次改变的位置不一致
                         if (diff | orig_bits) != orig_bits:
@@ -1581,8 +1602,8 @@ class analyze(CANModule):
                             if not chg and not schg and not nchg:
                                 # 标记变化位置不同，是一个新的位置改变
                                 self.data_set[_index][can_msg.CANFrame.frame_id]['changed_same'] = False
-                                ev = " 第一次改变 (新的位置变化), 上一条数据: " + str(
-                                    self.data_set[_index][can_msg.CANFrame.frame_id]['last'].hex)
+                                ev = " 第一次改变 (新的位置变化), 上一条数据: " + bits.to_hex(
+                                    self.data_set[_index][can_msg.CANFrame.frame_id]['last'])
 
                                 # 相关因子变化大于0
                                 if len(correlator_changes) > 0:
@@ -1597,12 +1618,12 @@ class analyze(CANModule):
                                     self.history = list(
                                         set(self.history).union(correlator_changes))
                                     # 添加注释,发生第一次改变
-                                    self.data_set[_index][can_msg.CANFrame.frame_id]['comm'].append(" 第一次改变, 上一条数据: " + str(
-                                        self.data_set[_index][can_msg.CANFrame.frame_id]['last'].hex) + ", 引起改变的原因可能是因为之前的下一个事件: " + str([hex(cor) for cor in correlator_changes]))
+                                    self.data_set[_index][can_msg.CANFrame.frame_id]['comm'].append(" 第一次改变, 上一条数据: " + bits.to_hex(
+                                        self.data_set[_index][can_msg.CANFrame.frame_id]['last']) + ", 引起改变的原因可能是因为之前的下一个事件: " + str([hex(cor) for cor in correlator_changes]))
                                 else:
                                     # 相关因子无变化，但是发生改变
                                     self.data_set[_index][can_msg.CANFrame.frame_id]['comm'].append(
-                                        " 第一次改变, 上一条数据: " + str(self.data_set[_index][can_msg.CANFrame.frame_id]['last'].hex))
+                                        " 第一次改变, 上一条数据: " + bits.to_hex(self.data_set[_index][can_msg.CANFrame.frame_id]['last']))
 
                                 #
                                 # 如果当前发生的改变，不在已知范围内
@@ -1873,6 +1894,7 @@ class analyze(CANModule):
                         self._action.set()
                         self._stat_resend = test_frame
                         self._action.clear()
+                        self.notify()
                         while 1:
                             time.sleep(1)
                             if not self._action.is_set():
@@ -1891,19 +1913,18 @@ class analyze(CANModule):
                             buf1 = self.all_frames[-1]['buf'].search_messages_by_id(
                                 idf)
 
-                            buf1x = [bitstring.BitArray(
-                                (b'\x00' * (8 - len(x))) + x) for x in buf1]
+                            buf1x = [bits.from_bytes(x) for x in buf1]
 
                             if idf in self.data_set[self._train_buffer]:
                                 orig_bits = self.data_set[self._train_buffer][idf]['change_bits']
                             else:
-                                orig_bits = bitstring.BitArray(b'\x00' * 8)
+                                orig_bits = 0
                             if idg != idf:
                                 looking_bits = orig_bits ^ self.data_set[self._rep_index][idf]['diff']
                                 self.info(
-                                    "对比位值 (" + hex(idf) + "): " + looking_bits.bin)
+                                    "对比位值 (" + hex(idf) + "): " + bits.to_bin(looking_bits))
                                 last_b = orig_bits
-                                chg_b = bitstring.BitArray(b'\x00' * 8)
+                                chg_b = 0
                                 itr = 0
                                 if len(buf1x) > 1:
                                     for bit in buf1x:
@@ -1911,8 +1932,8 @@ class analyze(CANModule):
                                         last_b = bit
                                         itr += 1
                                         self.info(
-                                            "\n比较位数据 " + bit.bin + " = " + (looking_bits & chg_b).bin)
-                                        if (looking_bits & chg_b).int != 0 and itr > 1:
+                                            "\n比较位数据 " + bits.to_bin(bit) + " = " + bits.to_bin(looking_bits & chg_b))
+                                        if (looking_bits & chg_b) != 0 and itr > 1:
                                             self.info("已匹配")
                                             tmp_w += 1
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from frame.kernel.module import CANModule
+from frame.stream.iostream import TraceMessage
 
 
 class filter(CANModule):
@@ -48,46 +49,48 @@ class filter(CANModule):
         self.describe = filter.help.get('describe', filter.name)
         self._bus = 'filter'
 
+    def _block(self, can_msg, reason):
+        """阻断数据帧。状态栏中显示最后一个被拦截的数据帧，读取状态时才进行格式化。
+
+        :param frame.message.can.CANSploitMessage can_msg: 被拦截的数据帧。
+        :param str reason: 拦截的原因。
+        """
+        can_msg.CANData = False
+        args = (can_msg.CANFrame.frame_id, reason, can_msg.bus)
+        self._status = 0
+        self._error_text = TraceMessage("数据帧 {} 被拦截({}) (BUS = {})", args)
+        self.trace("数据帧 {} 被拦截({}) (BUS = {})", *args)
+
     def do_effect(self, can_msg, args):
         if can_msg.CANData:
             # 当前CANID不在白名单中,将CANData设置为False进行阻断
             if 'white_list' in args and can_msg.CANFrame.frame_id not in args.get('white_list', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(BL) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'BL')
             # 当前CANID在黑名单中，将CANData设置为False进行阻断
             elif 'black_list' in args and can_msg.CANFrame.frame_id in args.get('black_list', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(WL) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'WL')
             # 对CAN数据进行审核，如果不在白名单中则阻断，其值是一个整数列表
-            if 'white_body' in args and can_msg.CANFrame.frame_data not in args.get('white_body', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(WB) (BUS = " + str(
-                    can_msg.bus) + ")")
+            if 'white_body' in args and list(can_msg.CANFrame.frame_data) not in args.get('white_body', []):
+                self._block(can_msg, 'WB')
             # 对CAN数据进行审核，如果在黑名单中则阻断，其值是一个整数列表
-            elif 'black_body' in args and can_msg.CANFrame.frame_data in args.get('black_body', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(BB) (BUS = " + str(
-                    can_msg.bus) + ")")
+            elif 'black_body' in args and list(can_msg.CANFrame.frame_data) in args.get('black_body', []):
+                self._block(can_msg, 'BB')
             # 对CAN数据进行审核，如果不在白名单中则阻断，描述数据使用16进制字符串
             if 'hex_white_body' in args and self.get_hex(can_msg.CANFrame.frame_raw_data) not in args.get('hex_white_body', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(WB) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'WB')
             # 对CAN数据进行审核，如果在黑名单中则阻断，描述数据使用16进制字符串
             elif 'hex_black_body' in args and self.get_hex(can_msg.CANFrame.frame_raw_data) in args.get('hex_black_body', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(BB) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'BB')
             # 如果bus是在黑名单的，则阻断
             if 'black_bus' in args and can_msg.bus.strip() in args.get('black_body', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(BBus) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'BBus')
             # 如果bus是不在白名单的，则阻断
             elif 'white_bus' in args and can_msg.bus.strip() not in args.get('white_bus', []):
-                can_msg.CANData = False
-                self.info("数据帧 " + str(can_msg.CANFrame.frame_id) + " 被拦截(WBus) (BUS = " + str(
-                    can_msg.bus) + ")")
+                self._block(can_msg, 'WBus')
         return can_msg
+
+    def do_effect_batch(self, batch, args):
+        # 过滤器不产生新的数据帧，只对批量中的数据帧逐一过滤
+        for can_msg in batch:
+            self.do_effect(can_msg, args)
+        return batch
@@ -1,6 +1,4 @@
 # -*- coding: utf-8 -*-
-import time
-
 from frame.message.can import CANMessage
 from frame.message.isotp import ISOTPMessage
 from frame.kernel.module import CANModule
@@ -43,6 +41,12 @@ class fuzz(CANModule):
                 "type": "int",
                 "default": 0,
                 "range": []
+            },
+            "pace": {
+                "describe": "发送数据使用的总线令牌桶名称，由引擎参数'pacer'配置，指定后忽略delay。",
+                "type": "str",
+                "default": None,
+                "range": []
             }
         }
     }
@@ -103,11 +107,10 @@ class fuzz(CANModule):
                     # 构造原始的CAN包
                     #
                     messages.append(CANMessage.init_data(
-                        idf, len(x_data), x_data[:8]))
+                        idf, min(8, len(x_data)), x_data[:8]))
         return messages
 
     def do_start(self, args):
-        self._last = time.clock()
         self._queue_messages = []
 
         # 在mode仅可以使用ISOTP
@@ -162,20 +165,15 @@ class fuzz(CANModule):
         if not self._queue_messages:
             self._active = False
             self.do_start(args)
-        elif not can_msg.CANData:
-            d_time = float(args.get('delay', 0))
-            if d_time > 0:
-                if time.clock() - self._last >= d_time:
-                    self._last = time.clock()
-                    can_msg.CANFrame = self._queue_messages.pop()
-                    can_msg.CANData = True
-                    can_msg.bus = self._bus
-                    self._last += 1
-                    self._status = self._last / (self._full / 100.0)
-            else:
-                can_msg.CANFrame = self._queue_messages.pop()
-                can_msg.CANData = True
-                can_msg.bus = self._bus
-                self._last += 1
-                self._status = self._last / (self._full / 100.0)
+        elif not can_msg.CANData and self.tx_ready(args):
+            # 发送速率由令牌桶控制(动作参数'pace'或者'delay')
+            can_msg.CANFrame = self._queue_messages.pop()
+            can_msg.CANData = True
+            can_msg.bus = self._bus
+            self.tx_sent(args, can_msg.CANFrame)
+            self._last += 1
+            self._status = self._last / (self._full / 100.0)
         return can_msg
+
+    def next_due(self, args):
+        return self.tx_due(args)
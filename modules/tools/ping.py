@@ -1,6 +1,4 @@
 # -*- coding: utf-8 -*-
-import time
-
 from frame.message.can import CANMessage
 from frame.message.uds import UDSMessage
 from frame.message.isotp import ISOTPMessage
@@ -47,6 +45,12 @@ class ping(CANModule):
                 "default": 0,
                 "range": []
             },
+            "pace": {
+                "describe": "发送数据使用的总线令牌桶名称，由引擎参数'pacer'配置，指定后忽略delay。",
+                "type": "str",
+                "default": None,
+                "range": []
+            },
             "padding": {
                 "describe": "用于UDS与ISOTP协议做填充数据，一般不使用。",
                 "type": "int",
@@ -115,7 +119,6 @@ class ping(CANModule):
 
     def do_start(self, args):
         self._queue_messages = []
-        self._last = time.clock()
 
         data = [0, 0, 0, 0, 0, 0, 0, 0]
         if 'body' in args:
@@ -138,7 +141,7 @@ class ping(CANModule):
                 self._queue_messages.extend(iso_list)
             elif iso_mode == 0:
                 self._queue_messages.append(
-                    CANMessage.init_data(i, len(data), data[:8]))
+                    CANMessage.init_data(i, min(8, len(data)), data[:8]))
             elif iso_mode == 2:
                 for service in args.get('services', []):
                     uds_m = UDSMessage(shift, padding)
@@ -160,20 +163,20 @@ class ping(CANModule):
         #
         # 此模块的命令，仅有发送数据包的状态，仅在非CAN包的情况下进行调用
         #
-        d_time = float(args.get('delay', 0))
+        # 发送速率由令牌桶控制(动作参数'pace'或者'delay')
         if not can_msg.CANData:
-            if d_time > 0:
-                if time.clock() - self._last >= d_time:
-                    self._last = time.clock()
-                    can_msg.CANFrame = self.do_ping(args)
-                else:
-                    can_msg.CANFrame = None
-            else:
+            if self.tx_ready(args):
                 can_msg.CANFrame = self.do_ping(args)
+            else:
+                can_msg.CANFrame = None
 
             if can_msg.CANFrame and not can_msg.CANData:
                 can_msg.CANData = True
                 can_msg.bus = self._bus
+                self.tx_sent(args, can_msg.CANFrame)
                 self._last += 1
                 self._status = self._last / (self._full / 100.0)
         return can_msg
+
+    def next_due(self, args):
+        return self.tx_due(args)
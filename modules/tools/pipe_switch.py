@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
 
 from frame.kernel.module import CANModule
 
@@ -23,15 +22,34 @@ class pipe_switch(CANModule):
         self.describe = pipe_switch.help.get('describe', pipe_switch.name)
         self._bus = 'pipe_switch'
         self._can_buffer = None
+        self._batch_buffer = []
 
     def do_start(self, params):
         self._can_buffer = None
+        self._batch_buffer = []
+
+    def next_due(self, args):
+        if args.get('action') == 'write' and (self._can_buffer or self._batch_buffer):
+            return 0
+        return None
+
+    def do_effect_batch(self, batch, args):
+        if args.get('action') == 'read':
+            for can_msg in batch:
+                if can_msg.CANData:
+                    self._batch_buffer.append(can_msg.share())
+        elif args.get('action') == 'write':
+            batch.extend(self._batch_buffer)
+            self._batch_buffer = []
+        else:
+            self.error('命令 ' + args['action'] + ' 未实现')
+        return batch
 
     def do_effect(self, can_msg, args):
         if args.get('action') == 'read' and can_msg.CANData:
-            self._can_buffer = copy.deepcopy(can_msg)
+            self._can_buffer = can_msg.share()
         elif args.get('action') == 'write' and self._can_buffer:
-            can_msg = copy.deepcopy(self._can_buffer)
+            can_msg = self._can_buffer
             self._can_buffer = None
         else:
             self.error('命令 ' + args['action'] + ' 未实现')
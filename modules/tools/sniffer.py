@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
-import time
 
+from frame.kernel import clock
 from frame.utils.replay import Replay
+from frame.message.can import CANSploitMessage
 from frame.kernel.module import CANModule, Command
 from frame.stream.cmdres import CmdResult, CMDRES_ERROR, CMDRES_NULL, CMDRES_INT, CMDRES_STR, CMDRES_TAB, CMDRES_OBJ
 
@@ -47,7 +48,7 @@ class sniffer(CANModule):
         self._replay = False
         self._sniff = False
         self.CANList = Replay()     # 使用Replay结构用于保存CAN数据包以及调试信息
-        self.last = time.clock()
+        self.last = clock.now()
         self._last = 0
         self._full = 1
         self._num1 = 0
@@ -81,7 +82,8 @@ class sniffer(CANModule):
     def get_status(self):
         status = "当前状态: " + str(self._active) + "\n嗅探模式: " + str(self._sniff) +\
             "\n回放模式: " + str(self._replay) + "\nCAN数据帧数量: " + str(len(self.CANList)) +\
-            "\n在队列中的数据帧数量: " + str(self._num2 - self._num1)
+            "\n在队列中的数据帧数量: " + str(self._num2 - self._num1) +\
+            "\n数据帧驻留命中率: {:.1%}".format(self.CANList.intern_stats()['hit_rate'])
         return CmdResult(cmdline='status', describe="当前状态", result_type=CMDRES_STR, result=status)
 
     def cmd_load(self, name):
@@ -156,6 +158,28 @@ class sniffer(CANModule):
     def cnt_print(self):
         return CmdResult(cmdline='print', describe="当前缓冲区包总数", result_type=CMDRES_INT, result=len(self.CANList))
 
+    def next_due(self, args):
+        # 回放模式下需要持续运行，按照时间戳回放时在下一个数据帧到期时运行
+        if self._replay:
+            if bool(args.get('ignore_time', False)):
+                return 0
+            return self.CANList.next_due()
+        return None
+
+    def do_effect_batch(self, batch, args):
+        if self._sniff:
+            for can_msg in batch:
+                if can_msg.CANData:
+                    self.CANList.append(can_msg)
+        elif self._replay:
+            # 回放模式下一次最多回放批量上限个数据帧
+            for _ in range(self._batch_size):
+                can_msg = self.do_effect(CANSploitMessage(), args)
+                if not can_msg.CANData:
+                    break
+                batch.append(can_msg)
+        return batch
+
     def do_effect(self, can_msg, args):
         #
         # 在嗅探模式下并且当前包是CAN包则缓存CAN包
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+# 从任意目录运行pytest时都可以导入仓库中的包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame.kernel.clock import get_clock, set_clock  # noqa: E402
+from frame.kernel.module import CANModule  # noqa: E402
+from frame.message.can import CANMessage  # noqa: E402
+
+
+class Recorder(CANModule):
+
+    """
+    测试用的模块，记录每次收到的管道变量。初始化参数`produce`为True时，管道中没有数据则写入一个数据帧。
+    """
+
+    def do_init(self, params):
+        self.calls = []
+        self.produce = params.get('produce', False)
+
+    def do_effect(self, can_msg, args):
+        self.calls.append(can_msg.CANData)
+        if self.produce and not can_msg.CANData:
+            can_msg.CANFrame = CANMessage.init_data(0x100, 1, b'\x01')
+            can_msg.CANData = True
+        return can_msg
+
+
+@pytest.fixture
+def virtual_clock():
+    """测试期间使用虚拟时钟，结束后恢复原来的时钟。"""
+    previous = get_clock()
+    clock = set_clock('virtual')
+    yield clock
+    set_clock(previous)
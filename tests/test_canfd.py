@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from frame.message.can import CANMessage, FD_BRS, FD_ESI, FD_FDF
+from frame.utils.replay import parse_dump_line
+from modules.io.hw_TCP2CAN import _pack_frames, _unpack_frames
+
+TAG = b'ct\x05'
+
+
+def _fields(frame):
+    return frame.frame_id, frame.frame_ext, frame.frame_length, frame.frame_data, frame.frame_flags
+
+
+def test_tcp2can_round_trip():
+    frames = [
+        CANMessage.init_data(0x123, 3, b'\x01\x02\x03'),
+        CANMessage.init_data(0x18da10f1, 64, bytes(range(64)), FD_BRS),
+        CANMessage.init_data(0x7df, 8, bytes(8), FD_FDF),
+        CANMessage.init_data(0x456, 12, bytes(range(12)), FD_BRS | FD_ESI),
+        CANMessage.init_data(0x1fffffff, 8, b'\xff' * 8),
+    ]
+    data = _pack_frames(TAG, frames)
+    # 经典CAN数据帧占用一组，CAN FD数据帧第一组之外的数据按照16字节补齐
+    assert len(data) == 16 * (1 + 5 + 2 + 2 + 1)
+    assert [_fields(frame) for frame in _unpack_frames(TAG, data)] == [_fields(frame) for frame in frames]
+
+
+def test_tcp2can_classic_layout():
+    data = _pack_frames(TAG, [CANMessage.init_data(0x123, 2, b'\xaa\xbb')])
+    assert data == TAG + b'\x00\x00\x01\x23\x02\xaa\xbb' + bytes(6)
+
+
+def test_tcp2can_wrong_tag():
+    data = _pack_frames(TAG, [CANMessage.init_data(0x123, 2, b'\xaa\xbb')])
+    assert _unpack_frames(b'ct\x03', data) is None
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('[0.5]0x123:8:1122334455667788\n', (0.5, 0x123, 8, bytes.fromhex('1122334455667788'), 0)),
+    ('0x123:2:aabb\r\n', (-1.0, 0x123, 2, b'\xaa\xbb', 0)),
+    ('[1.25]0x18da10f1:16:00112233445566778899aabbccddeeff:5\n',
+     (1.25, 0x18da10f1, 16, bytes.fromhex('00112233445566778899aabbccddeeff'), FD_FDF | FD_BRS)),
+    # 只有标志位的短数据帧同样是CAN FD数据帧
+    ('[2.0]0x10:1:ff:4\n', (2.0, 0x10, 1, b'\xff', FD_FDF)),
+    # CAN FD的数据长度向上取整
+    ('[3.0]0x10:10:00112233445566778899:1\n', (3.0, 0x10, 12, bytes.fromhex('00112233445566778899') + bytes(2),
+                                               FD_FDF | FD_BRS)),
+])
+def test_parse_dump_line(line, expected):
+    time_stamp, msg = parse_dump_line(line, 'can0')
+    frame = msg.CANFrame
+    assert (time_stamp, frame.frame_id, frame.frame_length, frame.frame_data, frame.frame_flags) == expected
+    assert msg.CANData and msg.bus == 'can0'
+
+
+def test_parse_dump_line_round_trip():
+    frame = CANMessage.init_data(0x18da10f1, 20, bytes(range(20)), FD_BRS)
+    _, msg = parse_dump_line('[0.0]' + frame.get_text(), 'can0')
+    assert _fields(msg.CANFrame) == _fields(frame)
+
+
+def test_parse_dump_line_invalid():
+    assert parse_dump_line('garbage\n', 'can0') is None
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from frame.kernel.pacer import BusBucket, TokenBucket, TxPacer, MAX_FRAME_BITS, fd_frame_bits, frame_bits
+from frame.message.can import CANMessage, FD_BRS
+
+
+def test_token_bucket_rate(virtual_clock):
+    bucket = TokenBucket(10)
+    assert bucket.ready()
+    bucket.consume()
+    assert bucket.next_due() == pytest.approx(0.1)
+    virtual_clock.advance(0.05)
+    assert not bucket.ready()
+    assert not bucket.try_consume()
+    virtual_clock.advance(0.05)
+    assert bucket.try_consume()
+    assert bucket.next_due() == pytest.approx(0.2)
+
+
+def test_token_bucket_burst(virtual_clock):
+    bucket = TokenBucket(10, burst=3)
+    assert [bucket.try_consume() for _ in range(4)] == [True, True, True, False]
+    assert bucket.next_due() == pytest.approx(0.1)
+    virtual_clock.advance_to(bucket.next_due())
+    assert bucket.try_consume()
+
+
+def test_token_bucket_wait_advances_virtual_clock(virtual_clock):
+    bucket = TokenBucket(4)
+    assert bucket.wait()
+    assert bucket.wait()
+    # 虚拟时钟下等待只推进时间
+    assert virtual_clock.now() == pytest.approx(0.25)
+
+
+def test_token_bucket_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_frame_bits_classic():
+    assert frame_bits(CANMessage.init_data(0x100, 8, bytes(8))) == 135
+    assert frame_bits(CANMessage.init_data(0x100, 0, b'')) == 55
+    assert frame_bits(None) == MAX_FRAME_BITS == 160
+
+
+def test_frame_bits_fd():
+    fd = CANMessage.init_data(0x100, 64, bytes(64))
+    brs = CANMessage.init_data(0x100, 64, bytes(64), FD_BRS)
+    assert frame_bits(fd) == fd_frame_bits(64, False)
+    assert frame_bits(fd) > 4 * MAX_FRAME_BITS
+    # 数据段的位数按照波特率的比值折算
+    assert frame_bits(brs) == frame_bits(fd)
+    assert frame_bits(brs, 0.25) < frame_bits(fd) // 2
+    # 8字节以内的CAN FD数据帧使用17位CRC，同样比经典数据帧长
+    assert frame_bits(CANMessage.init_data(0x100, 8, bytes(8), FD_BRS)) > 135
+
+
+def test_bus_bucket_bits(virtual_clock):
+    bucket = BusBucket(bitrate=500000, load=50)
+    frame = CANMessage.init_data(0x100, 8, bytes(8))
+    assert bucket.cost(frame) == 135
+    bucket.consume(bucket.cost(frame))
+    assert bucket.next_due() == pytest.approx(135 / 250000.0)
+
+
+def test_bus_bucket_fd(virtual_clock):
+    bucket = BusBucket(bitrate=500000, data_bitrate=2000000)
+    frame = CANMessage.init_data(0x100, 64, bytes(64), FD_BRS)
+    assert bucket.cost(frame) == frame_bits(frame, 0.25)
+    # fd为True时突发的容量按照64字节的CAN FD数据帧计算
+    bucket = BusBucket(bitrate=500000, data_bitrate=2000000, burst=2, fd=True)
+    assert [bucket.try_consume(bucket.cost(frame)) for _ in range(3)] == [True, True, False]
+
+
+def test_bus_bucket_per_frame():
+    bucket = BusBucket(rate=100)
+    assert bucket.cost(CANMessage.init_data(0x100, 64, bytes(64))) == 1
+
+
+@pytest.mark.parametrize('params', [{'load': 0}, {'load': 101}, {'bitrate': 500000, 'data_bitrate': 250000}])
+def test_bus_bucket_invalid(params):
+    with pytest.raises(ValueError):
+        BusBucket(**params)
+
+
+def test_tx_pacer():
+    pacer = TxPacer({'can0': {'rate': 100}})
+    assert pacer.bucket('can0').per_frame
+    # 没有配置的总线按照默认参数创建，同一条总线共用一个令牌桶
+    assert pacer.bucket('can1') is pacer.bucket('can1')
+    assert pacer.bucket('can1').bitrate == 500000
+    with pytest.raises(ValueError):
+        pacer.configure({'can2': {'speed': 1}})
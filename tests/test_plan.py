@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from conftest import Recorder
+from frame.kernel.plan import ActionPlan, ActionSchedule
+
+
+def _actions(*specs):
+    # (模块, 管道)的列表转换成引擎的动作列表
+    return [['recorder', module, {'pipe': pipe}] for module, pipe in specs]
+
+
+def test_pipes_are_compiled_to_slots():
+    producer, consumer, other = Recorder({'produce': True}), Recorder({}), Recorder({})
+    plan = ActionPlan(_actions((producer, 1), (other, 2), (consumer, 1)))
+    assert plan.pipe_names == [1, 2]
+    assert [step[4] for step in plan.steps] == [0, 1, 0]
+
+    plan.run()
+    assert consumer.calls == [True]
+    assert other.calls == [False]
+    assert plan.pipes()[1].CANData and not plan.pipes()[2].CANData
+
+
+def test_inactive_module_is_skipped():
+    producer, consumer = Recorder({'produce': True}), Recorder({})
+    plan = ActionPlan(_actions((producer, 1), (consumer, 1)))
+    producer._active = False
+    plan.run()
+    assert producer.calls == []
+    assert consumer.calls == [False]
+
+
+def test_recycle_keeps_empty_messages_and_replaces_used_ones():
+    producer, consumer = Recorder({'produce': True}), Recorder({})
+    plan = ActionPlan(_actions((producer, 1), (consumer, 2)))
+    plan.run()
+    used, empty = plan.slots
+    plan.recycle()
+    # 携带数据的消息可能被模块保存，换成新的消息结构；没有数据的消息原地重置后复用
+    assert plan.slots[0] is not used and used.CANData
+    assert not plan.slots[0].CANData
+    assert plan.slots[1] is empty
+
+
+def test_batch_slots_are_lists():
+    producer = Recorder({'produce': True})
+    plan = ActionPlan(_actions((producer, 1)), batch=True)
+    assert plan.slots == [[]]
+    plan.slots[0].append(None)
+    kept = plan.slots[0]
+    plan.recycle()
+    assert plan.slots == [[]] and plan.slots[0] is not kept
+
+
+def test_schedule_is_bound_at_compile_time():
+    module = Recorder({})
+    plan = ActionPlan(_actions((module, 1)), schedule_of=lambda params: ActionSchedule(every=2))
+    for _ in range(4):
+        plan.run()
+        plan.recycle()
+    assert len(module.calls) == 2
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from frame.message.can import CANMessage, CANSploitMessage, FrameInterner
+from frame.utils.replay import Replay
+
+
+def _message(fid, data, bus='can0'):
+    msg = CANSploitMessage()
+    msg.CANFrame = CANMessage.init_data(fid, len(data), data)
+    msg.CANData = True
+    msg.bus = bus
+    return msg
+
+
+def _ids(replay):
+    return [msg.CANFrame.frame_id for _, msg in replay if msg.CANData]
+
+
+def test_repeated_frames_share_one_message():
+    replay = Replay(FrameInterner())
+    for _ in range(3):
+        replay.append(_message(0x10, b'\x01'))
+    messages = [msg for _, msg in replay if msg.CANData]
+    assert len(replay) == 3
+    assert messages[0] is messages[1] is messages[2]
+
+
+def test_remove_by_id_on_shared_messages():
+    interner = FrameInterner()
+    replay, other = Replay(interner), Replay(interner)
+    for fid in (0x10, 0x20, 0x10, 0x30, 0x10):
+        replay.append(_message(fid, b'\x01'))
+        other.append(_message(fid, b'\x01'))
+    shared = [msg for _, msg in replay if msg.CANData][0]
+
+    replay.remove_by_id(0x10)
+    assert len(replay) == 2
+    assert _ids(replay) == [0x20, 0x30]
+    # 共用的消息结构没有被修改，其他缓冲区不受影响
+    assert shared.CANData
+    assert len(other) == 5 and _ids(other) == [0x10, 0x20, 0x10, 0x30, 0x10]
+
+    # 删除后再次追加相同的数据帧依然可以取出
+    replay.append(_message(0x10, b'\x01'))
+    assert _ids(replay) == [0x20, 0x30, 0x10]
+    assert len(replay) == 3
+
+
+def test_remove_by_id_keeps_times_and_order():
+    replay = Replay(FrameInterner())
+    for index, fid in enumerate((0x10, 0x20, 0x10)):
+        replay.append_time(float(index), _message(fid, bytes((index,))))
+    replay.remove_by_id(0x20)
+    assert [(times, msg.CANData) for times, msg in replay][1:] == [(0.0, True), (1.0, False), (2.0, True)]
+    assert replay.search_messages_by_id(0x10) == [b'\x00', b'\x02']
+    assert replay.search_messages_by_id(0x20) == []
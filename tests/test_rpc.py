@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from frame.kernel.engine import L6Engine
+from frame.kernel.rpc import RPCServer, PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INVALID_PARAMS, \
+    INTERNAL_ERROR
+
+
+@pytest.fixture
+def rpc(tmp_path):
+    engine = L6Engine()
+    engine.load_config_by_json({'name': 'rpc', 'modules': {'tools/filter': {}},
+                                'actions': [{'filter': {'pipe': 1, 'black_list': [0x10]}}]})
+    yield RPCServer(engine, str(tmp_path / 'rpc.sock'))
+    engine.engine_exit()
+
+
+def _call(rpc, method, params=None, req_id=1):
+    request = {'jsonrpc': '2.0', 'id': req_id, 'method': method}
+    if params is not None:
+        request['params'] = params
+    return rpc.dispatch(request)
+
+
+def _code(reply):
+    return reply['error']['code']
+
+
+def test_result(rpc):
+    assert _call(rpc, 'status')['result'] == {'running': False, 'stats': False}
+    reply = _call(rpc, 'call_module', [0, 'status'])
+    assert reply['id'] == 1 and reply['result']['last_error'] >= 0
+    # 模块可以使用名称指定，参数可以是字典
+    assert _call(rpc, 'call_module', {'module': 'filter', 'cmdline': 'status'})['result'] == reply['result']
+
+
+def test_parse_error(rpc):
+    reply = json.loads(rpc.handle_line(b'{"jsonrpc": "2.0", "id": 1,'))
+    assert _code(reply) == PARSE_ERROR and reply['id'] is None
+
+
+@pytest.mark.parametrize('request_', [[], {'id': 1}, {'id': 1, 'method': 5}])
+def test_invalid_request(rpc, request_):
+    assert _code(rpc.dispatch(request_)) == INVALID_REQUEST
+
+
+def test_method_not_found(rpc):
+    assert _code(_call(rpc, 'engine_exit')) == METHOD_NOT_FOUND
+
+
+@pytest.mark.parametrize('method, params', [
+    ('status', [1]),                            # 参数个数不符合方法的签名
+    ('call_module', {'module': 0}),
+    ('call_module', {'module': 0, 'cmd': 'status'}),
+    ('call_module', 'status'),                  # 参数既不是列表也不是字典
+    ('call_module', [5, 'status']),             # 模块不存在
+    ('edit_module', [0, [1]]),                  # 动作参数不是字典
+])
+def test_invalid_params(rpc, method, params):
+    assert _code(_call(rpc, method, params)) == INVALID_PARAMS
+
+
+def test_internal_error(rpc, monkeypatch):
+    def broken():
+        raise TypeError('broken')
+    # 执行中抛出的TypeError是内部错误，不是参数错误
+    monkeypatch.setattr(rpc._engine, 'get_stats', broken)
+    reply = _call(rpc, 'stats')
+    assert _code(reply) == INTERNAL_ERROR and 'broken' in reply['error']['message']
+
+
+def test_notification_and_batch(rpc):
+    assert rpc.dispatch({'jsonrpc': '2.0', 'method': 'status'}) is None
+    assert rpc.handle_line(b'{"jsonrpc": "2.0", "method": "status"}') is None
+    replies = json.loads(rpc.handle_line(json.dumps([
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'status'},
+        {'jsonrpc': '2.0', 'method': 'status'},
+        {'jsonrpc': '2.0', 'id': 2, 'method': 'missing'},
+    ]).encode()))
+    assert [reply['id'] for reply in replies] == [1, 2]
+    assert _code(replies[1]) == METHOD_NOT_FOUND
+
+
+def test_edit_module_restarts(rpc):
+    params = {'pipe': 1, 'black_list': [0x20]}
+    assert 'error' not in _call(rpc, 'edit_module', [0, params])
+    assert _call(rpc, 'actions')['result'][0]['params']['black_list'] == [0x20]
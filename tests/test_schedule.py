@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from frame.kernel.plan import ActionSchedule
+from frame.message.can import CANMessage, CANSploitMessage
+
+
+def _message(data):
+    msg = CANSploitMessage()
+    if data:
+        msg.CANFrame = CANMessage.init_data(0x10, 1, b'\x00')
+        msg.CANData = True
+    return msg
+
+
+def test_parse():
+    assert ActionSchedule.parse(None) is None
+    assert ActionSchedule.parse('on_data').on_data
+    schedule = ActionSchedule.parse({'every': 4, 'period': 20, 'on_data': True})
+    assert (schedule.every, schedule.period, schedule.on_data) == (4, 0.02, True)
+
+
+@pytest.mark.parametrize('spec', ['always', {'every': 2, 'unknown': 1}, [('every', 2)]])
+def test_parse_invalid(spec):
+    with pytest.raises(ValueError):
+        ActionSchedule.parse(spec)
+
+
+def test_every():
+    schedule = ActionSchedule(every=3)
+    assert [schedule.ready(None) for _ in range(6)] == [False, False, True, False, False, True]
+
+
+def test_on_data():
+    schedule = ActionSchedule(on_data=True)
+    assert not schedule.ready(None)
+    assert not schedule.ready([])
+    assert not schedule.ready(_message(False))
+    assert schedule.ready(_message(True))
+    assert schedule.ready([_message(True)])
+
+
+def test_period(virtual_clock):
+    schedule = ActionSchedule(period=100)
+    assert schedule.ready(None)
+    virtual_clock.advance(0.05)
+    assert not schedule.ready(None)
+    virtual_clock.advance(0.05)
+    assert schedule.ready(None)
+
+
+def test_next_due(virtual_clock):
+    assert ActionSchedule(on_data=True).next_due(1.0) is None
+    schedule = ActionSchedule(period=100)
+    schedule.ready(None)
+    # 模块更早到期时按照调度策略的周期推迟
+    assert schedule.next_due(0.0) == pytest.approx(0.1)
+    assert schedule.next_due(0.5) == 0.5
+    assert ActionSchedule(every=2).next_due(None) is None
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import threading
+import multiprocessing
+
+import pytest
+
+from frame.kernel.shmring import FrameRing, RingPipe
+from frame.message.can import CANMessage, CANSploitMessage, FD_BRS, FD_FDF
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(capacity=4)
+    yield ring
+    ring.close()
+
+
+def _pipes(ring, batch=0, policy='block'):
+    # 同一个进程中的生产者与消费者，共用门铃、锁与空间事件
+    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+    lock, space = multiprocessing.Lock(), multiprocessing.Event()
+    return (RingPipe('p', ring, send_end, lock, space, batch, policy),
+            RingPipe('p', ring, recv_end, lock, space, batch, policy))
+
+
+def _message(fid, data, flags=0, bus='can0'):
+    msg = CANSploitMessage()
+    msg.CANFrame = CANMessage.init_data(fid, len(data), data, flags)
+    msg.CANData = True
+    msg.bus = bus
+    return msg
+
+
+def test_push_pop(ring):
+    assert ring.pop() is None
+    assert ring.push(0x123, 3, b'\x01\x02\x03', False, 'can0', 1.5)
+    assert ring.push(0x18da10f1, 64, bytes(range(64)), True, 'can1', 2.5, FD_FDF | FD_BRS)
+    assert len(ring) == 2
+    assert ring.pop() == (1.5, 0x123, 3, b'\x01\x02\x03', False, 'can0', 0)
+    assert ring.pop() == (2.5, 0x18da10f1, 64, bytes(range(64)), True, 'can1', FD_FDF | FD_BRS)
+    assert ring.pop() is None
+
+
+def test_push_full_and_wrap(ring):
+    for index in range(4):
+        assert ring.push(index, 1, bytes((index,)), False, 'can0')
+    assert not ring.push(4, 1, b'\x04', False, 'can0')
+    for index in range(10):
+        assert ring.pop()[1] == index
+        assert ring.push(index + 4, 1, b'\x00', False, 'can0')
+
+
+def test_attach_by_name(ring):
+    other = FrameRing(ring.name)
+    try:
+        assert other.capacity == ring.capacity
+        ring.push(0x10, 1, b'\xff', False, 'can0')
+        assert other.pop()[1] == 0x10
+    finally:
+        other.close()
+
+
+def test_ring_pipe_keeps_flags_and_stamp(ring):
+    producer, consumer = _pipes(ring)
+    stop_e = threading.Event()
+    stamped = _message(0x10, bytes(8), FD_BRS)
+    stamped.stamp = 12.5
+    assert producer.put(stamped, stop_e)
+    assert producer.put(CANSploitMessage(), stop_e)    # 没有数据的消息不会写入
+    assert producer.put(_message(0x11, b'\x01'), stop_e)
+
+    first, second = consumer.get(), consumer.get()
+    assert consumer.get() is None
+    assert first.CANFrame.frame_id == 0x10 and first.CANFrame.frame_data == bytes(8)
+    assert first.CANFrame.frame_flags == FD_FDF | FD_BRS
+    assert first.stamp == 12.5 and first.bus == 'can0'
+    assert not second.CANFrame.frame_fd and second.stamp > 0
+
+
+def test_ring_pipe_drop(ring):
+    producer, consumer = _pipes(ring, batch=8, policy='drop')
+    assert not producer.put([_message(index, b'\x00') for index in range(6)], threading.Event())
+    assert producer.dropped == 2
+    assert [msg.CANFrame.frame_id for msg in consumer.get()] == [0, 1, 2, 3]
+
+
+def test_ring_pipe_block_waits_for_space(ring):
+    producer, consumer = _pipes(ring)
+    stop_e = threading.Event()
+    count = 200
+    thread = threading.Thread(target=lambda: [producer.put(_message(index, b'\x00'), stop_e)
+                                              for index in range(count)])
+    thread.start()
+    received = []
+    while len(received) < count:
+        msg = consumer.get()
+        if msg is None:
+            stop_e.wait(0.0005)
+            continue
+        received.append(msg.CANFrame.frame_id)
+    thread.join(5)
+    assert received == list(range(count))
+
+
+def test_ring_pipe_block_stops(ring):
+    producer, consumer = _pipes(ring)
+    stop_e = threading.Event()
+    for index in range(4):
+        producer.put(_message(index, b'\x00'), stop_e)
+    stop_e.set()
+    assert not producer.put(_message(4, b'\x00'), stop_e)
+
+
+def test_ring_pipe_invalid_policy(ring):
+    with pytest.raises(ValueError):
+        _pipes(ring, policy='spin')